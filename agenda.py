@@ -0,0 +1,133 @@
+import datetime
+import heapq
+
+EPOCH = datetime.datetime(1970, 1, 1)
+
+
+def sessionEntry(sess):
+    """Return the agenda entry [start, end, websafeSessionKey, name] of sess.
+
+    Start and end are given in minutes since the epoch, both are None if the
+    session has no date or start time.
+    """
+    start = end = None
+    if sess.date and sess.startTime:
+        begin = datetime.datetime.combine(sess.date, sess.startTime)
+        start = int((begin - EPOCH).total_seconds()) // 60
+        end = start + (sess.duration or 0)
+    return [start, end, sess.key.urlsafe(), sess.name]
+
+
+def sortKey(entry):
+    """Order by start, then end (i.e. duration); unscheduled ones last."""
+    return (entry[0] is None, entry[0], entry[1])
+
+
+def _bisectLeft(entries, key):
+    """Return the index of the first of sorted entries whose sort key isn't
+    less than key, comparing only the keys of O(log n) entries."""
+    lo, hi = 0, len(entries)
+    while lo < hi:
+        mid = (lo + hi) // 2
+        if sortKey(entries[mid]) < key:
+            lo = mid + 1
+        else:
+            hi = mid
+    return lo
+
+
+def _bisectRight(entries, key):
+    """Return the index of the first of sorted entries whose sort key is
+    greater than key, comparing only the keys of O(log n) entries."""
+    lo, hi = 0, len(entries)
+    while lo < hi:
+        mid = (lo + hi) // 2
+        if key < sortKey(entries[mid]):
+            hi = mid
+        else:
+            lo = mid + 1
+    return lo
+
+
+def _firstStarting(entries, start):
+    """Return the index of the first of sorted entries starting at or after
+    start; unscheduled ones count as starting last."""
+    # A key of start alone sorts before those of all entries starting then.
+    return _bisectLeft(entries, (False, start))
+
+
+def maxDuration(entries):
+    """Return the longest duration of the scheduled entries, or 0."""
+    return max([e[1] - e[0] for e in entries if e[0] is not None] or [0])
+
+
+def findConflicts(entries):
+    """Return all pairs of overlapping entries.
+
+    Sweeps over the entries by start time, keeping the ones still running in
+    a heap ordered by their end; O(n log n) plus the number of conflicts.
+    """
+    scheduled = sorted((e for e in entries if e[0] is not None), key=sortKey)
+    conflicts = []
+    running = []
+
+    for i, entry in enumerate(scheduled):
+        # Sessions ending before this one starts can't overlap anymore.
+        while running and running[0][0] <= entry[0]:
+            heapq.heappop(running)
+
+        conflicts.extend((other, entry) for _, _, other in running)
+        heapq.heappush(running, (entry[1], i, entry))
+
+    return conflicts
+
+
+def maxNonConflicting(entries):
+    """Return a largest subset of entries without overlaps.
+
+    Greedily picks the session ending first (interval scheduling).
+    """
+    scheduled = sorted((e for e in entries if e[0] is not None),
+                       key=lambda e: (e[1], e[0]))
+    chosen = []
+    last_end = None
+
+    for entry in scheduled:
+        if last_end is None or entry[0] >= last_end:
+            chosen.append(entry)
+            last_end = entry[1]
+
+    return chosen
+
+
+def conflictsWith(agenda, entry, max_duration):
+    """Return the entries of a sorted agenda overlapping entry.
+
+    No entry of the agenda runs longer than max_duration, so only the
+    entries starting in [start - max_duration, end) of entry are looked at,
+    found by binary search.
+    """
+    if entry[0] is None:
+        return []
+
+    lo = _firstStarting(agenda, entry[0] - max_duration)
+    hi = _firstStarting(agenda, entry[1])
+    return [other for other in agenda[lo:hi] if other[1] > entry[0]]
+
+
+def insertEntry(agenda, entry):
+    """Insert entry into agenda, keeping it sorted; its position is found
+    by binary search."""
+    agenda.insert(_bisectRight(agenda, sortKey(entry)), entry)
+
+
+def inWindow(timeline, start, end, max_duration):
+    """Return the entries of a sorted timeline of scheduled sessions running
+    at some point in [start, end), or starting at start.
+
+    No session runs longer than max_duration, so only the entries starting
+    in [start - max_duration, end) are looked at, found by binary search.
+    """
+    lo = _firstStarting(timeline, start - max_duration)
+    hi = _firstStarting(timeline, end)
+    return [e for e in timeline[lo:hi] if e[1] > start or e[0] >= start]
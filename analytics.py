@@ -0,0 +1,112 @@
+import datetime
+import time
+
+from google.appengine.datastore.datastore_query import Cursor
+from google.appengine.ext import ndb
+
+from models import AttendanceJob
+from models import ConferenceStats
+from models import Profile
+from models import TeeShirtSize
+
+from settings import ATTENDANCE_BATCH_SIZE
+from settings import ATTENDANCE_BATCHES_PER_TASK
+from settings import ATTENDANCE_JOB_TIMEOUT
+
+from tasks import StepChain
+
+JOB_KEY = ndb.Key(AttendanceJob, 'attendance')
+TASK_URL = '/tasks/aggregate_attendance'
+STEPS = StepChain(TASK_URL)
+
+# Position of every t-shirt size in the compact histograms of the job.
+SIZES = [name for name, _ in sorted(TeeShirtSize.to_dict().items(),
+                                    key=lambda item: item[1])]
+SIZE_INDEX = {name: i for i, name in enumerate(SIZES)}
+
+
+@ndb.transactional()
+def _createJob():
+    """Create a new job unless one is running; return it or None.
+
+    A job without progress for ATTENDANCE_JOB_TIMEOUT seconds is replaced.
+    """
+    job = JOB_KEY.get()
+    timeout = datetime.timedelta(seconds=ATTENDANCE_JOB_TIMEOUT)
+    if job and job.updated > datetime.datetime.utcnow() - timeout:
+        return None
+    job = AttendanceJob(key=JOB_KEY, run=str(int(time.time())), step=0,
+                        counts={})
+    job.put()
+    return job
+
+
+def startAggregation():
+    """Start aggregating attendance; return False if already running."""
+    job = _createJob()
+    if not job:
+        return False
+    STEPS.enqueue({'run': job.run}, 0)
+    return True
+
+
+def _addProfiles(counts, profiles):
+    """Count profiles into counts, mapping websafeConferenceKey to
+    [attendees, histogram of t-shirt sizes]."""
+    for prof in profiles:
+        size = SIZE_INDEX.get(prof.teeShirtSize, 0)
+        for wsck in set(prof.conferenceKeysToAttend):
+            entry = counts.get(wsck)
+            if entry is None:
+                entry = counts[wsck] = [0, [0] * len(SIZES)]
+            entry[0] += 1
+            entry[1][size] += 1
+
+
+def _storeStats(counts):
+    """Replace all ConferenceStats with counts."""
+    stats = [ConferenceStats(
+        id=wsck, attendees=attendees,
+        teeShirtSizes={SIZES[i]: n for i, n in enumerate(sizes) if n})
+        for wsck, (attendees, sizes) in counts.items()]
+    for i in range(0, len(stats), ATTENDANCE_BATCH_SIZE):
+        ndb.put_multi(stats[i:i + ATTENDANCE_BATCH_SIZE])
+
+    # Conferences which have lost all their attendees since the last run.
+    ndb.delete_multi([key for key in ConferenceStats.query().iter(
+                      keys_only=True) if key.id() not in counts])
+
+
+def runStep(run, step):
+    """Process the next few batches of profiles of a running job.
+
+    Progress (cursor & partial counts) is checkpointed after every step,
+    so a failed step is simply retried from the last checkpoint. Memory is
+    bounded by the number of conferences, not profiles.
+    """
+    job = JOB_KEY.get()
+    if not job or job.run != run:
+        return
+    if STEPS.resume({'run': run}, step, job.step):
+        return
+
+    cursor = Cursor(urlsafe=job.cursor) if job.cursor else None
+    counts = job.counts
+    more = True
+    for _ in range(ATTENDANCE_BATCHES_PER_TASK):
+        profiles, cursor, more = Profile.query().fetch_page(
+            ATTENDANCE_BATCH_SIZE, start_cursor=cursor)
+        _addProfiles(counts, profiles)
+        if not more:
+            break
+
+    if not more or not cursor:
+        _storeStats(counts)
+        JOB_KEY.delete()
+        return
+
+    job.cursor = cursor.urlsafe()
+    job.counts = counts
+    job.step = step + 1
+    job.put()
+    STEPS.enqueue({'run': run}, job.step)
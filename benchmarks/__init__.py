@@ -0,0 +1,15 @@
+"""Benchmarks of the in-memory parts of the app. Run them from the root of
+the repository, e.g.
+
+    python -m benchmarks.recommendations
+
+with the App Engine SDK in $APPENGINE_SDK (default
+/usr/local/google_appengine).
+"""
+import os
+import sys
+
+sys.path.insert(0, os.environ.get('APPENGINE_SDK',
+                                  '/usr/local/google_appengine'))
+import dev_appserver  # noqa: E402
+dev_appserver.fix_sys_path()
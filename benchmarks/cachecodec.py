@@ -0,0 +1,105 @@
+"""Time encoding & decoding of cached values by cachecodec against protojson
+(messages) and pickle (plain values), and a set & get through the memcache
+stub, on synthetic sessions and a speaker roster.
+
+    python -m benchmarks.cachecodec [--repeat N]
+"""
+from __future__ import absolute_import
+
+import argparse
+import cPickle
+import random
+import timeit
+
+from protorpc import protojson
+
+from google.appengine.ext import testbed
+
+import cachecodec
+
+from models import SessionForm
+from models import SessionForms
+
+WORDS = ['python', 'cloud', 'data', 'scaling', 'web', 'mobile', 'security',
+         'ml', 'design', 'ops']
+KEY_CHARS = ('abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ'
+             '0123456789')
+
+
+def websafeKey(rnd):
+    return 'ag' + ''.join(rnd.choice(KEY_CHARS) for _ in range(70))
+
+
+def sessionForms(rnd, n):
+    """Return SessionForms of n sessions with realistic field sizes."""
+    return SessionForms(items=[SessionForm(
+        name=' '.join(rnd.choice(WORDS) for _ in range(4)),
+        highlights=[rnd.choice(WORDS) for _ in range(3)],
+        speakers=[websafeKey(rnd) for _ in range(2)],
+        typeOfSession='talk',
+        date='2026-05-%02d' % rnd.randint(1, 28),
+        startTime='%02d:00' % rnd.randint(8, 18),
+        duration=rnd.choice([30, 45, 60]),
+        websafeKey=websafeKey(rnd)) for _ in range(n)])
+
+
+def roster(rnd, n):
+    """Return a speaker roster {websafeKey: [name, session count]}."""
+    return {websafeKey(rnd): [' '.join(rnd.choice(WORDS) for _ in range(2)),
+                              rnd.randint(1, 9)] for _ in range(n)}
+
+
+def best(func, number, repeat):
+    """Return the best time of func over repeat runs, in milliseconds."""
+    seconds = min(timeit.repeat(func, number=number, repeat=repeat))
+    return seconds / number * 1e3
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    bed = testbed.Testbed()
+    bed.activate()
+    bed.init_memcache_stub()
+
+    rnd = random.Random(1)
+    cases = [('SessionForms x100', sessionForms(rnd, 100), SessionForms, 200),
+             ('SessionForms x2000', sessionForms(rnd, 2000), SessionForms, 10),
+             ('SessionForms x20000', sessionForms(rnd, 20000), SessionForms,
+              1),
+             ('roster dict x2000', roster(rnd, 2000), None, 50)]
+    for label, value, message_type, number in cases:
+        if message_type:
+            name, data = 'protojson', protojson.encode_message(value)
+            encode = lambda: protojson.encode_message(value)
+            decode = lambda: protojson.decode_message(message_type, data)
+        else:
+            name, data = 'pickle', cPickle.dumps(value, 2)
+            encode = lambda: cPickle.dumps(value, 2)
+            decode = lambda: cPickle.loads(data)
+        print('%-20s %-10s %9d B  enc %7.2f ms  dec %7.2f ms' % (
+            label, name, len(data), best(encode, number, args.repeat),
+            best(decode, number, args.repeat)))
+
+        data = cachecodec.encode(value)
+        print('%-20s %-10s %9d B  enc %7.2f ms  dec %7.2f ms' % (
+            label, 'cachecodec', len(data),
+            best(lambda: cachecodec.encode(value), number, args.repeat),
+            best(lambda: cachecodec.decode(data, message_type), number,
+                 args.repeat)))
+
+        def roundTrip():
+            cachecodec.set('benchmark', value)
+            return cachecodec.get('benchmark', message_type)
+        assert roundTrip() == value
+        print('%-20s %-10s %9d chunk(s)  %7.2f ms' % (
+            label, 'set+get', -(-len(data) // cachecodec.CACHE_CHUNK_SIZE),
+            best(roundTrip, number, args.repeat)))
+
+    bed.deactivate()
+
+
+if __name__ == '__main__':
+    main()
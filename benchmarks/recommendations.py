@@ -0,0 +1,116 @@
+"""Time the in-memory part of the recommendations job on synthetic
+wishlists: counting the pairs of every partition and picking the top
+neighbours of its sessions, either from all profiles at once or by merging
+the counts of slices of them, as the job does.
+
+    python -m benchmarks.recommendations [--profiles N] [--sessions N]
+"""
+from __future__ import absolute_import
+
+import argparse
+import json
+import time
+import zlib
+
+import numpy as np
+
+import recommendations
+
+from settings import RECOMMENDATION_BATCH_SIZE
+from settings import RECOMMENDATION_MAX_PAIRS
+from settings import RECOMMENDATION_PARTITIONS
+from settings import RECOMMENDATION_SLICE_SIZE
+from settings import RECOMMENDATION_TOP_K
+
+
+def wishlists(profiles, sessions, max_length, seed=0):
+    """Return wishlists of 1 to max_length sessions, drawn from a Zipf-like
+    distribution, as websafeSessionKey-like strings."""
+    weights = 1.0 / np.arange(1, sessions + 1) ** 0.8
+    weights /= weights.sum()
+    rnd = np.random.RandomState(seed)
+    # As long as actual websafeSessionKeys, for the size of stored counts.
+    return [set(('s%d' % i).ljust(70, '-')
+                for i in rnd.choice(sessions, n, p=weights))
+            for n in rnd.randint(1, max_length + 1, profiles)]
+
+
+def run(baskets, partitions):
+    """Build the top neighbours of all partitions; return the time taken
+    and the largest number of pairs counted for a partition."""
+    started = time.time()
+    largest = 0
+    for part in range(partitions):
+        cooc = recommendations.CoOccurrence(
+            owns=lambda item: recommendations.partition(
+                item, partitions) == part,
+            max_pairs=RECOMMENDATION_MAX_PAIRS)
+        for i in range(0, len(baskets), RECOMMENDATION_BATCH_SIZE):
+            cooc.addBatch(baskets[i:i + RECOMMENDATION_BATCH_SIZE])
+        cooc.topK(RECOMMENDATION_TOP_K)
+        largest = max(largest, len(cooc.codes))
+    return time.time() - started, largest
+
+
+def storedSize(items, *arrays):
+    """Return the compressed size of counts stored as RecommendationCounts."""
+    return len(zlib.compress(json.dumps(items))) + sum(
+        len(zlib.compress(recommendations._pack(a))) for a in arrays)
+
+
+def runSlices(baskets, partitions, slice_size):
+    """Count the pairs of slices of the baskets, then merge the counts of
+    every partition; return the time taken and the largest stored counts of
+    a slice, in bytes."""
+    started = time.time()
+    stored = []
+    for i in range(0, len(baskets), slice_size):
+        cooc = recommendations.CoOccurrence(
+            max_pairs=RECOMMENDATION_MAX_PAIRS)
+        for j in range(i, min(i + slice_size, len(baskets)),
+                       RECOMMENDATION_BATCH_SIZE):
+            cooc.addBatch(baskets[j:min(j + RECOMMENDATION_BATCH_SIZE,
+                                        i + slice_size)])
+        popularity = cooc.popularityCounts()
+        parts = np.array([recommendations.partition(item, partitions)
+                          for item in cooc.items], dtype=np.int64)
+        pairs = [cooc.pairCounts(parts == part)
+                 for part in range(partitions)]
+        stored.append((popularity, pairs))
+
+    for part in range(partitions):
+        cooc = recommendations.CoOccurrence()
+        for popularity, pairs in stored:
+            cooc.addPopularity(*popularity)
+            cooc.addPairCounts(*pairs[part])
+        cooc.topK(RECOMMENDATION_TOP_K)
+    seconds = time.time() - started
+
+    largest = max(max([storedSize(*popularity)] +
+                      [storedSize(*p) for p in pairs])
+                  for popularity, pairs in stored)
+    return seconds, largest
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--profiles', type=int, default=100000)
+    parser.add_argument('--sessions', type=int, default=5000)
+    parser.add_argument('--max-length', type=int, default=30)
+    args = parser.parse_args()
+
+    baskets = wishlists(args.profiles, args.sessions, args.max_length)
+    print('%d profiles, %d sessions, 1 to %d saved sessions per profile' % (
+        args.profiles, args.sessions, args.max_length))
+    for partitions in sorted(set([1, RECOMMENDATION_PARTITIONS])):
+        seconds, pairs = run(baskets, partitions)
+        print('%2d partition(s): %6.1fs, at most %d pairs in memory' % (
+            partitions, seconds, pairs))
+    seconds, size = runSlices(baskets, RECOMMENDATION_PARTITIONS,
+                              RECOMMENDATION_SLICE_SIZE)
+    print('%d-profile slices: %6.1fs, at most %d KB stored per entity' % (
+        RECOMMENDATION_SLICE_SIZE, seconds, size // 1024))
+
+
+if __name__ == '__main__':
+    main()
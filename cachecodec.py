@@ -0,0 +1,227 @@
+import logging
+import marshal
+import random
+import zlib
+
+from protorpc import messages
+
+from google.appengine.api import memcache
+
+from settings import CACHE_CAS_RETRIES
+from settings import CACHE_CHUNK_EXPIRY
+from settings import CACHE_CHUNK_SIZE
+from settings import CACHE_COMPRESS_THRESHOLD
+
+# First byte of an encoded value: ProtoRPC message or plain value (lists,
+# dicts, strings, numbers); upper case if the rest is compressed. Both are
+# stored in marshal format.
+MESSAGE = 'm'
+VALUE = 'v'
+# Stored instead of a value spread over several keys.
+CHUNKED = 'c'
+
+# Message class -> {field number: (name, repeated, type, is message)}.
+_fields = {}
+
+
+def _messageFields(cls):
+    fields = _fields.get(cls)
+    if fields is None:
+        fields = _fields[cls] = {
+            f.number: (f.name, f.repeated,
+                       f.type if isinstance(f, (messages.MessageField,
+                                                messages.EnumField)) else None,
+                       isinstance(f, messages.MessageField))
+            for f in cls.all_fields()}
+    return fields
+
+
+def _messageToList(msg):
+    """Return the assigned fields of msg as [number, value, ...], nested
+    messages as lists and enums as their numbers.
+
+    Unlike protojson, no field names are stored, and unlike the protobuf
+    encoder of ProtoRPC (which is pure Python), the list is serialized by
+    marshal, which is implemented in C.
+    """
+    values = []
+    for number, (name, repeated, typ, is_msg) in (
+            _messageFields(type(msg)).iteritems()):
+        value = msg.get_assigned_value(name)
+        if value is None:
+            continue
+        if typ is None:
+            if repeated:
+                value = list(value)
+        elif is_msg:
+            value = ([_messageToList(m) for m in value] if repeated
+                     else _messageToList(value))
+        else:
+            value = [e.number for e in value] if repeated else value.number
+        values.extend((number, value))
+    return values
+
+
+def _listToMessage(cls, values):
+    """Return the message of class cls encoded by _messageToList(); fields
+    unknown to cls are skipped."""
+    fields = _messageFields(cls)
+    kwargs = {}
+    for i in range(0, len(values), 2):
+        field = fields.get(values[i])
+        if field is None:
+            continue
+        name, repeated, typ, is_msg = field
+        value = values[i + 1]
+        if typ is not None:
+            if is_msg:
+                value = ([_listToMessage(typ, v) for v in value] if repeated
+                         else _listToMessage(typ, value))
+            else:
+                value = [typ(n) for n in value] if repeated else typ(value)
+        kwargs[name] = value
+    return cls(**kwargs)
+
+
+def encode(value):
+    """Encode a ProtoRPC message or plain value as a compact string,
+    compressed if it is larger than CACHE_COMPRESS_THRESHOLD bytes."""
+    if isinstance(value, messages.Message):
+        kind, payload = MESSAGE, marshal.dumps(_messageToList(value))
+    else:
+        kind, payload = VALUE, marshal.dumps(value)
+
+    if len(payload) > CACHE_COMPRESS_THRESHOLD:
+        compressed = zlib.compress(payload, 1)
+        if len(compressed) < len(payload):
+            kind, payload = kind.upper(), compressed
+    return kind + payload
+
+
+def decode(data, message_type=None):
+    """Decode a string returned by encode(); message_type is the class of
+    an encoded ProtoRPC message."""
+    kind, payload = data[0], data[1:]
+    if kind.isupper():
+        payload = zlib.decompress(payload)
+    if kind.lower() == MESSAGE:
+        return _listToMessage(message_type, marshal.loads(payload))
+    return marshal.loads(payload)
+
+
+def _chunkKeys(key, count, token):
+    return ['%s|%s|%d' % (key, token, i) for i in range(count)]
+
+
+def _store(store, key, value, time):
+    """Store value with store (memcache.set or add); return whether it has
+    been stored."""
+    data = encode(value)
+    if len(data) <= CACHE_CHUNK_SIZE:
+        return store(key, data, time=time)
+
+    time = min(time or CACHE_CHUNK_EXPIRY, CACHE_CHUNK_EXPIRY)
+    count = -(-len(data) // CACHE_CHUNK_SIZE)
+    token = '%08x' % random.getrandbits(32)
+    keys = _chunkKeys(key, count, token)
+    if memcache.set_multi(
+            {k: data[i * CACHE_CHUNK_SIZE:(i + 1) * CACHE_CHUNK_SIZE]
+             for i, k in enumerate(keys)}, time=time):
+        return False
+    if store(key, CHUNKED + marshal.dumps((count, token)), time=time):
+        return True
+    memcache.delete_multi(keys)
+    return False
+
+
+def set(key, value, time=0):
+    """Store value in memcache; return False if it could not be stored.
+
+    Values larger than CACHE_CHUNK_SIZE are split over several keys, which
+    key refers to, and expire after at most CACHE_CHUNK_EXPIRY seconds. The
+    chunk keys are unique to every write, so a reader never mixes chunks of
+    different values.
+    """
+    return _store(memcache.set, key, value, time)
+
+
+def add(key, value, time=0):
+    """Store value in memcache unless key is present, or locked by
+    delete(); return whether it has been stored."""
+    return _store(memcache.add, key, value, time)
+
+
+def get(key, message_type=None):
+    """Return the value stored by set(), None on a miss.
+
+    Chunks are fetched with one get_multi; if any of them has been evicted,
+    the value is missing.
+    """
+    return _load(key, memcache.get(key), message_type)
+
+
+def _load(key, data, message_type=None):
+    """Return the value of data stored at key, None if it is missing."""
+    if not isinstance(data, str) or not data:
+        return None
+
+    try:
+        if data[0] == CHUNKED:
+            keys = _chunkKeys(key, *marshal.loads(data[1:]))
+            chunks = memcache.get_multi(keys)
+            if len(chunks) < len(keys):
+                return None
+            data = ''.join(chunks[k] for k in keys)
+        return decode(data, message_type)
+    except Exception:
+        # Entries written in another format are treated as misses.
+        logging.warning('Undecodable cache entry %s', key)
+        return None
+
+
+def update(key, func, time=0):
+    """Replace the value at key by func(value) using compare-and-set; return
+    whether it has been replaced. A missing value isn't; a value which is
+    still changed concurrently after CACHE_CAS_RETRIES attempts is deleted,
+    so that it is read again rather than left behind."""
+    client = memcache.Client()
+    for _ in range(CACHE_CAS_RETRIES):
+        value = _load(key, client.gets(key))
+        if value is None:
+            return False
+        if _store(lambda k, data, time: client.cas(k, data, time=time),
+                  key, func(value), time):
+            return True
+    delete(key)
+    return False
+
+
+def delete(key, seconds=0):
+    """Delete a value and its chunks, if any; for seconds, add() doesn't
+    store it again."""
+    data = memcache.get(key)
+    if isinstance(data, str) and data[:1] == CHUNKED:
+        try:
+            memcache.delete_multi(_chunkKeys(key, *marshal.loads(data[1:])))
+        except Exception:
+            logging.warning('Undecodable cache entry %s', key)
+    return memcache.delete(key, seconds=seconds)
+
+
+def getVersion(key):
+    """Return the version counter at key, None if memcache is unavailable.
+
+    An evicted version starts over at a random value, so that it doesn't
+    come back as one that has been seen before.
+    """
+    version = memcache.get(key)
+    if version is None:
+        memcache.add(key, random.getrandbits(32))
+        version = memcache.get(key)
+    return version
+
+
+def bumpVersion(key):
+    """Increment the version counter at key, starting it at a random value
+    if it is missing; never fails."""
+    memcache.incr(key, initial_value=random.getrandbits(32))
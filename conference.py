@@ -1,28 +1,64 @@
 import datetime
 import endpoints
+import hashlib
+import importlib
 
 from protorpc import remote
 from protorpc import message_types
+from protorpc import messages
 
 from google.appengine.api import memcache
 from google.appengine.api import taskqueue
+from google.appengine.datastore.datastore_query import Cursor
 from google.appengine.ext import ndb
 
+import models
+from models import Announcement
 from models import ConflictException
 from models import Profile
 from models import ProfileMiniForm
 from models import ProfileForm
 from models import StringMessage
+from models import AnnouncementForm
 from models import MultiStringMessage
 from models import BooleanMessage
 from models import Session
 from models import SessionForm
 from models import SessionForms
+from models import SessionConflictForm
+from models import AgendaForm
+from models import WishlistForm
+from models import SessionRecommendations
+from models import RecommendationForm
+from models import RecommendationForms
 from models import Conference
 from models import ConferenceForm
 from models import ConferenceForms
 from models import ConferenceQueryForms
+from models import Registration
+from models import RegistrationForm
+from models import AttendeeForm
+from models import AttendeeForms
+from models import WaitlistEntry
+from models import WaitlistCounter
+from models import WaitlistForm
+from models import ConferenceStats
+from models import ConferenceStatsForm
+from models import TeeShirtCountForm
+from models import FacetValueForm
+from models import FacetForm
+from models import FacetForms
+from models import SearchResultForm
+from models import SearchResultForms
 from models import Speaker
+from models import SpeakerSession
+from models import SpeakerRoster
+from models import SessionTimeline
+from models import RosterEntryForm
+from models import SpeakerRosterForms
+from models import SpeakerProfileForm
+from models import SpeakerSuggestionForms
+from models import ConferenceCountForm
 from models import TeeShirtSize
 
 from settings import WEB_CLIENT_ID
@@ -32,17 +68,52 @@ from settings import ANDROID_AUDIENCE
 from settings import EMAIL_SCOPE
 from settings import API_EXPLORER_CLIENT_ID
 from settings import MEMCACHE_ANNOUNCEMENTS_KEY
+from settings import MEMCACHE_ROSTER_KEY
+from settings import ROSTER_EXPIRY
+from settings import ROSTER_LOCK
+from settings import MEMCACHE_FEATURED_KEY
+from settings import MEMCACHE_ETAG_KEY
+from settings import MEMCACHE_UPCOMING_KEY
+from settings import UPCOMING_EXPIRY
+from settings import MEMCACHE_WINDOW_KEY
+from settings import WINDOW_EXPIRY
+from settings import MAX_WINDOW_MINUTES
 from settings import ANNOUNCEMENT_TPL
+from settings import ANNOUNCEMENT_SEATS_THRESHOLD
+from settings import ANNOUNCEMENT_RECONCILE_BATCH
 from settings import DEFAULTS
 from settings import OPERATORS
 from settings import FIELDS
+from settings import FACET_FIELDS
+from settings import MAX_PAGE_SIZE
+from settings import MAX_SUGGESTIONS
+from settings import SEARCH_KINDS
+from settings import SEARCH_MAX_RESULTS
+from settings import WAITLIST_PROMOTE_ROUNDS
+from settings import WAITLIST_RETRY_DELAY
 
 from requests import CONF_GET_REQUEST
 from requests import CONF_POST_REQUEST
+from requests import CONF_ETAG_GET_REQUEST
+from requests import ETAG_GET_REQUEST
+from requests import ROSTER_GET_REQUEST
+from requests import WINDOW_GET_REQUEST
 from requests import TYPE_GET_REQUEST
 from requests import WISH_POST_REQUEST
+from requests import AGENDA_GET_REQUEST
 from requests import SESS_GET_REQUEST
 from requests import SESS_POST_REQUEST
+from requests import SPEAKER_GET_REQUEST
+from requests import SUGGEST_GET_REQUEST
+from requests import ATTENDEE_GET_REQUEST
+from requests import SEARCH_GET_REQUEST
+
+# Modules only some of the methods need (agenda, cachecodec, facets,
+# localcache, migrations, searchindex, speakerindex) are imported by those
+# methods, so a new instance doesn't pay for them before they are used.
+
+from ratelimit import rateLimited
+from tasks import batchTasks
 
 from utils import getUserId
 from utils import validateUser
@@ -73,7 +144,8 @@ class ConferenceApi(remote.Service):
 
     def _addSpeakers(self, request, speakers):
         keys = []
-        all_speakers = {sp.name: sp for sp in Speaker.query()}
+        all_speakers = {sp.name: sp for sp in
+                        Speaker.query(Speaker.name.IN(speakers))}
 
         # Check if the speakers are already in the Datastore.
         for name in speakers:
@@ -90,13 +162,15 @@ class ConferenceApi(remote.Service):
 
                 # Add speaker as featured speaker to memcache using a task
                 # queue, if there is at least one other session by this speaker
-                # at this conference.
-                if Session.query(Session.speakers.IN([s_key])):
-                    taskqueue.add(params={
+                # at this conference. Only the last featured speaker per
+                # conference matters, so these tasks are coalesced.
+                conf_counts = known_speaker.conferenceCounts or {}
+                if conf_counts.get(request.websafeConferenceKey):
+                    self.tasks.add('/tasks/set_feature', {
                         'speaker': known_speaker.name,
                         'session': getattr(request, 'name'),
                         'wbsk': request.websafeConferenceKey},
-                        url='/tasks/set_feature')
+                        coalesce=('feature', request.websafeConferenceKey))
         return keys
 
 
@@ -155,6 +229,50 @@ class ConferenceApi(remote.Service):
         return (inequality_field, formatted_filters)
 
 
+    def _getCursor(self, page_token):
+        """Return the query Cursor for a pageToken, None if there is none."""
+        if not page_token:
+            return None
+        try:
+            return Cursor(urlsafe=page_token)
+        except Exception:
+            raise endpoints.BadRequestException("Invalid pageToken.")
+
+
+    def _checkLimit(self, limit):
+        if not 0 < limit <= MAX_PAGE_SIZE:
+            raise endpoints.BadRequestException(
+                "Limit must be between 1 and %d." % MAX_PAGE_SIZE)
+
+
+    def _currentEtag(self, resource, wsck):
+        """Return the ETag of a resource, a version counter in memcache, or
+        None if memcache is unavailable; a single memcache lookup.
+
+        It has to be read before the resource itself: a write committed in
+        between then changes the version, so the client gets an outdated
+        ETag and its next request a full response, but never a current
+        ETag along with outdated content.
+        """
+        import cachecodec
+        version = cachecodec.getVersion(MEMCACHE_ETAG_KEY % (resource, wsck))
+        return None if version is None else str(version)
+
+
+    @staticmethod
+    def _invalidateEtag(resource, wsck):
+        """Bump the ETag version of a resource once the current transaction
+        (if any) has been committed."""
+        ndb.get_context().call_on_commit(
+            lambda: memcache.incr(MEMCACHE_ETAG_KEY % (resource, wsck)))
+
+
+    def _indexLater(self, key):
+        """Schedule (re)indexing of a Conference or Session for search."""
+        self.tasks.add('/tasks/index_document', {'websafeKey': key.urlsafe()},
+                       named=False)
+
+
 # - - - Endpoint methods - - - - - - - - - - - - - - - - -
 
 # - - - Conferences - - -
@@ -173,6 +291,8 @@ class ConferenceApi(remote.Service):
 
         del data['websafeKey']
         del data['organizerDisplayName']
+        del data['etag']
+        del data['notModified']
 
         # Add default values for those missing.
         for df in DEFAULTS:
@@ -206,15 +326,31 @@ class ConferenceApi(remote.Service):
         data['organizerUserId'] = request.organizerUserId = user_id
 
         # Create Conference, send email to organizer confirming
-        # creation of Conference & return (modified) ConferenceForm
-        Conference(**data).put()
-        taskqueue.add(params={'email': user.email(),
-                      'conferenceInfo': repr(request)},
-                      url='/tasks/send_confirmation_email')
+        # creation of Conference & return (modified) ConferenceForm.
+        # The email task only carries the conference key, not its contents.
+        conf = Conference(**data)
+        self._storeConference(conf)
+        if self._isNearlySoldOut(conf.seatsAvailable):
+            self._trackNearlySoldOut(conf)
+
+        self.tasks.add('/tasks/send_confirmation_email', {
+            'email': user.email(),
+            'websafeConferenceKey': c_key.urlsafe()})
+        self._indexLater(c_key)
 
         return request
 
 
+    @staticmethod
+    @ndb.transactional(xg=True)
+    def _storeConference(conf):
+        """Put a new conference together with the change of the facet
+        counts it adds to."""
+        import facets
+        conf.put()
+        facets.updateFacets(conf)
+
+
     def _copyConferenceToForm(self, conf, displayName):
         """Copy relevant fields from Conference to ConferenceForm."""
         cf = ConferenceForm()
@@ -237,8 +373,9 @@ class ConferenceApi(remote.Service):
         return cf
 
 
-    @ndb.transactional()
+    @ndb.transactional(xg=True)
     def _updateConferenceObject(self, request):
+        import facets
         user = validateUser()
         user_id = getUserId(user)
 
@@ -249,6 +386,8 @@ class ConferenceApi(remote.Service):
         # Update existing conference.
         conf = ndb.Key(urlsafe=request.websafeConferenceKey).get()
         self._validateOwner(request.websafeConferenceKey, user_id)
+        was_nearly = self._isNearlySoldOut(conf.seatsAvailable)
+        old_name = conf.name
 
         # Not getting all the fields, so don't create a new object. Just
         # copy relevant fields from ConferenceForm to Conference object.
@@ -256,6 +395,9 @@ class ConferenceApi(remote.Service):
             data = getattr(request, field.name)
             # Only copy fields where we get data.
 
+            if field.name in ('etag', 'notModified'):
+                continue
+
             if data not in (None, []):
                 # Special handling for dates (convert string to Date).
                 if field.name in ('startDate', 'endDate'):
@@ -268,6 +410,15 @@ class ConferenceApi(remote.Service):
                 setattr(conf, field.name, data)
 
         conf.put()
+        facets.updateFacets(conf)
+
+        # Seats or name might have changed, keep the announcement in sync.
+        is_nearly = self._isNearlySoldOut(conf.seatsAvailable)
+        if was_nearly != is_nearly or (is_nearly and conf.name != old_name):
+            self._trackNearlySoldOut(conf)
+
+        self._indexLater(conf.key)
+        self._invalidateEtag('conference', request.websafeConferenceKey)
         prof = ndb.Key(Profile, user_id).get()
 
         return self._copyConferenceToForm(conf, getattr(prof, 'displayName'))
@@ -275,6 +426,7 @@ class ConferenceApi(remote.Service):
 
     @endpoints.method(ConferenceForm, ConferenceForm, path='conference',
                       http_method='POST', name='createConference')
+    @batchTasks
     def createConference(self, request):
         """Create new conference."""
         return self._createConferenceObject(request)
@@ -283,27 +435,37 @@ class ConferenceApi(remote.Service):
     @endpoints.method(CONF_POST_REQUEST, ConferenceForm,
                       path='conference/{websafeConferenceKey}',
                       http_method='PUT', name='updateConference')
+    @batchTasks
     def updateConference(self, request):
         """Update conference w/provided fields & return w/updated info."""
         return self._updateConferenceObject(request)
 
 
-    @endpoints.method(CONF_GET_REQUEST, ConferenceForm,
+    @endpoints.method(CONF_ETAG_GET_REQUEST, ConferenceForm,
                       path='conference/{websafeConferenceKey}',
                       http_method='GET', name='getConference')
     def getConference(self, request):
-        """Return requested conference (by websafeConferenceKey)."""
+        """Return requested conference (by websafeConferenceKey), or just
+        notModified if it still has the ETag given as ifNoneMatch."""
+        wsck = request.websafeConferenceKey
+        etag = self._currentEtag('conference', wsck)
+        if etag and request.ifNoneMatch == etag:
+            return ConferenceForm(etag=etag, notModified=True)
+
         # Get Conference object from request; bail if not found.
-        conf = ndb.Key(urlsafe=request.websafeConferenceKey).get()
+        conf = ndb.Key(urlsafe=wsck).get()
         self._checkConf(conf)
         prof = conf.key.parent().get()
 
-        return self._copyConferenceToForm(conf, getattr(prof, 'displayName'))
+        cf = self._copyConferenceToForm(conf, getattr(prof, 'displayName'))
+        cf.etag = etag
+        return cf
 
 # - - - Sessions - - -
 
     def _createSessionObject(self, request):
         """Create Session object, return Session form."""
+        import speakerindex
         user = validateUser()
         user_id = getUserId(user)
 
@@ -327,6 +489,7 @@ class ConferenceApi(remote.Service):
                 data[field.name] = value
 
         del data['websafeConferenceKey']
+        del data['websafeKey']
 
         # Check if conference exists and if user is its owner.
         conf = ndb.Key(urlsafe=request.websafeConferenceKey).get()
@@ -339,11 +502,154 @@ class ConferenceApi(remote.Service):
         data['key'] = s_key
 
         sess = Session(**data)
-        sess.put()
+        names = dict(zip(sess.speakers, request.speakers))
+        self._storeSession(sess, names)
+        self._indexLater(s_key)
+        self._invalidateEtag('sessions', request.websafeConferenceKey)
+
+        # Add the session to the reverse index of each of its speakers; the
+        # speaker index of every instance picks up the new counts itself.
+        counted = [sp for sp in sess.speakers
+                   if self._addSpeakerSession(ndb.Key(urlsafe=sp), sess)]
+        if counted:
+            speakerindex.speakersChanged()
 
         return self._copySessionToForm(sess)
 
 
+    @ndb.transactional()
+    def _addSpeakerSession(self, sp_key, sess):
+        """Add sess to the sessions & session counts of a speaker; return
+        False if it has already been added."""
+        wsck = sess.key.parent().urlsafe()
+        ss_key = ndb.Key(SpeakerSession, sess.key.urlsafe(), parent=sp_key)
+
+        speaker, known = ndb.get_multi([sp_key, ss_key])
+        if not speaker or known:
+            return False
+
+        counts = dict(speaker.conferenceCounts or {})
+        counts[wsck] = counts.get(wsck, 0) + 1
+        speaker.conferenceCounts = counts
+        speaker.sessionCount = (speaker.sessionCount or 0) + 1
+
+        ndb.put_multi([speaker, SpeakerSession(key=ss_key, conference=wsck)])
+        return True
+
+
+    @ndb.transactional(xg=True)
+    def _storeSession(self, sess, speaker_names):
+        """Store sess & add it to the speaker roster and timeline of its
+        conference in one transaction; see _getOrBuild()."""
+        sess.put()
+        if sess.speakers:
+            self._addToRoster(sess, speaker_names)
+        self._addToTimeline(sess)
+
+
+    @staticmethod
+    @ndb.transactional(xg=True)
+    def _getOrBuild(key, build):
+        """Return the entity of key, storing the one returned by build() if
+        there is none.
+
+        Used for the aggregates over the sessions of a conference, which
+        build() computes by an ancestor query. The query runs within this
+        transaction, and _storeSession() stores a session and adds it to
+        the aggregates in another one, so each session is counted exactly
+        once: either by build() or by _storeSession().
+        """
+        entity = key.get()
+        if not entity:
+            entity = build()
+            entity.put()
+        return entity
+
+
+    @ndb.transactional()
+    def _addToRoster(self, sess, speaker_names):
+        """Count sess for each of its speakers in the conference's roster,
+        unless the roster has yet to be built by _getRoster()."""
+        import cachecodec
+        wsck = sess.key.parent().urlsafe()
+        roster = ndb.Key(SpeakerRoster, wsck).get()
+        if not roster:
+            return
+
+        speakers = dict(roster.speakers)
+        for sp in sess.speakers:
+            name, count = speakers.get(sp, (speaker_names[sp], 0))
+            speakers[sp] = [name, count + 1]
+
+        roster.speakers = speakers
+        roster.put()
+        # Deleted rather than overwritten, as writes of the roster by
+        # concurrent commits may reach memcache in any order.
+        ndb.get_context().call_on_commit(
+            lambda: cachecodec.delete(MEMCACHE_ROSTER_KEY % wsck,
+                                      seconds=ROSTER_LOCK))
+
+
+    def _getRoster(self, wsck):
+        """Return the speakers of a conference as a dict mapping
+        websafeSpeakerKey to [name, sessionCount], from memcache if possible.
+        """
+        import cachecodec
+        speakers = cachecodec.get(MEMCACHE_ROSTER_KEY % wsck)
+        if speakers is not None:
+            return speakers
+
+        def build():
+            sessions = self._getSessions(wsck).fetch(
+                projection=[Session.speakers])
+            # Speakers are entity groups of their own, so their names are
+            # read outside of the transaction.
+            speaker_names = ndb.non_transactional(self._getSpeakerNames)(
+                sessions)
+            speakers = {}
+            for sess in sessions:
+                for sp in sess.speakers:
+                    name, count = speakers.get(sp, (speaker_names.get(sp), 0))
+                    speakers[sp] = [name, count + 1]
+            return SpeakerRoster(id=wsck, speakers=speakers)
+
+        speakers = self._getOrBuild(ndb.Key(SpeakerRoster, wsck),
+                                    build).speakers
+        cachecodec.add(MEMCACHE_ROSTER_KEY % wsck, speakers,
+                       time=ROSTER_EXPIRY)
+        return speakers
+
+
+    @ndb.transactional()
+    def _addToTimeline(self, sess):
+        """Insert sess into the timeline of its conference if it is
+        scheduled and the timeline has been built by _getTimeline()."""
+        import agenda
+        entry = agenda.sessionEntry(sess)
+        timeline = ndb.Key(SessionTimeline, sess.key.parent().urlsafe()).get()
+        if entry[0] is None or not timeline:
+            return
+
+        agenda.insertEntry(timeline.entries, entry)
+        timeline.maxDuration = max(timeline.maxDuration, entry[1] - entry[0])
+        timeline.put()
+
+
+    def _getTimeline(self, wsck):
+        """Return the SessionTimeline of a conference, building it if
+        necessary."""
+        import agenda
+        def build():
+            entries = [agenda.sessionEntry(sess)
+                       for sess in self._getSessions(wsck)]
+            entries = sorted((e for e in entries if e[0] is not None),
+                             key=agenda.sortKey)
+            return SessionTimeline(id=wsck, entries=entries,
+                                   maxDuration=agenda.maxDuration(entries))
+
+        return self._getOrBuild(ndb.Key(SessionTimeline, wsck), build)
+
+
     def _getSessions(self, wbck):
         """Get all sessions from a conference."""
         confkey = ndb.Key(urlsafe=wbck)
@@ -354,8 +660,12 @@ class ConferenceApi(remote.Service):
         return sessions
 
 
-    def _copySessionToForm(self, sess):
-        """Copy relevant fields from Session to SessionForm."""
+    def _copySessionToForm(self, sess, speaker_names=None):
+        """Copy relevant fields from Session to SessionForm.
+
+        Speaker names are looked up in speaker_names (websafeSpeakerKey to
+        name) if given, instead of getting each speaker.
+        """
         cf = SessionForm()
         for field in cf.all_fields():
             if hasattr(sess, field.name):
@@ -364,31 +674,51 @@ class ConferenceApi(remote.Service):
 
                 # Copy speaker names to form instead of their keys.
                 elif field.name == 'speakers':
-                    sp_names = [ndb.Key(urlsafe=sp).get().name for sp in
-                                getattr(sess, 'speakers')]
+                    if speaker_names is not None:
+                        sp_names = [speaker_names[sp] for sp in
+                                    getattr(sess, 'speakers')]
+                    else:
+                        sp_names = [ndb.Key(urlsafe=sp).get().name for sp in
+                                    getattr(sess, 'speakers')]
                     setattr(cf, field.name, sp_names)
 
                 else:
                     setattr(cf, field.name, getattr(sess, field.name))
 
+            elif field.name == "websafeKey":
+                setattr(cf, field.name, sess.key.urlsafe())
+
         cf.check_initialized()
         return cf
 
 
+    def _getSpeakerNames(self, sessions):
+        """Return names of all speakers of sessions, using a single get."""
+        sp_keys = list(set(sp for sess in sessions for sp in sess.speakers))
+        speakers = ndb.get_multi([ndb.Key(urlsafe=sp) for sp in sp_keys])
+        return {k: sp.name for k, sp in zip(sp_keys, speakers) if sp}
+
+
     @endpoints.method(SESS_POST_REQUEST, SessionForm,
                       path='session/{websafeConferenceKey}',
                       http_method='POST', name='createSession')
+    @rateLimited
+    @batchTasks
     def createSession(self, request):
         """Create new session."""
         return self._createSessionObject(request)
 
 # - - - Wishlists - - -
 
-    @endpoints.method(WISH_POST_REQUEST, MultiStringMessage,
+    @endpoints.method(WISH_POST_REQUEST, WishlistForm,
                       path='wishlist/{websafeSessionKey}',
                       http_method='POST', name='addSessionToWishlist')
+    @rateLimited
     def addSessionToWishlist(self, request):
-        """Adds the session to the current user's wishlist."""
+        """Adds the session to the current user's wishlist and returns the
+        names of the sessions on it, as well as those overlapping the new one.
+        """
+        import agenda
         validateUser()
         profile = self._getProfileFromUser(makeNew=False)
 
@@ -397,14 +727,65 @@ class ConferenceApi(remote.Service):
             raise ConflictException(
                 "This session is already on your wishlist.")
 
+        sess = ndb.Key(urlsafe=request.websafeSessionKey).get()
+        if not sess:
+            raise endpoints.NotFoundException('No session found.')
+
+        # Profiles created before the agenda existed get it built once.
+        if profile.agenda is None:
+            sessions = ndb.get_multi([ndb.Key(urlsafe=wssk) for wssk in
+                                      profile.sessionWishlist])
+            profile.agenda = sorted(
+                (agenda.sessionEntry(s) for s in sessions if s),
+                key=agenda.sortKey)
+        if profile.agendaMaxDuration is None:
+            profile.agendaMaxDuration = agenda.maxDuration(profile.agenda)
+
+        # Check the new session against the stored agenda for conflicts.
+        entry = agenda.sessionEntry(sess)
+        conflicts = agenda.conflictsWith(profile.agenda, entry,
+                                         profile.agendaMaxDuration)
+
         # Add session to wishlist.
         profile.sessionWishlist.append(request.websafeSessionKey)
+        agenda.insertEntry(profile.agenda, entry)
+        profile.agendaMaxDuration = max(profile.agendaMaxDuration,
+                                        agenda.maxDuration([entry]))
         profile.put()
 
-        session_names = [s.name for s in
-                         ndb.get_multi(profile.sessionWishlist)]
+        return WishlistForm(data=[e[3] for e in profile.agenda],
+                            conflicts=[e[3] for e in conflicts])
 
-        return MultiStringMessage(data=session_names)
+
+    @endpoints.method(AGENDA_GET_REQUEST, AgendaForm,
+                      path='agenda',
+                      http_method='GET', name='getMyAgenda')
+    def getMyAgenda(self, request):
+        """Return the user's wishlist sessions in chronological order, with
+        all overlapping pairs and optionally a largest conflict-free subset.
+        """
+        import agenda
+        validateUser()
+        profile = self._getProfileFromUser(makeNew=False)
+
+        sessions = [s for s in ndb.get_multi(
+            [ndb.Key(urlsafe=wssk) for wssk in profile.sessionWishlist]) if s]
+        entries = sorted((agenda.sessionEntry(s) for s in sessions),
+                         key=agenda.sortKey)
+        by_key = {s.key.urlsafe(): s for s in sessions}
+        speaker_names = self._getSpeakerNames(sessions)
+
+        form = AgendaForm(
+            items=[self._copySessionToForm(by_key[e[2]], speaker_names)
+                   for e in entries],
+            conflicts=[SessionConflictForm(first=a[2], second=b[2])
+                       for a, b in agenda.findConflicts(entries)])
+
+        if request.nonConflicting:
+            form.nonConflicting = [
+                e[2] for e in agenda.maxNonConflicting(entries)]
+
+        return form
 
 
     @endpoints.method(message_types.VoidMessage, MultiStringMessage,
@@ -422,38 +803,133 @@ class ConferenceApi(remote.Service):
 
         return MultiStringMessage(data=session_names)
 
+    @endpoints.method(WISH_POST_REQUEST, RecommendationForms,
+                      path='session/{websafeSessionKey}/recommended',
+                      http_method='GET', name='getRecommendedSessions')
+    def getRecommendedSessions(self, request):
+        """Return sessions often saved together with the given one."""
+        recs = ndb.Key(SessionRecommendations,
+                       request.websafeSessionKey).get()
+
+        return RecommendationForms(
+            items=[RecommendationForm(websafeSessionKey=wssk, name=name,
+                                      similarity=sim)
+                   for wssk, name, sim in (recs.sessions if recs else [])])
+
 # - - - Queries - - -
 
-    @endpoints.method(CONF_GET_REQUEST, MultiStringMessage,
-                      path='bla/{websafeConferenceKey}',
+    @endpoints.method(ROSTER_GET_REQUEST, SpeakerRosterForms,
+                      path='conference/{websafeConferenceKey}/speakers',
                       http_method='GET', name='getConferenceSpeakers')
     def getConferenceSpeakers(self, request):
-        """Return all speakers of a conference (by websafeConferenceKey)."""
-        sessions = self._getSessions(
-            request.websafeConferenceKey).fetch(projection=[Session.speakers])
+        """Return speakers of a conference (by websafeConferenceKey), sorted
+        by NAME or SESSION_COUNT, a page at a time."""
+        self._checkLimit(request.limit)
+        if request.offset < 0:
+            raise endpoints.BadRequestException("Invalid offset.")
+
+        speakers = self._getRoster(request.websafeConferenceKey)
+        items = [RosterEntryForm(websafeSpeakerKey=sp, name=name,
+                                 sessionCount=count)
+                 for sp, (name, count) in speakers.items()]
+
+        if request.sortBy == 'SESSION_COUNT':
+            items.sort(key=lambda i: (-i.sessionCount, i.name))
+        elif request.sortBy == 'NAME':
+            items.sort(key=lambda i: i.name)
+        else:
+            raise endpoints.BadRequestException(
+                "sortBy must be NAME or SESSION_COUNT.")
 
-        # Use a Python set to remove duplicates among speaker keys.
-        unique_sp = set([sp for sess in sessions for sp in
-                        sess.speakers])
+        end = request.offset + request.limit
+        return SpeakerRosterForms(
+            items=items[request.offset:end],
+            nextOffset=end if len(items) > end else None)
 
-        # Retrieve speaker objects from keys and return them.
-        speakers = ndb.get_multi((ndb.Key(urlsafe=k) for k in unique_sp))
-        return MultiStringMessage(data=[sp.name for sp in speakers])
 
+    @endpoints.method(CONF_GET_REQUEST, MultiStringMessage,
+                      path='bla/{websafeConferenceKey}',
+                      http_method='GET', name='getConferenceSpeakerNames')
+    def getConferenceSpeakerNames(self, request):
+        """Deprecated, use getConferenceSpeakers: return the names of all
+        speakers of a conference, at the former path of
+        getConferenceSpeakers."""
+        speakers = self._getRoster(request.websafeConferenceKey)
+        return MultiStringMessage(
+            data=sorted(name for name, _ in speakers.values()))
 
-    @endpoints.method(CONF_GET_REQUEST, SessionForms,
+
+    @endpoints.method(CONF_ETAG_GET_REQUEST, SessionForms,
                       path='session/{websafeConferenceKey}',
                       http_method='GET', name='getConferenceSessions')
     def getConferenceSessions(self, request):
-        """Return all sessions of a conference."""
-        sessions = self._getSessions(request.websafeConferenceKey)
+        """Return all sessions of a conference, or just notModified if they
+        still have the ETag given as ifNoneMatch."""
+        wsck = request.websafeConferenceKey
+        etag = self._currentEtag('sessions', wsck)
+        if etag and request.ifNoneMatch == etag:
+            return SessionForms(etag=etag, notModified=True)
+
+        sessions = self._getSessions(wsck).fetch()
+        speaker_names = self._getSpeakerNames(sessions)
 
         # Return set of SessionForm objects per Session.
         return SessionForms(
-            items=[self._copySessionToForm(sess) for sess in sessions]
+            items=[self._copySessionToForm(sess, speaker_names)
+                   for sess in sessions],
+            etag=etag
         )
 
 
+    @endpoints.method(WINDOW_GET_REQUEST, SessionForms,
+                      path='conference/{websafeConferenceKey}/timeline',
+                      http_method='GET', name='getSessionsInWindow')
+    def getSessionsInWindow(self, request):
+        """Return sessions of a conference running during the given number
+        of minutes from start ('YYYY-MM-DD hh:mm'), ordered by start time.
+
+        Session times are the local time of the conference, which has no
+        time zone, so start is required rather than taken from the clock.
+        """
+        import agenda
+        import cachecodec
+        if not 0 < request.minutes <= MAX_WINDOW_MINUTES:
+            raise endpoints.BadRequestException(
+                "Minutes must be between 1 and %d." % MAX_WINDOW_MINUTES)
+        try:
+            start = datetime.datetime.strptime(request.start or '',
+                                               "%Y-%m-%d %H:%M")
+        except ValueError:
+            raise endpoints.BadRequestException(
+                "Start must be given as YYYY-MM-DD hh:mm, in the local time "
+                "of the conference.")
+
+        # Results are cached per minute, so any number of attendees asking
+        # for the same window cost one computation.
+        wsck = request.websafeConferenceKey
+        start_min = int((start - agenda.EPOCH).total_seconds()) // 60
+        cache_key = MEMCACHE_WINDOW_KEY % (wsck, start_min, request.minutes)
+        cached = cachecodec.get(cache_key, SessionForms)
+        if cached is not None:
+            return cached
+
+        timeline = self._getTimeline(wsck)
+        entries = agenda.inWindow(timeline.entries, start_min,
+                                  start_min + request.minutes,
+                                  timeline.maxDuration)
+
+        items = []
+        for begin, end, wssk, name in entries:
+            starts_at = agenda.EPOCH + datetime.timedelta(minutes=begin)
+            items.append(SessionForm(
+                name=name, websafeKey=wssk, date=str(starts_at.date()),
+                startTime=str(starts_at.time()), duration=end - begin))
+        forms = SessionForms(items=items)
+
+        cachecodec.set(cache_key, forms, time=WINDOW_EXPIRY)
+        return forms
+
+
     @endpoints.method(TYPE_GET_REQUEST, SessionForms,
                       path='session/{websafeConferenceKey}/{sessionType}',
                       http_method='GET', name='getConferenceSessionsByType')
@@ -490,29 +966,99 @@ class ConferenceApi(remote.Service):
                       path='speaker/{websafeSpeakerKey}',
                       http_method='GET', name='getSessionsBySpeaker')
     def getSessionsBySpeaker(self, request):
-        """Return all sessions given by a particular speaker."""
-        # Create query for all key matches for this speaker.
-        sessions = Session.query(
-            Session.speakers.IN([request.websafeSpeakerKey]))
+        """Return sessions given by a particular speaker, optionally only at
+        one conference, a page at a time."""
+        self._checkLimit(request.limit)
+
+        # Query the speaker's reverse index, whose key names are the
+        # websafeSessionKeys, so a keys-only query suffices.
+        sp_key = ndb.Key(urlsafe=request.websafeSpeakerKey)
+        q = SpeakerSession.query(ancestor=sp_key)
+        if request.websafeConferenceKey:
+            q = q.filter(
+                SpeakerSession.conference == request.websafeConferenceKey)
+
+        keys, cursor, more = q.fetch_page(
+            request.limit, start_cursor=self._getCursor(request.pageToken),
+            keys_only=True)
+        sessions = [s for s in ndb.get_multi(
+            [ndb.Key(urlsafe=k.id()) for k in keys]) if s]
+        speaker_names = self._getSpeakerNames(sessions)
 
         return SessionForms(
-            items=[self._copySessionToForm(sess) for sess in sessions]
+            items=[self._copySessionToForm(sess, speaker_names)
+                   for sess in sessions],
+            nextPageToken=cursor.urlsafe() if more and cursor else None
         )
 
 
+    @endpoints.method(SUGGEST_GET_REQUEST, SpeakerSuggestionForms,
+                      path='speakers/suggest',
+                      http_method='GET', name='suggestSpeakers')
+    def suggestSpeakers(self, request):
+        """Return the speakers with a name or word of it starting with the
+        given prefix, those with the most sessions first."""
+        import speakerindex
+        if not 0 < request.limit <= MAX_SUGGESTIONS:
+            raise endpoints.BadRequestException(
+                "Limit must be between 1 and %d." % MAX_SUGGESTIONS)
+
+        return SpeakerSuggestionForms(items=[
+            RosterEntryForm(websafeSpeakerKey=wssk, name=name,
+                            sessionCount=count)
+            for wssk, name, count in speakerindex.suggest(request.prefix,
+                                                          request.limit)])
+
+
+    @endpoints.method(SPEAKER_GET_REQUEST, SpeakerProfileForm,
+                      path='speaker/{websafeSpeakerKey}/profile',
+                      http_method='GET', name='getSpeakerProfile')
+    def getSpeakerProfile(self, request):
+        """Return a speaker with the number of sessions per conference."""
+        speaker = ndb.Key(urlsafe=request.websafeSpeakerKey).get()
+        if not speaker:
+            raise endpoints.NotFoundException('No speaker found.')
+
+        counts = sorted((speaker.conferenceCounts or {}).items(),
+                        key=lambda item: -item[1])
+
+        return SpeakerProfileForm(
+            name=speaker.name,
+            email=speaker.email,
+            websafeKey=speaker.key.urlsafe(),
+            sessionCount=speaker.sessionCount or 0,
+            conferences=[ConferenceCountForm(websafeConferenceKey=wsck,
+                                             count=cnt)
+                         for wsck, cnt in counts])
+
+
     @endpoints.method(message_types.VoidMessage, ConferenceForms,
                       path='upcoming',
                       http_method='GET', name='getUpcomingConferences')
     def getUpcomingConferences(self, request):
         """Return upcoming conferences (this and next month)."""
-        # Retrieve all conferences held at the current or the next month.
+        return self._getUpcoming()
+
+
+    def _getUpcoming(self):
+        """Return upcoming conferences, cached in memcache for a short
+        while as they only change with new conferences & registrations."""
+        import cachecodec
         cur_mo = datetime.datetime.now().month
+        cache_key = MEMCACHE_UPCOMING_KEY % cur_mo
+        cached = cachecodec.get(cache_key, ConferenceForms)
+        if cached is not None:
+            return cached
+
+        # Retrieve all conferences held at the current or the next month.
         confs = Conference.query(Conference.month >= cur_mo,
                                  Conference.month <= cur_mo + 1)
 
-        return ConferenceForms(
+        forms = ConferenceForms(
             items=[self._copyConferenceToForm(conf, '') for conf in confs]
         )
+        cachecodec.set(cache_key, forms, time=UPCOMING_EXPIRY)
+        return forms
 
 
     @endpoints.method(message_types.VoidMessage, ConferenceForms,
@@ -558,6 +1104,69 @@ class ConferenceApi(remote.Service):
                 for conf in conferences])
 
 
+    @endpoints.method(ConferenceQueryForms, FacetForms,
+                      path='conferenceFacets',
+                      http_method='POST',
+                      name='getConferenceFacets')
+    def getConferenceFacets(self, request):
+        """Return the number of conferences per city, topic and month,
+        optionally only counting conferences matching one equality filter."""
+        import facets
+        inequality_field, filters = self._formatFilters(request.filters)
+        if inequality_field or len(filters) > 1:
+            raise endpoints.BadRequestException(
+                "Facets can only be filtered by one equality filter.")
+
+        condition = None
+        for filtr in filters:
+            if filtr["field"] not in FACET_FIELDS:
+                raise endpoints.BadRequestException(
+                    "Facets can't be filtered by %s." % filtr["field"])
+            value = filtr["value"]
+            if filtr["field"] == "month":
+                value = int(value)
+            condition = facets.facetValue(filtr["field"], value)
+
+        # Report fields by the names queryConferences accepts.
+        names = {field: name for name, field in FIELDS.items()}
+        counts = facets.facetCounts(condition)
+        return FacetForms(items=[
+            FacetForm(field=names[field],
+                      values=[FacetValueForm(value=value, count=count)
+                              for value, count in sorted(
+                                  counts.get(field, {}).items(),
+                                  key=lambda item: (-item[1], item[0]))])
+            for field in FACET_FIELDS])
+
+
+    @endpoints.method(SEARCH_GET_REQUEST, SearchResultForms,
+                      path='search',
+                      http_method='GET', name='search')
+    def search(self, request):
+        """Full-text search over conferences and sessions."""
+        import searchindex
+        kind = None
+        if request.kind:
+            try:
+                kind = SEARCH_KINDS[request.kind.upper()]
+            except KeyError:
+                raise endpoints.BadRequestException(
+                    "Kind must be one of %s." % ', '.join(SEARCH_KINDS))
+
+        if request.offset < 0 or not 0 < request.limit <= SEARCH_MAX_RESULTS:
+            raise endpoints.BadRequestException(
+                "Invalid offset or limit.")
+
+        hits, next_offset = searchindex.search(
+            request.query, kind, request.offset, request.limit)
+
+        return SearchResultForms(
+            items=[SearchResultForm(kind=doc.kind, websafeKey=doc.key.id(),
+                                    name=doc.title, score=float(score))
+                   for doc, score in hits],
+            nextOffset=next_offset)
+
+
 # - - - Profile objects - - - - - - - - - - - - - - - - - - -
 
     def _copyProfileToForm(self, prof):
@@ -602,6 +1211,7 @@ class ConferenceApi(remote.Service):
         """Get user Profile and return to user, possibly updating it first."""
         # Get user Profile
         prof = self._getProfileFromUser()
+        display_name = prof.displayName
 
         # If saveProfile(), process user-modifyable fields.
         if save_request:
@@ -619,6 +1229,12 @@ class ConferenceApi(remote.Service):
 
                         prof.put()
 
+            # The display name is part of the conferences they organize.
+            if prof.displayName != display_name:
+                for c_key in Conference.query(ancestor=prof.key).iter(
+                        keys_only=True):
+                    self._invalidateEtag('conference', c_key.urlsafe())
+
         return self._copyProfileToForm(prof)
 
 
@@ -672,55 +1288,220 @@ class ConferenceApi(remote.Service):
                       name='getFeaturedSpeaker')
     def getFeaturedSpeaker(self, request):
         """Return featured speaker from memcache."""
-        cache_entry = memcache.get(request.websafeConferenceKey)
+        import localcache
+        cache_entry = localcache.get(
+            MEMCACHE_FEATURED_KEY % request.websafeConferenceKey)
 
         # If there is a featured speaker in memcache, return its name.
         if cache_entry:
-            return StringMessage(data=cache_entry.split('|')[0])
+            return StringMessage(data=cache_entry[0])
         else:
             return StringMessage(data='')
 
 # - - - Announcements - - - - - - - - - - - - - - - - - - - -
 
+    @staticmethod
+    def _isNearlySoldOut(seats):
+        """Return True if a conference with that many seats is announced."""
+        return 0 < (seats or 0) <= ANNOUNCEMENT_SEATS_THRESHOLD
+
+
+    @staticmethod
+    def _announcementKey():
+        return ndb.Key(Announcement, MEMCACHE_ANNOUNCEMENTS_KEY)
+
+
+    @staticmethod
+    def _formatAnnouncement(names):
+        """Format Announcement from names of nearly sold out conferences."""
+        if names:
+            return ANNOUNCEMENT_TPL % ', '.join(names)
+        return ""
+
+
+    @staticmethod
+    def _setAnnouncement(nearly_sold_out):
+        """Assign the sorted names of nearly sold out conferences to memcache
+        & return the Announcement. An empty list is cached if there are
+        none, so that getAnnouncement() can tell it apart from a cache miss.
+        """
+        import localcache
+        names = sorted(nearly_sold_out.values())
+        localcache.set(MEMCACHE_ANNOUNCEMENTS_KEY, names)
+        return ConferenceApi._formatAnnouncement(names)
+
+
+    @staticmethod
+    @ndb.transactional()
+    def _trackNearlySoldOut(conf):
+        """Add or remove conf from the set of nearly sold out conferences.
+
+        Called whenever seatsAvailable crosses the announcement threshold;
+        joins the caller's transaction if there is one, and rewrites the
+        cached announcement only once the change has been committed.
+        """
+        key = ConferenceApi._announcementKey()
+        ann = key.get() or Announcement(key=key)
+        nearly_sold_out = dict(ann.nearlySoldOut or {})
+        wsck = conf.key.urlsafe()
+
+        if ConferenceApi._isNearlySoldOut(conf.seatsAvailable):
+            if nearly_sold_out.get(wsck) == conf.name:
+                return
+            nearly_sold_out[wsck] = conf.name
+        else:
+            if wsck not in nearly_sold_out:
+                return
+            del nearly_sold_out[wsck]
+
+        ann.nearlySoldOut = nearly_sold_out
+        ann.put()
+        ndb.get_context().call_on_commit(
+            lambda: ConferenceApi._setAnnouncement(nearly_sold_out))
+
+
+    @staticmethod
+    @ndb.transactional(xg=True)
+    def _reconcileAnnouncement(conf_keys):
+        """Re-read the conferences of conf_keys & add them to or remove them
+        from the tracked set by their seats; return the tracked set.
+
+        The conferences are read within the transaction, so a change the
+        registration path commits meanwhile is never undone.
+        """
+        key = ConferenceApi._announcementKey()
+        ann = key.get() or Announcement(key=key)
+        nearly_sold_out = dict(ann.nearlySoldOut or {})
+        for conf_key, conf in zip(conf_keys, ndb.get_multi(conf_keys)):
+            wsck = conf_key.urlsafe()
+            if conf and ConferenceApi._isNearlySoldOut(conf.seatsAvailable):
+                nearly_sold_out[wsck] = conf.name
+            else:
+                nearly_sold_out.pop(wsck, None)
+
+        if nearly_sold_out != (ann.nearlySoldOut or {}):
+            ann.nearlySoldOut = nearly_sold_out
+            ann.put()
+        return nearly_sold_out
+
+
     @staticmethod
     def _cacheAnnouncement():
-        """Create Announcement & assign to memcache; used by
-        memcache cron job & putAnnouncement().
+        """Reconcile the tracked nearly sold out conferences with the
+        datastore & refresh memcache; used by memcache cron job.
+
+        The set is normally maintained by the registration path, so this
+        only repairs drift and repopulates evicted or stale cache entries.
         """
+        import cachecodec
+        key = ConferenceApi._announcementKey()
+        ann = key.get()
+        tracked = (ann.nearlySoldOut if ann else None) or {}
         confs = Conference.query(ndb.AND(
-            Conference.seatsAvailable <= 5,
+            Conference.seatsAvailable <= ANNOUNCEMENT_SEATS_THRESHOLD,
             Conference.seatsAvailable > 0)
         ).fetch(projection=[Conference.name])
+        found = {conf.key.urlsafe(): conf.name for conf in confs}
 
-        if confs:
-            # If there are almost sold out conferences,
-            # format announcement and set it in memcache
-            announcement = ANNOUNCEMENT_TPL % (
-                ', '.join(conf.name for conf in confs))
-            memcache.set(MEMCACHE_ANNOUNCEMENTS_KEY, announcement)
-        else:
-            # If there are no sold out conferences,
-            # delete the memcache announcements entry
-            announcement = ""
-            memcache.delete(MEMCACHE_ANNOUNCEMENTS_KEY)
+        # The query is eventually consistent, so the conferences it
+        # disagrees on are re-read before the tracked set is changed.
+        stale = [ndb.Key(urlsafe=wsck) for wsck in set(found) | set(tracked)
+                 if found.get(wsck) != tracked.get(wsck)]
+        for i in range(0, len(stale), ANNOUNCEMENT_RECONCILE_BATCH):
+            ConferenceApi._reconcileAnnouncement(
+                stale[i:i + ANNOUNCEMENT_RECONCILE_BATCH])
+
+        ann = key.get()
+        tracked = (ann.nearlySoldOut if ann else None) or {}
+        names = cachecodec.get(MEMCACHE_ANNOUNCEMENTS_KEY)
+        if names != sorted(tracked.values()):
+            return ConferenceApi._setAnnouncement(tracked)
 
-        return announcement
+        return ConferenceApi._formatAnnouncement(names)
 
 
-    @endpoints.method(message_types.VoidMessage, StringMessage,
+    @staticmethod
+    def _getAnnouncement():
+        """Return Announcement from memcache, rebuilding it from the tracked
+        conferences on a cache miss."""
+        import localcache
+        names = localcache.get(MEMCACHE_ANNOUNCEMENTS_KEY)
+        if names is None:
+            ann = ConferenceApi._announcementKey().get()
+            return ConferenceApi._setAnnouncement(
+                ann.nearlySoldOut if ann else {})
+        return ConferenceApi._formatAnnouncement(names)
+
+
+    @endpoints.method(ETAG_GET_REQUEST, AnnouncementForm,
                       path='conference/announcement/get',
                       http_method='GET', name='getAnnouncement')
     def getAnnouncement(self, request):
-        """Return Announcement from memcache."""
-        return StringMessage(data=memcache.get(
-            MEMCACHE_ANNOUNCEMENTS_KEY) or "")
+        """Return Announcement from memcache, or just notModified if it
+        still has the ETag given as ifNoneMatch."""
+        announcement = self._getAnnouncement()
+        etag = hashlib.md5(announcement.encode('utf-8')).hexdigest()
+        if request.ifNoneMatch == etag:
+            return AnnouncementForm(etag=etag, notModified=True)
+
+        return AnnouncementForm(data=announcement, etag=etag)
+
+
+# - - - Warmup - - - - - - - - - - - - - - - - - - - - - - -
+
+    def _warmup(self):
+        """Import the modules of all methods, resolve message field types &
+        prime the caches; used by the warmup request of a new instance."""
+        for name in ('agenda', 'cachecodec', 'facets', 'localcache',
+                     'migrations', 'searchindex'):
+            importlib.import_module(name)
+        import speakerindex
+        # ProtoRPC resolves the types of message and enum fields lazily,
+        # on their first use.
+        for obj in vars(models).values():
+            if isinstance(obj, type) and issubclass(obj, messages.Message):
+                for field in obj.all_fields():
+                    _ = field.type
+
+        self._getAnnouncement()
+        self._getUpcoming()
+        speakerindex.load()
+
+
+# - - - Statistics - - - - - - - - - - - - - - - - - - - -
+
+    @endpoints.method(CONF_GET_REQUEST, ConferenceStatsForm,
+                      path='conference/{websafeConferenceKey}/stats',
+                      http_method='GET', name='getConferenceStats')
+    def getConferenceStats(self, request):
+        """Return attendee count & t-shirt sizes of a conference, as of the
+        last aggregation run; only available to its organizer."""
+        user = validateUser()
+        self._validateOwner(request.websafeConferenceKey, getUserId(user))
+
+        stats = ndb.Key(ConferenceStats, request.websafeConferenceKey).get()
+        if not stats:
+            return ConferenceStatsForm(attendees=0)
+
+        return ConferenceStatsForm(
+            attendees=stats.attendees,
+            teeShirtSizes=[TeeShirtCountForm(size=getattr(TeeShirtSize, size),
+                                             count=count)
+                           for size, count in sorted(
+                               stats.teeShirtSizes.items(),
+                               key=lambda item: -item[1])],
+            updated=str(stats.updated))
 
 
 # - - - Registration - - - - - - - - - - - - - - - - - - - -
 
     @ndb.transactional(xg=True)
     def _conferenceRegistration(self, request, reg=True):
-        """Register or unregister user for selected conference."""
+        """Register or unregister user for selected conference.
+
+        Return True on success, False if the user was not registered when
+        unregistering, and None if there are no seats available.
+        """
         retval = None
         prof = self._getProfileFromUser()
 
@@ -729,6 +1510,8 @@ class ConferenceApi(remote.Service):
         conf = ndb.Key(urlsafe=wsck).get()
         self._checkConf(conf)
 
+        was_nearly = self._isNearlySoldOut(conf.seatsAvailable)
+
         # Register
         if reg:
             # Check if user already registered otherwise add.
@@ -738,12 +1521,13 @@ class ConferenceApi(remote.Service):
 
             # Check if seats available.
             if conf.seatsAvailable <= 0:
-                raise ConflictException(
-                    "There are no seats available.")
+                return None
 
             # Register user, take away one seat.
             prof.conferenceKeysToAttend.append(wsck)
             conf.seatsAvailable -= 1
+            Registration(parent=conf.key, id=prof.key.id(),
+                         userId=prof.key.id()).put()
             retval = True
 
         # Unregister
@@ -751,17 +1535,161 @@ class ConferenceApi(remote.Service):
             # Check if user already registered.
             if wsck in prof.conferenceKeysToAttend:
 
-                # Unregister user, add back one seat.
+                # Unregister user, add back one seat and have it taken by
+                # the next user on the waitlist, if any.
                 prof.conferenceKeysToAttend.remove(wsck)
                 conf.seatsAvailable += 1
+                ndb.Key(Registration, prof.key.id(), parent=conf.key).delete()
+                self._promoteLater(wsck, transactional=True)
                 retval = True
             else:
                 retval = False
 
-        # Write things back to the datastore & return.
+        # Write things back to the datastore.
         prof.put()
         conf.put()
-        return BooleanMessage(data=retval)
+        if retval:
+            self._invalidateEtag('conference', wsck)
+
+        # Update the announcement if the threshold has been crossed.
+        if was_nearly != self._isNearlySoldOut(conf.seatsAvailable):
+            self._trackNearlySoldOut(conf)
+
+        return retval
+
+
+    def _waitlistKey(self, wsck, user_id):
+        return ndb.Key(WaitlistEntry, '%s|%s' % (wsck, user_id))
+
+
+    def _waitlistPosition(self, entry, conf=None):
+        """Return the 1-based position of entry on its waitlist.
+
+        Entries are numbered as users join & the conference records the
+        highest number promoted, so the position is their difference;
+        users who left the waitlist ahead of entry count until the
+        promoter has passed them.
+        """
+        if entry.sequence is None:
+            # Joined before entries were numbered.
+            return WaitlistEntry.query(
+                WaitlistEntry.conference == entry.conference,
+                WaitlistEntry.joined < entry.joined).count() + 1
+
+        conf = conf or ndb.Key(urlsafe=entry.conference).get()
+        return max(entry.sequence - conf.waitlistPromoted, 1)
+
+
+    def _joinWaitlist(self, conf, user_id):
+        """Put user on the waitlist of a conference; return the position."""
+        wsck = conf.key.urlsafe()
+        key = self._waitlistKey(wsck, user_id)
+        entry = key.get() or self._addWaitlistEntry(key, wsck, user_id)
+        return self._waitlistPosition(entry, conf)
+
+
+    @staticmethod
+    @ndb.transactional(xg=True)
+    def _addWaitlistEntry(key, wsck, user_id):
+        """Add a waitlist entry numbered by the conference's WaitlistCounter
+        & return it, or the entry a concurrent join has added.
+
+        Entries & counters are root entities, so joining never contends
+        with the Conference entity group, only with other users joining
+        the same waitlist.
+        """
+        entry = key.get()
+        if entry:
+            return entry
+
+        counter_key = ndb.Key(WaitlistCounter, wsck)
+        counter = counter_key.get() or WaitlistCounter(key=counter_key)
+        counter.joined += 1
+        entry = WaitlistEntry(key=key, conference=wsck, userId=user_id,
+                              sequence=counter.joined)
+        ndb.put_multi([counter, entry])
+        return entry
+
+
+    @staticmethod
+    def _promoteLater(wsck, transactional=False, countdown=None):
+        """Enqueue a task promoting waitlisted users of a conference; pass
+        transactional=True to enqueue it only if the caller's transaction
+        commits."""
+        taskqueue.add(url='/tasks/promote_waitlist',
+                      params={'websafeConferenceKey': wsck},
+                      transactional=transactional, countdown=countdown)
+
+
+    @staticmethod
+    @ndb.transactional(xg=True)
+    def _promoteEntry(entry_key):
+        """Register the user of a waitlist entry & remove the entry; return
+        False if there has been no seat left, None if the entry is gone."""
+        entry = entry_key.get()
+        if not entry:
+            return None
+
+        conf = ndb.Key(urlsafe=entry.conference).get()
+        if not conf or conf.seatsAvailable <= 0:
+            return False
+
+        # Waitlist positions are counted from the last entry promoted.
+        promoted = max(conf.waitlistPromoted, entry.sequence or 0)
+        passed = promoted != conf.waitlistPromoted
+        conf.waitlistPromoted = promoted
+
+        prof = ndb.Key(Profile, entry.userId).get()
+        if prof and entry.conference not in prof.conferenceKeysToAttend:
+            was_nearly = ConferenceApi._isNearlySoldOut(conf.seatsAvailable)
+            prof.conferenceKeysToAttend.append(entry.conference)
+            conf.seatsAvailable -= 1
+            ndb.put_multi([prof, conf, Registration(
+                parent=conf.key, id=entry.userId, userId=entry.userId)])
+            ConferenceApi._invalidateEtag('conference', entry.conference)
+
+            if was_nearly != ConferenceApi._isNearlySoldOut(
+                    conf.seatsAvailable):
+                ConferenceApi._trackNearlySoldOut(conf)
+        elif passed:
+            conf.put()
+
+        entry_key.delete()
+        return True
+
+
+    @staticmethod
+    def _promoteWaitlist(wsck):
+        """Register waitlisted users in the order they joined, as long as
+        seats are available; used by the promote waitlist task.
+
+        The query is eventually consistent and may return entries already
+        removed, so a task runs at most WAITLIST_PROMOTE_ROUNDS rounds, and
+        stops early if a round finds nothing but removed entries; a later
+        task picks up what is left.
+        """
+        for _ in range(WAITLIST_PROMOTE_ROUNDS):
+            conf = ndb.Key(urlsafe=wsck).get()
+            if not conf or conf.seatsAvailable <= 0:
+                return
+
+            entries = WaitlistEntry.query(
+                WaitlistEntry.conference == wsck).order(
+                WaitlistEntry.joined).fetch(conf.seatsAvailable,
+                                            keys_only=True)
+            if not entries:
+                return
+
+            promoted = False
+            for entry_key in entries:
+                result = ConferenceApi._promoteEntry(entry_key)
+                if result is False:
+                    return
+                promoted = promoted or result
+            if not promoted:
+                break
+
+        ConferenceApi._promoteLater(wsck, countdown=WAITLIST_RETRY_DELAY)
 
 
     @endpoints.method(message_types.VoidMessage, ConferenceForms,
@@ -769,10 +1697,21 @@ class ConferenceApi(remote.Service):
                       http_method='GET', name='getConferencesToAttend')
     def getConferencesToAttend(self, request):
         """Get list of conferences that user has registered for."""
-        prof = self._getProfileFromUser()
-        conf_keys = [ndb.Key(urlsafe=wsck) for wsck in
-                     prof.conferenceKeysToAttend]
-        conferences = ndb.get_multi(conf_keys)
+        import migrations
+        user_id = getUserId(validateUser())
+
+        if migrations.isCompleted('registrations'):
+            # Registrations are children of their conference, so the keys
+            # of the conferences come with a keys-only query.
+            conf_keys = [key.parent() for key in Registration.query(
+                         Registration.userId == user_id).fetch(keys_only=True)]
+        else:
+            # Until the registrations of older users have been backfilled,
+            # their profile is the only complete record.
+            prof = ndb.Key(Profile, user_id).get()
+            conf_keys = [ndb.Key(urlsafe=wsck) for wsck in
+                         (prof.conferenceKeysToAttend if prof else [])]
+        conferences = [conf for conf in ndb.get_multi(conf_keys) if conf]
 
         # Get organizers
         organisers = [ndb.Key(Profile, conf.organizerUserId)
@@ -790,20 +1729,109 @@ class ConferenceApi(remote.Service):
                 for conf in conferences])
 
 
-    @endpoints.method(CONF_GET_REQUEST, BooleanMessage,
+    @staticmethod
+    def _attendeePage(conf_key, limit, cursor=None):
+        """Return a page of attendees of a conference as (registrations,
+        profiles, cursor, more), in the order of their user ids."""
+        regs, cursor, more = Registration.query(ancestor=conf_key).fetch_page(
+            limit, start_cursor=cursor)
+        profiles = ndb.get_multi([ndb.Key(Profile, reg.userId)
+                                  for reg in regs])
+        return regs, profiles, cursor, more
+
+
+    @endpoints.method(ATTENDEE_GET_REQUEST, AttendeeForms,
+                      path='conference/{websafeConferenceKey}/attendees',
+                      http_method='GET', name='getConferenceAttendees')
+    def getConferenceAttendees(self, request):
+        """Return the attendees of a conference a page at a time; only
+        available to its organizer."""
+        self._checkLimit(request.limit)
+        user = validateUser()
+        self._validateOwner(request.websafeConferenceKey, getUserId(user))
+
+        regs, profiles, cursor, more = self._attendeePage(
+            ndb.Key(urlsafe=request.websafeConferenceKey), request.limit,
+            self._getCursor(request.pageToken))
+
+        items = []
+        for reg, prof in zip(regs, profiles):
+            form = AttendeeForm(registered=str(reg.registered))
+            if prof:
+                form.displayName = prof.displayName
+                form.mainEmail = prof.mainEmail
+                form.teeShirtSize = getattr(TeeShirtSize, prof.teeShirtSize)
+            items.append(form)
+
+        return AttendeeForms(
+            items=items,
+            nextPageToken=cursor.urlsafe() if more and cursor else None)
+
+
+    @endpoints.method(CONF_GET_REQUEST, RegistrationForm,
                       path='conference/{websafeConferenceKey}',
                       http_method='POST', name='registerForConference')
+    @rateLimited
     def registerForConference(self, request):
-        """Register user for selected conference."""
-        return self._conferenceRegistration(request)
+        """Register user for selected conference, or put them on its
+        waitlist if it is full."""
+        prof = self._getProfileFromUser()
+        wsck = request.websafeConferenceKey
+        conf = ndb.Key(urlsafe=wsck).get()
+        self._checkConf(conf)
+
+        if wsck in prof.conferenceKeysToAttend:
+            raise ConflictException(
+                "You have already registered for this conference")
+
+        # Seats freed while others are waiting belong to them: join the
+        # waitlist behind them & have the promoter hand out the seats.
+        waiting = conf.seatsAvailable > 0 and WaitlistEntry.query(
+            WaitlistEntry.conference == wsck).get(keys_only=True)
+
+        # Don't bother the Conference entity group with a transaction if
+        # the conference is known to be full.
+        if (conf.seatsAvailable > 0 and not waiting and
+                self._conferenceRegistration(request)):
+            return RegistrationForm(data=True)
+
+        position = self._joinWaitlist(conf, prof.key.id())
+        if waiting:
+            self._promoteLater(wsck)
+        return RegistrationForm(data=False, waitlistPosition=position)
 
 
     @endpoints.method(CONF_GET_REQUEST, BooleanMessage,
                       path='conference/{websafeConferenceKey}',
                       http_method='DELETE', name='unregisterFromConference')
     def unregisterFromConference(self, request):
-        """Unregister user for selected conference."""
-        return self._conferenceRegistration(request, reg=False)
+        """Unregister user for selected conference, or remove them from its
+        waitlist."""
+        if self._conferenceRegistration(request, reg=False):
+            return BooleanMessage(data=True)
+
+        user_id = getUserId(validateUser())
+        entry_key = self._waitlistKey(request.websafeConferenceKey, user_id)
+        if entry_key.get():
+            entry_key.delete()
+            return BooleanMessage(data=True)
+
+        return BooleanMessage(data=False)
+
+
+    @endpoints.method(CONF_GET_REQUEST, WaitlistForm,
+                      path='conference/{websafeConferenceKey}/waitlist',
+                      http_method='GET', name='getWaitlistPosition')
+    def getWaitlistPosition(self, request):
+        """Return the user's position on the waitlist of a conference, or
+        no position if they are not on it."""
+        user_id = getUserId(validateUser())
+        entry = self._waitlistKey(request.websafeConferenceKey, user_id).get()
+        if not entry:
+            return WaitlistForm()
+
+        return WaitlistForm(position=self._waitlistPosition(entry),
+                            joined=str(entry.joined))
 
 
 api = endpoints.api_server([ConferenceApi])
@@ -0,0 +1,217 @@
+import hashlib
+import json
+import random
+import time
+
+from google.appengine.api import taskqueue
+from google.appengine.ext import ndb
+
+import cachecodec
+
+from models import FacetChange
+from models import FacetShard
+from models import FacetState
+
+from settings import FACET_FIELDS
+from settings import FACET_SHARDS
+from settings import FACET_APPLY_BATCH
+from settings import FACETS_EXPIRY
+from settings import MEMCACHE_FACETS_KEY
+
+TASK_URL = '/tasks/apply_facets'
+
+
+def facetValue(field, value):
+    return (field, value)
+
+
+def facetValues(conf):
+    """Return the facet values (field, value) of a conference."""
+    values = set()
+    for field in FACET_FIELDS:
+        value = getattr(conf, field)
+        for v in (value if isinstance(value, list) else [value]):
+            # Conferences without a start date have month 0.
+            if v:
+                values.add(facetValue(field, v))
+    return values
+
+
+def countKey(*values):
+    """Return the key of the count of conferences having all values.
+
+    The key is the JSON list of the sorted values, so any field value,
+    whatever characters it contains, maps to a key of its own.
+    """
+    return json.dumps(sorted(list(v) for v in values),
+                      separators=(',', ':'))
+
+
+def decodeKey(key):
+    """Return the facet values of a count key."""
+    return [facetValue(field, value) for field, value in json.loads(key)]
+
+
+def _countKeys(values):
+    """Return the keys of all counts a conference with values adds to: one
+    per value and one per pair of values."""
+    values = sorted(values)
+    keys = [countKey(v) for v in values]
+    keys.extend(countKey(a, b) for i, a in enumerate(values)
+                for b in values[i + 1:])
+    return keys
+
+
+def _shardKey(key, n):
+    # Count keys may be longer than a key name may be.
+    digest = hashlib.sha1(key.encode('utf-8')).hexdigest()
+    return ndb.Key(FacetShard, '%s-%d' % (digest, n))
+
+
+def facetChanges(conf):
+    """Return the entities recording the change of the facet counts of conf
+    since it has last been counted: its FacetState and a FacetChange; or
+    nothing if its facet values haven't changed."""
+    state_key = ndb.Key(FacetState, 'facets', parent=conf.key)
+    state = state_key.get()
+    old_values = set(facetValue(field, value)
+                     for field, value in state.values) if state else set()
+    new_values = facetValues(conf)
+    if state and old_values == new_values:
+        return []
+
+    delta = {}
+    for k in _countKeys(old_values):
+        delta[k] = delta.get(k, 0) - 1
+    for k in _countKeys(new_values):
+        delta[k] = delta.get(k, 0) + 1
+    delta = {k: d for k, d in delta.items() if d}
+
+    state = FacetState(key=state_key,
+                       values=sorted(list(v) for v in new_values))
+    if not delta:
+        return [state]
+    # Ids can't be allocated within the transaction of the caller.
+    change_id = ndb.non_transactional(FacetChange.allocate_ids)(size=1)[0]
+    return [state, FacetChange(id=change_id, delta=delta)]
+
+
+@ndb.transactional(xg=True)
+def updateFacets(conf):
+    """Record the change of the facet counts of conf, to be called in the
+    transaction writing it, and enqueue the task applying it.
+
+    Joins the transaction of the caller. The counts themselves are only
+    written by the task, as a conference adds to more counts than a
+    transaction may write entity groups.
+    """
+    writes = facetChanges(conf)
+    ndb.put_multi(writes)
+    for entity in writes:
+        if isinstance(entity, FacetChange):
+            _applyLater(entity.key.id(), transactional=True)
+
+
+def _applyLater(change_id, transactional=False):
+    taskqueue.add(url=TASK_URL, params={'id': change_id},
+                  transactional=transactional)
+
+
+@ndb.transactional(xg=True)
+def _applyBatch(change_key):
+    """Apply up to FACET_APPLY_BATCH counts of a change, each to a random
+    shard of its count; return whether the change is still pending.
+
+    The applied counts are removed from the change in the same
+    transaction, so a retried batch never counts twice.
+    """
+    change = change_key.get()
+    if not change:
+        return False
+
+    batch = sorted(change.delta)[:FACET_APPLY_BATCH]
+    shard_keys = [_shardKey(k, random.randrange(FACET_SHARDS))
+                  for k in batch]
+    shards = ndb.get_multi(shard_keys)
+    applied = {}
+    for k, key, shard in zip(batch, shard_keys, shards):
+        shard = shard or FacetShard(key=key, countKey=k, count=0)
+        applied[k] = change.delta.pop(k)
+        shard.count += applied[k]
+        shard.put()
+
+    if change.delta:
+        change.put()
+    else:
+        change.key.delete()
+    ndb.get_context().call_on_commit(lambda: _updateCachedCounts(applied))
+    return bool(change.delta)
+
+
+def _cacheExpiry():
+    """Return when the cached counts expire, as a timestamp: at the end of
+    the current FACETS_EXPIRY seconds, however often they are updated."""
+    return (int(time.time()) // FACETS_EXPIRY + 1) * FACETS_EXPIRY
+
+
+def _updateCachedCounts(delta):
+    """Add an applied change to the cached counts, if they are cached.
+
+    Counts summed while the change was being applied may miss it, and are
+    only corrected once they expire.
+    """
+    def add(counts):
+        for k, d in delta.items():
+            counts[k] = counts.get(k, 0) + d
+            # Counts moved between shards add up to zero.
+            if counts[k] <= 0:
+                del counts[k]
+        return counts
+    cachecodec.update(MEMCACHE_FACETS_KEY, add, time=_cacheExpiry())
+
+
+def applyChange(change_id):
+    """Apply a pending change of the facet counts, a batch at a time."""
+    change_key = ndb.Key(FacetChange, int(change_id))
+    while _applyBatch(change_key):
+        pass
+
+
+def applyPending():
+    """Enqueue the application of all pending changes, e.g. those recorded
+    by the conference_facets migration or whose task has failed."""
+    for key in FacetChange.query().iter(keys_only=True):
+        _applyLater(key.id())
+
+
+def getFacetCounts():
+    """Return all counts by count key, summed over the shards and cached in
+    memcache."""
+    counts = cachecodec.get(MEMCACHE_FACETS_KEY)
+    if counts is None:
+        counts = {}
+        for shard in FacetShard.query():
+            counts[shard.countKey] = (counts.get(shard.countKey, 0) +
+                                      shard.count)
+        # Counts moved between shards add up to zero.
+        counts = {k: n for k, n in counts.items() if n > 0}
+        cachecodec.set(MEMCACHE_FACETS_KEY, counts, time=_cacheExpiry())
+    return counts
+
+
+def facetCounts(condition=None):
+    """Return {field: {value: count}} of all facet values, counting only the
+    conferences with facet value condition, if given."""
+    facets = {}
+    for k, n in getFacetCounts().items():
+        values = decodeKey(k)
+        if condition:
+            if len(values) != 2 or condition not in values:
+                continue
+            values.remove(condition)
+        elif len(values) != 1:
+            continue
+
+        field, value = values[0]
+        facets.setdefault(field, {})[u'%s' % value] = n
+    return facets
@@ -0,0 +1,129 @@
+import collections
+import threading
+import time
+
+import cachecodec
+
+from settings import LOCAL_CACHE_CHECK_INTERVAL
+from settings import LOCAL_CACHE_SIZE
+from settings import LOCAL_CACHE_TTL
+from settings import MEMCACHE_CACHE_VERSION_KEY
+
+# Cached for keys missing in memcache, too.
+_MISSING = object()
+
+_clock = time.time
+
+
+class LocalCache(object):
+    """Thread-safe LRU cache holding at most max_entries entries, each for
+    at most ttl seconds."""
+
+    def __init__(self, max_entries, ttl):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entries = collections.OrderedDict()
+
+    def get(self, key, now):
+        """Return (True, value) if key is cached, else (False, None)."""
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is None or entry[0] <= now:
+                return False, None
+            # Reinsert as the most recently used entry.
+            self._entries[key] = entry
+            return True, entry[1]
+
+    def set(self, key, value, now):
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = (now + self.ttl, value)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+_cache = LocalCache(LOCAL_CACHE_SIZE, LOCAL_CACHE_TTL)
+_lock = threading.Lock()
+_state = {'version': None, 'nextCheck': 0}
+_stats = collections.Counter()
+
+
+def _count(name):
+    with _lock:
+        _stats[name] += 1
+
+
+def _checkVersion(now):
+    """Clear the local cache if the global version has changed; memcache is
+    asked at most once per LOCAL_CACHE_CHECK_INTERVAL seconds."""
+    with _lock:
+        if now < _state['nextCheck']:
+            return
+        _state['nextCheck'] = now + LOCAL_CACHE_CHECK_INTERVAL
+
+    version = cachecodec.getVersion(MEMCACHE_CACHE_VERSION_KEY)
+    _count('versionChecks')
+
+    with _lock:
+        if version is not None and version == _state['version']:
+            return
+        _state['version'] = version
+        _stats['invalidations'] += 1
+    _cache.clear()
+
+
+def get(key, message_type=None):
+    """Return a value cached by set(), None if there is none.
+
+    The instance keeps the values of memcache (and their absence), so a
+    read only costs a memcache RPC if the entry is unknown, has expired, or
+    a version check is due.
+    """
+    now = _clock()
+    _checkVersion(now)
+
+    found, value = _cache.get(key, now)
+    if found:
+        _count('localHits')
+        return None if value is _MISSING else value
+
+    value = cachecodec.get(key, message_type)
+    _count('memcacheHits' if value is not None else 'misses')
+    _cache.set(key, _MISSING if value is None else value, now)
+    return value
+
+
+def set(key, value, time=0):
+    """Store value in memcache & bump the global version, so that all
+    instances drop their local copies within LOCAL_CACHE_CHECK_INTERVAL."""
+    cachecodec.set(key, value, time=time)
+    cachecodec.bumpVersion(MEMCACHE_CACHE_VERSION_KEY)
+    _cache.set(key, value, _clock())
+
+
+def stats():
+    """Return the hit counts and rates of both tiers on this instance."""
+    with _lock:
+        counts = dict(_stats)
+    local = counts.get('localHits', 0)
+    remote = counts.get('memcacheHits', 0)
+    misses = counts.get('misses', 0)
+    return {
+        'local': {'hits': local, 'misses': remote + misses,
+                  'hitRate': float(local) / (local + remote + misses)
+                  if local + remote + misses else None,
+                  'entries': len(_cache)},
+        'memcache': {'hits': remote, 'misses': misses,
+                     'hitRate': float(remote) / (remote + misses)
+                     if remote + misses else None},
+        'versionChecks': counts.get('versionChecks', 0),
+        'invalidations': counts.get('invalidations', 0),
+    }
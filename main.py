@@ -1,41 +1,259 @@
+import csv
+import json
+import logging
+import time
+
 import webapp2
-from google.appengine.api import app_identity
-from google.appengine.api import mail
-from google.appengine.api import memcache
-from conference import ConferenceApi
+
+# The modules of the app (and the App Engine APIs they use) are imported by
+# the handlers needing them, so a new instance only pays for the imports of
+# its first request. The API module (conference) and models pull in
+# endpoints, which is kept off the path of all other tasks this way.
+
+
+class WarmupHandler(webapp2.RequestHandler):
+    def get(self):
+        """Import the API & prime caches before the instance gets traffic."""
+        start = time.time()
+        from conference import ConferenceApi
+        imported = time.time()
+        ConferenceApi()._warmup()
+        logging.info('Warmup: imports %.0f ms, caches %.0f ms',
+                     (imported - start) * 1000,
+                     (time.time() - imported) * 1000)
 
 
 class SetFeatureHandler(webapp2.RequestHandler):
     def post(self):
         """Set featured speaker in Memcache."""
-        cache_entry = '%s|%s' % (self.request.get('speaker'),
-                                 self.request.get('session'))
-        memcache.set(self.request.get('wbsk'), cache_entry)
+        import localcache
+        from settings import MEMCACHE_FEATURED_KEY
+        localcache.set(MEMCACHE_FEATURED_KEY % self.request.get('wbsk'),
+                       [self.request.get('speaker'),
+                        self.request.get('session')])
 
 
 class SetAnnouncementHandler(webapp2.RequestHandler):
     def get(self):
         """Set Announcement in Memcache."""
+        from conference import ConferenceApi
         ConferenceApi._cacheAnnouncement()
         self.response.set_status(204)
 
 
+class SpeakerSnapshotHandler(webapp2.RequestHandler):
+    def get(self):
+        """Store the snapshot of all speakers the instances load their
+        autocomplete index from."""
+        import speakerindex
+        speakerindex.takeSnapshot()
+        self.response.set_status(204)
+
+
+class StartRecommendationsHandler(webapp2.RequestHandler):
+    def get(self):
+        """Start recomputing the recommended sessions from all wishlists."""
+        # NumPy is only needed by this job, not by the API.
+        import recommendations
+        recommendations.startBuild()
+        self.response.set_status(204)
+
+
+class BuildRecommendationsHandler(webapp2.RequestHandler):
+    def post(self):
+        """Run the next step of the recommendations build."""
+        import recommendations
+        recommendations.runStep(self.request.get('run'),
+                                int(self.request.get('step')))
+
+
+class StartAttendanceHandler(webapp2.RequestHandler):
+    def get(self):
+        """Start aggregating attendance statistics."""
+        import analytics
+        analytics.startAggregation()
+        self.response.set_status(204)
+
+
+class AggregateAttendanceHandler(webapp2.RequestHandler):
+    def post(self):
+        """Aggregate the next batches of profiles into attendance stats."""
+        import analytics
+        analytics.runStep(self.request.get('run'),
+                          int(self.request.get('step')))
+
+
+class ApplyFacetsHandler(webapp2.RequestHandler):
+    def post(self):
+        """Apply a pending change of the conference facet counts."""
+        import facets
+        facets.applyChange(self.request.get('id'))
+
+
+class ApplyPendingFacetsHandler(webapp2.RequestHandler):
+    def get(self):
+        """Enqueue the application of all pending facet count changes."""
+        import facets
+        facets.applyPending()
+        self.response.set_status(204)
+
+
+class PromoteWaitlistHandler(webapp2.RequestHandler):
+    def post(self):
+        """Register waitlisted users for freed seats."""
+        from conference import ConferenceApi
+        ConferenceApi._promoteWaitlist(
+            self.request.get('websafeConferenceKey'))
+
+
+class MigrateHandler(webapp2.RequestHandler):
+    def post(self):
+        """Migrate the next batch of entities."""
+        import migrations
+        migrations.runStep(self.request.get('name'), self.request.get('run'),
+                           int(self.request.get('step')))
+
+
+class MigrationsAdminHandler(webapp2.RequestHandler):
+    def get(self):
+        """Report the progress of all migrations as JSON."""
+        import migrations
+        from models import MigrationState
+        states = MigrationState.query().fetch()
+        self.response.content_type = 'application/json'
+        self.response.write(json.dumps({
+            'available': sorted(migrations.MIGRATIONS),
+            'migrations': [dict(state.to_dict(exclude=['cursor']),
+                                name=state.key.id(),
+                                started=str(state.started),
+                                updated=str(state.updated),
+                                completed=state.completed and
+                                str(state.completed))
+                           for state in states]}))
+
+    def post(self):
+        """Start, resume or stop (action=stop) a migration."""
+        import migrations
+        from settings import MIGRATION_BATCH_SIZE
+        from settings import MIGRATION_WRITES_PER_SECOND
+        name = self.request.get('name')
+        if self.request.get('action') == 'stop':
+            migrations.stopMigration(name)
+            return
+
+        try:
+            migrations.startMigration(
+                name,
+                int(self.request.get('batchSize', MIGRATION_BATCH_SIZE)),
+                float(self.request.get('writesPerSecond',
+                                       MIGRATION_WRITES_PER_SECOND)),
+                dry_run=self.request.get('dryRun') in ('1', 'true'),
+                restart=self.request.get('restart') in ('1', 'true'))
+        except (migrations.MigrationError, ValueError) as e:
+            self.response.set_status(400)
+            self.response.write(str(e))
+
+
+class ExportAttendeesHandler(webapp2.RequestHandler):
+    def get(self):
+        """Export the attendees of a conference as CSV; only available to
+        its organizer."""
+        from google.appengine.api import users
+        from google.appengine.ext import ndb
+        from conference import ConferenceApi
+        from settings import MAX_PAGE_SIZE
+        try:
+            conf = ndb.Key(
+                urlsafe=self.request.get('websafeConferenceKey')).get()
+        except Exception:
+            conf = None
+        if not conf:
+            self.abort(404)
+        if conf.organizerUserId != users.get_current_user().email():
+            self.abort(403)
+
+        self.response.content_type = 'text/csv'
+        self.response.headers['Content-Disposition'] = (
+            'attachment; filename=attendees.csv')
+        writer = csv.writer(self.response.out)
+        writer.writerow(['displayName', 'mainEmail', 'teeShirtSize',
+                         'registered'])
+
+        # Write a page of attendees at a time, so memory doesn't grow with
+        # the size of the conference.
+        cursor, more = None, True
+        while more:
+            regs, profiles, cursor, more = ConferenceApi._attendeePage(
+                conf.key, MAX_PAGE_SIZE, cursor)
+            for reg, prof in zip(regs, profiles):
+                row = [prof.displayName, prof.mainEmail, prof.teeShirtSize] \
+                    if prof else ['', reg.userId, '']
+                writer.writerow([(value or '').encode('utf-8')
+                                 for value in row] + [reg.registered])
+
+
+class CacheStatsHandler(webapp2.RequestHandler):
+    def get(self):
+        """Report the hit rates of the caches of this instance as JSON."""
+        import localcache
+        self.response.content_type = 'application/json'
+        self.response.write(json.dumps(localcache.stats()))
+
+
 class SendConfirmationEmailHandler(webapp2.RequestHandler):
     def post(self):
         """Send email confirming Conference creation."""
+        from google.appengine.api import app_identity
+        from google.appengine.api import mail
+        from google.appengine.ext import ndb
+        conf = ndb.Key(urlsafe=self.request.get('websafeConferenceKey')).get()
+        if not conf:
+            return
+
+        conferenceInfo = '\r\n'.join(
+            '%s: %s' % (field, getattr(conf, field)) for field in
+            ('name', 'description', 'topics', 'city', 'startDate', 'endDate',
+             'maxAttendees'))
+
         mail.send_mail(
             'noreply@%s.appspotmail.com' % (
                 app_identity.get_application_id()),     # from
             self.request.get('email'),                  # to
             'You created a new Conference!',            # subj
             'Hi, you have created a following '         # body
-            'conference:\r\n\r\n%s' % self.request.get(
-                'conferenceInfo')
+            'conference:\r\n\r\n%s' % conferenceInfo
         )
 
 
+class IndexDocumentHandler(webapp2.RequestHandler):
+    def post(self):
+        """Update the search index for a Conference or Session."""
+        import searchindex
+        from google.appengine.ext import ndb
+        key = ndb.Key(urlsafe=self.request.get('websafeKey'))
+        entity = key.get()
+        if entity:
+            searchindex.indexEntity(entity)
+        else:
+            searchindex.unindexEntity(key)
+
+
 app = webapp2.WSGIApplication([
+    ('/_ah/warmup', WarmupHandler),
     ('/crons/set_announcement', SetAnnouncementHandler),
+    ('/crons/speaker_snapshot', SpeakerSnapshotHandler),
+    ('/crons/build_recommendations', StartRecommendationsHandler),
+    ('/tasks/build_recommendations', BuildRecommendationsHandler),
+    ('/crons/aggregate_attendance', StartAttendanceHandler),
+    ('/tasks/aggregate_attendance', AggregateAttendanceHandler),
     ('/tasks/send_confirmation_email', SendConfirmationEmailHandler),
     ('/tasks/set_feature', SetFeatureHandler),
+    ('/tasks/index_document', IndexDocumentHandler),
+    ('/tasks/promote_waitlist', PromoteWaitlistHandler),
+    ('/tasks/apply_facets', ApplyFacetsHandler),
+    ('/crons/apply_facets', ApplyPendingFacetsHandler),
+    ('/tasks/migrate', MigrateHandler),
+    ('/admin/migrations', MigrationsAdminHandler),
+    ('/admin/cache_stats', CacheStatsHandler),
+    ('/export/attendees', ExportAttendeesHandler),
 ], debug=True)
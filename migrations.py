@@ -0,0 +1,300 @@
+import datetime
+import logging
+import time
+
+from google.appengine.datastore.datastore_query import Cursor
+from google.appengine.ext import ndb
+
+import agenda
+import facets
+import searchindex
+
+from models import Conference
+from models import MigrationState
+from models import Profile
+from models import Registration
+from models import SearchDocument
+from models import Session
+from models import Speaker
+from models import SpeakerSession
+
+from tasks import StepChain
+
+TASK_URL = '/tasks/migrate'
+STEPS = StepChain(TASK_URL)
+
+# Entity groups a cross-group transaction may span.
+MAX_ENTITY_GROUPS = 25
+
+# Registered migrations: name -> (model, transform).
+MIGRATIONS = {}
+
+
+class MigrationError(Exception):
+    pass
+
+
+def migration(name, model, recheck=False):
+    """Decorator registering a transform of all entities of model, or of a
+    tuple of models migrated one after the other.
+
+    The transform is called with each entity and returns the entities to
+    write (which may include the entity itself), or nothing if there is
+    nothing to change. It has to be idempotent, as a batch is processed
+    again if its step fails. The writes of a batch are put at once; if a
+    request may change the entities meanwhile, pass recheck=True, and each
+    entity with writes is read again and transformed within a cross-group
+    transaction writing it instead, in which other entity groups the
+    transform only reads are best read with _getOutside().
+    """
+    def register(transform):
+        models = model if isinstance(model, tuple) else (model,)
+        MIGRATIONS[name] = (models, transform, recheck)
+        return transform
+    return register
+
+
+def _enqueueStep(state, countdown=None):
+    STEPS.enqueue({'name': state.key.id(), 'run': state.run}, state.step,
+                  countdown=countdown)
+
+
+@ndb.transactional()
+def _createState(name, batch_size, writes_per_second, dry_run, restart):
+    key = ndb.Key(MigrationState, name)
+    state = key.get()
+    if state and state.status == 'running':
+        raise MigrationError('Migration %s is already running.' % name)
+
+    if (not restart and state and state.status == 'stopped' and
+            state.cursor and state.dryRun == dry_run):
+        # Resume where the migration has been stopped, in a new run, as the
+        # tasks are named by run and step and the next step of the old run
+        # may already have been executed.
+        state.status = 'running'
+        state.run = '%d-%d' % (time.time(), state.step)
+        state.batchSize = batch_size
+        state.writesPerSecond = writes_per_second
+    else:
+        state = MigrationState(
+            key=key, kind=MIGRATIONS[name][0][0]._get_kind(), status='running',
+            run=str(int(time.time())), step=0, batchSize=batch_size,
+            writesPerSecond=writes_per_second, dryRun=dry_run, processed=0,
+            changed=0, completed=state.completed if state else None)
+    state.put()
+    return state
+
+
+def startMigration(name, batch_size, writes_per_second, dry_run=False,
+                   restart=False):
+    """Start a registered migration; return its MigrationState.
+
+    A stopped migration is resumed from the batch it has been stopped
+    before, unless restart is True or dry_run differs. In a dry run, the
+    transform is applied but nothing is written, so the number of entities
+    which would change is reported.
+    """
+    if name not in MIGRATIONS:
+        raise MigrationError('Unknown migration %s.' % name)
+    if batch_size <= 0 or writes_per_second <= 0:
+        raise MigrationError('Batch size and write rate must be positive.')
+
+    state = _createState(name, batch_size, writes_per_second, dry_run,
+                         restart)
+    _enqueueStep(state)
+    return state
+
+
+def isCompleted(name):
+    """Return whether a migration has run to its end at least once, other
+    than as a dry run."""
+    state = ndb.Key(MigrationState, name).get()
+    return bool(state and state.completed)
+
+
+@ndb.transactional()
+def stopMigration(name):
+    """Stop a running migration after its current step."""
+    state = ndb.Key(MigrationState, name).get()
+    if state and state.status == 'running':
+        state.status = 'stopped'
+        state.put()
+
+
+@ndb.non_transactional
+def _getOutside(keys):
+    """Get entities outside of the transaction of a transform, so that they
+    don't count against its entity groups."""
+    return ndb.get_multi(keys)
+
+
+@ndb.transactional(xg=True)
+def _migrateEntity(key, transform, dry_run):
+    """Apply transform to the entity of key; return the number of entities
+    written, or which would be written in a dry run.
+
+    The entity is read again within the transaction writing it, so a
+    request changing it meanwhile makes the transaction retry rather than
+    have its change overwritten.
+    """
+    entity = key.get()
+    if not entity:
+        return 0
+    writes = transform(entity) or []
+    if writes and not dry_run:
+        ndb.put_multi(writes)
+    return len(writes)
+
+
+def _migrateBatch(keys, transform, recheck, dry_run):
+    """Apply transform to the entities of keys; return the number of
+    entities written, or which would be written in a dry run."""
+    changed, writes = 0, []
+    for key, entity in zip(keys, ndb.get_multi(keys)):
+        changes = transform(entity) if entity else None
+        if not changes:
+            continue
+        if recheck:
+            changed += _migrateEntity(key, transform, dry_run)
+        else:
+            changed += len(changes)
+            writes.extend(changes)
+    if writes and not dry_run:
+        ndb.put_multi(writes)
+    return changed
+
+
+@ndb.transactional()
+def _saveProgress(name, run, step, processed, changed, cursor, next_kind):
+    """Checkpoint the progress of step, continuing at cursor or else with
+    the first entity of next_kind; return the MigrationState, or None if
+    the step has already been checkpointed.
+
+    A migration stopped during the step stays stopped, but its progress is
+    kept, so that it can be resumed.
+    """
+    state = ndb.Key(MigrationState, name).get()
+    if not state or state.run != run or state.step != step:
+        return None
+    state.processed += processed
+    state.changed += changed
+    state.step += 1
+    if cursor:
+        state.cursor = cursor.urlsafe()
+    elif next_kind:
+        state.kind = next_kind
+        state.cursor = None
+    else:
+        state.status = 'done'
+        if not state.dryRun:
+            state.completed = datetime.datetime.utcnow()
+    state.put()
+    return state
+
+
+def runStep(name, run, step):
+    """Migrate the next batch of a running migration.
+
+    The batch is read by a keys-only query, transformed and written at once
+    (see migration()). The cursor is checkpointed after every batch. The
+    next step is delayed so that the writes of the migration don't exceed
+    its write rate; dry runs write nothing and aren't delayed.
+    """
+    state = ndb.Key(MigrationState, name).get()
+    if not state or state.run != run or state.status != 'running':
+        return
+    if STEPS.resume({'name': name, 'run': run}, step, state.step):
+        return
+
+    models, transform, recheck = MIGRATIONS[name]
+    kinds = [model._get_kind() for model in models]
+    i = kinds.index(state.kind)
+    cursor = Cursor(urlsafe=state.cursor) if state.cursor else None
+    keys, cursor, more = models[i].query().fetch_page(
+        state.batchSize, start_cursor=cursor, keys_only=True)
+
+    writes = _migrateBatch(keys, transform, recheck, state.dryRun)
+    state = _saveProgress(name, run, step, len(keys), writes,
+                          cursor if more and cursor else None,
+                          kinds[i + 1] if i + 1 < len(kinds) else None)
+
+    if state and state.status == 'running':
+        _enqueueStep(state, countdown=0 if state.dryRun else
+                     float(writes) / state.writesPerSecond)
+
+
+# - - - Migrations - - - - - - - - - - - - - - - - - - - - - -
+
+@migration('profile_agenda', Profile, recheck=True)
+def _profileAgenda(profile):
+    """Build the agenda of profiles created before it existed."""
+    if profile.agenda is not None or not profile.sessionWishlist:
+        return None
+
+    sessions = _getOutside([ndb.Key(urlsafe=wssk) for wssk in
+                            profile.sessionWishlist])
+    profile.agenda = sorted((agenda.sessionEntry(s) for s in sessions if s),
+                            key=agenda.sortKey)
+    profile.agendaMaxDuration = agenda.maxDuration(profile.agenda)
+    return [profile]
+
+
+@migration('speaker_sessions', Session)
+def _speakerSessions(sess):
+    """Add sessions created before the speaker reverse index to it; to be
+    followed by speaker_counts."""
+    wsck = sess.key.parent().urlsafe()
+    keys = [ndb.Key(SpeakerSession, sess.key.urlsafe(),
+                    parent=ndb.Key(urlsafe=sp)) for sp in sess.speakers]
+    return [SpeakerSession(key=key, conference=wsck)
+            for key, known in zip(keys, ndb.get_multi(keys)) if not known]
+
+
+@migration('speaker_counts', Speaker, recheck=True)
+def _speakerCounts(speaker):
+    """Recount the sessions of a speaker from the reverse index."""
+    counts = {}
+    for ss in SpeakerSession.query(ancestor=speaker.key):
+        counts[ss.conference] = counts.get(ss.conference, 0) + 1
+
+    if (speaker.conferenceCounts or {}) == counts:
+        return None
+
+    speaker.conferenceCounts = counts
+    speaker.sessionCount = sum(counts.values())
+    return [speaker]
+
+
+@migration('registrations', Profile, recheck=True)
+def _registrations(profile):
+    """Add the registrations of users who registered before they existed.
+
+    Each registration is an entity group of its own, so at most
+    MAX_ENTITY_GROUPS - 1 of them are added per profile; the migration is to
+    be run again for users with more.
+    """
+    keys = [ndb.Key(Registration, profile.key.id(),
+                    parent=ndb.Key(urlsafe=wsck))
+            for wsck in profile.conferenceKeysToAttend]
+    missing = [Registration(key=key, userId=profile.key.id())
+               for key, known in zip(keys, _getOutside(keys)) if not known]
+    if len(missing) >= MAX_ENTITY_GROUPS:
+        logging.warning('Profile %s has %d missing registrations, run the '
+                        'migration again', profile.key.id(), len(missing))
+    return missing[:MAX_ENTITY_GROUPS - 1]
+
+
+@migration('conference_facets', Conference, recheck=True)
+def _conferenceFacets(conf):
+    """Count conferences created before the facet counts in them; the
+    counts are applied by the apply_facets cron job."""
+    return facets.facetChanges(conf)
+
+
+@migration('search', (Conference, Session))
+def _search(entity):
+    """Index conferences and sessions created before the search index;
+    those indexed since are kept up to date by the index_document task."""
+    if ndb.Key(SearchDocument, entity.key.urlsafe()).get():
+        return None
+    return searchindex.indexChanges(entity, None)[0]
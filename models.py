@@ -9,6 +9,11 @@ class ConflictException(endpoints.ServiceException):
     http_status = httplib.CONFLICT
 
 
+class TooManyRequestsException(endpoints.ServiceException):
+    """TooManyRequestsException -- exception mapped to HTTP 429 response"""
+    http_status = 429
+
+
 class Profile(ndb.Model):
     """Profile -- User profile object"""
     displayName = ndb.StringProperty()
@@ -16,6 +21,10 @@ class Profile(ndb.Model):
     teeShirtSize = ndb.StringProperty(default='NOT_SPECIFIED')
     sessionWishlist = ndb.StringProperty(repeated=True)
     conferenceKeysToAttend = ndb.StringProperty(repeated=True)
+    # Sorted [start, end, websafeSessionKey, name] of wishlisted sessions,
+    # and an upper bound of their durations.
+    agenda = ndb.JsonProperty()
+    agendaMaxDuration = ndb.IntegerProperty(indexed=False)
 
 
 class ProfileMiniForm(messages.Message):
@@ -38,6 +47,64 @@ class Speaker(ndb.Model):
     # anyway.
     name = ndb.StringProperty()
     email = ndb.StringProperty()
+    # Reverse index of SpeakerSession children: total & per websafeConfKey.
+    sessionCount = ndb.IntegerProperty(default=0)
+    conferenceCounts = ndb.JsonProperty()
+    # Queried by the speaker index for the speakers changed since a time.
+    updated = ndb.DateTimeProperty(auto_now=True)
+
+
+class SpeakerSuggestionForms(messages.Message):
+    """SpeakerSuggestionForms -- speakers matching a prefix outbound form
+    message"""
+    items = messages.MessageField('RosterEntryForm', 1, repeated=True)
+
+
+class SpeakerSession(ndb.Model):
+    """SpeakerSession -- session of a speaker; child of Speaker, keyed by
+    websafeSessionKey"""
+    conference = ndb.StringProperty()
+
+
+class SessionTimeline(ndb.Model):
+    """SessionTimeline -- scheduled sessions of a conference, keyed by its
+    websafeConferenceKey, as sorted [start, end, websafeSessionKey, name]"""
+    entries = ndb.JsonProperty(compressed=True)
+    maxDuration = ndb.IntegerProperty(indexed=False)
+
+
+class SpeakerRoster(ndb.Model):
+    """SpeakerRoster -- speakers of a conference, keyed by its
+    websafeConferenceKey; maps websafeSpeakerKey to [name, sessionCount]"""
+    speakers = ndb.JsonProperty()
+
+
+class RosterEntryForm(messages.Message):
+    """RosterEntryForm -- speaker of a conference outbound form message"""
+    websafeSpeakerKey = messages.StringField(1)
+    name = messages.StringField(2)
+    sessionCount = messages.IntegerField(3)
+
+
+class SpeakerRosterForms(messages.Message):
+    """SpeakerRosterForms -- page of conference speakers outbound message"""
+    items = messages.MessageField(RosterEntryForm, 1, repeated=True)
+    nextOffset = messages.IntegerField(2)
+
+
+class ConferenceCountForm(messages.Message):
+    """ConferenceCountForm -- sessions per conference outbound message"""
+    websafeConferenceKey = messages.StringField(1)
+    count = messages.IntegerField(2)
+
+
+class SpeakerProfileForm(messages.Message):
+    """SpeakerProfileForm -- Speaker outbound form message"""
+    name = messages.StringField(1)
+    email = messages.StringField(2)
+    websafeKey = messages.StringField(3)
+    sessionCount = messages.IntegerField(4)
+    conferences = messages.MessageField(ConferenceCountForm, 5, repeated=True)
 
 
 class MultiStringMessage(messages.Message):
@@ -50,6 +117,13 @@ class StringMessage(messages.Message):
     data = messages.StringField(1, required=True)
 
 
+class AnnouncementForm(messages.Message):
+    """AnnouncementForm -- announcement outbound form message"""
+    data = messages.StringField(1)
+    etag = messages.StringField(2)
+    notModified = messages.BooleanField(3)
+
+
 class BooleanMessage(messages.Message):
     """BooleanMessage-- outbound Boolean value message"""
     data = messages.BooleanField(1)
@@ -75,11 +149,53 @@ class SessionForm(messages.Message):
     date = messages.StringField(5)
     startTime = messages.StringField(6)
     duration = messages.IntegerField(7)
+    websafeKey = messages.StringField(8)
 
 
 class SessionForms(messages.Message):
     """SessionForms -- multiple Sessions outbound form message"""
     items = messages.MessageField(SessionForm, 1, repeated=True)
+    nextPageToken = messages.StringField(2)
+    etag = messages.StringField(3)
+    notModified = messages.BooleanField(4)
+
+
+class SessionConflictForm(messages.Message):
+    """SessionConflictForm -- pair of overlapping sessions outbound message"""
+    first = messages.StringField(1)
+    second = messages.StringField(2)
+
+
+class AgendaForm(messages.Message):
+    """AgendaForm -- sorted wishlist sessions outbound form message"""
+    items = messages.MessageField(SessionForm, 1, repeated=True)
+    conflicts = messages.MessageField(SessionConflictForm, 2, repeated=True)
+    nonConflicting = messages.StringField(3, repeated=True)
+
+
+class WishlistForm(messages.Message):
+    """WishlistForm -- wishlist session names & conflicts outbound message"""
+    data = messages.StringField(1, repeated=True)
+    conflicts = messages.StringField(2, repeated=True)
+
+
+class SessionRecommendations(ndb.Model):
+    """SessionRecommendations -- sessions often saved together with the one
+    keyed by websafeSessionKey, as [websafeSessionKey, name, similarity]"""
+    sessions = ndb.JsonProperty()
+    run = ndb.StringProperty(indexed=False)
+
+
+class RecommendationForm(messages.Message):
+    """RecommendationForm -- recommended session outbound form message"""
+    websafeSessionKey = messages.StringField(1)
+    name = messages.StringField(2)
+    similarity = messages.FloatField(3)
+
+
+class RecommendationForms(messages.Message):
+    """RecommendationForms -- multiple recommendations outbound message"""
+    items = messages.MessageField(RecommendationForm, 1, repeated=True)
 
 
 class Conference(ndb.Model):
@@ -94,6 +210,8 @@ class Conference(ndb.Model):
     endDate = ndb.DateProperty()
     maxAttendees = ndb.IntegerProperty()
     seatsAvailable = ndb.IntegerProperty()
+    # Highest WaitlistEntry sequence number promoted, for waitlist positions
+    waitlistPromoted = ndb.IntegerProperty(default=0, indexed=False)
 
 
 class ConferenceForm(messages.Message):
@@ -110,6 +228,8 @@ class ConferenceForm(messages.Message):
     endDate = messages.StringField(10)
     websafeKey = messages.StringField(11)
     organizerDisplayName = messages.StringField(12)
+    etag = messages.StringField(13)
+    notModified = messages.BooleanField(14)
 
 
 class ConferenceForms(messages.Message):
@@ -136,6 +256,193 @@ class TeeShirtSize(messages.Enum):
     XXXL_W = 15
 
 
+class Announcement(ndb.Model):
+    """Announcement -- nearly sold out conferences, websafeKey to name"""
+    nearlySoldOut = ndb.JsonProperty()
+
+
+class SearchDocument(ndb.Model):
+    """SearchDocument -- indexed terms of a Conference or Session"""
+    kind = ndb.StringProperty(indexed=False)
+    title = ndb.StringProperty(indexed=False)
+    terms = ndb.JsonProperty()
+
+
+class SearchPosting(ndb.Model):
+    """SearchPosting -- occurrence of a search term in a document"""
+    term = ndb.StringProperty()
+    kind = ndb.StringProperty()
+    doc = ndb.StringProperty(indexed=False)
+    weight = ndb.IntegerProperty(indexed=False)
+
+
+class SearchResultForm(messages.Message):
+    """SearchResultForm -- single search hit outbound form message"""
+    kind = messages.StringField(1)
+    websafeKey = messages.StringField(2)
+    name = messages.StringField(3)
+    score = messages.FloatField(4)
+
+
+class SearchResultForms(messages.Message):
+    """SearchResultForms -- page of search hits outbound form message"""
+    items = messages.MessageField(SearchResultForm, 1, repeated=True)
+    nextOffset = messages.IntegerField(2)
+
+
+class FacetShard(ndb.Model):
+    """FacetShard -- shard of the conference count of a facet value or pair
+    of facet values, keyed by '<sha1 of the count key>-<n>'"""
+    countKey = ndb.TextProperty()
+    count = ndb.IntegerProperty(indexed=False)
+
+
+class FacetState(ndb.Model):
+    """FacetState -- facet values a conference is counted with, child of
+    the conference"""
+    values = ndb.JsonProperty()
+
+
+class FacetChange(ndb.Model):
+    """FacetChange -- change of the facet counts by count key, pending until
+    applied to the shards"""
+    delta = ndb.JsonProperty(compressed=True)
+
+
+class FacetValueForm(messages.Message):
+    """FacetValueForm -- facet value and its count outbound form message"""
+    value = messages.StringField(1)
+    count = messages.IntegerField(2)
+
+
+class FacetForm(messages.Message):
+    """FacetForm -- counts of the values of a field outbound form message"""
+    field = messages.StringField(1)
+    values = messages.MessageField(FacetValueForm, 2, repeated=True)
+
+
+class FacetForms(messages.Message):
+    """FacetForms -- multiple FacetForm outbound form message"""
+    items = messages.MessageField(FacetForm, 1, repeated=True)
+
+
+class AttendanceJob(ndb.Model):
+    """AttendanceJob -- checkpoint of the running attendance aggregation"""
+    run = ndb.StringProperty(indexed=False)
+    step = ndb.IntegerProperty(indexed=False)
+    cursor = ndb.StringProperty(indexed=False)
+    counts = ndb.JsonProperty(compressed=True)
+    updated = ndb.DateTimeProperty(auto_now=True, indexed=False)
+
+
+class RecommendationJob(ndb.Model):
+    """RecommendationJob -- step reached by the running recommendations
+    build, the cursor after the last slice of profiles counted and, once
+    all have been counted, their number"""
+    run = ndb.StringProperty(indexed=False)
+    step = ndb.IntegerProperty(indexed=False)
+    cursor = ndb.StringProperty(indexed=False)
+    slices = ndb.IntegerProperty(indexed=False)
+    updated = ndb.DateTimeProperty(auto_now=True, indexed=False)
+
+
+class RecommendationCounts(ndb.Model):
+    """RecommendationCounts -- popularity of the sessions in a slice of the
+    profiles, or co-occurrence counts of the pairs of a partition of the
+    sessions in it, as little-endian int64 arrays"""
+    items = ndb.JsonProperty(compressed=True)
+    popularity = ndb.BlobProperty(compressed=True)
+    codes = ndb.BlobProperty(compressed=True)
+    counts = ndb.BlobProperty(compressed=True)
+
+
+class MigrationState(ndb.Model):
+    """MigrationState -- progress & checkpoint of a migration, keyed by its
+    name"""
+    kind = ndb.StringProperty(indexed=False)
+    status = ndb.StringProperty(indexed=False)
+    run = ndb.StringProperty(indexed=False)
+    step = ndb.IntegerProperty(indexed=False)
+    cursor = ndb.StringProperty(indexed=False)
+    batchSize = ndb.IntegerProperty(indexed=False)
+    writesPerSecond = ndb.FloatProperty(indexed=False)
+    dryRun = ndb.BooleanProperty(indexed=False)
+    processed = ndb.IntegerProperty(indexed=False)
+    changed = ndb.IntegerProperty(indexed=False)
+    completed = ndb.DateTimeProperty(indexed=False)
+    started = ndb.DateTimeProperty(auto_now_add=True, indexed=False)
+    updated = ndb.DateTimeProperty(auto_now=True, indexed=False)
+
+
+class ConferenceStats(ndb.Model):
+    """ConferenceStats -- attendance of a conference, keyed by its
+    websafeConferenceKey"""
+    attendees = ndb.IntegerProperty(indexed=False)
+    teeShirtSizes = ndb.JsonProperty()
+    updated = ndb.DateTimeProperty(auto_now=True, indexed=False)
+
+
+class TeeShirtCountForm(messages.Message):
+    """TeeShirtCountForm -- attendees per t-shirt size outbound message"""
+    size = messages.EnumField('TeeShirtSize', 1)
+    count = messages.IntegerField(2)
+
+
+class ConferenceStatsForm(messages.Message):
+    """ConferenceStatsForm -- conference attendance outbound form message"""
+    attendees = messages.IntegerField(1)
+    teeShirtSizes = messages.MessageField(TeeShirtCountForm, 2, repeated=True)
+    updated = messages.StringField(3)
+
+
+class WaitlistEntry(ndb.Model):
+    """WaitlistEntry -- user waiting for a seat, keyed by
+    'websafeConferenceKey|userId'"""
+    conference = ndb.StringProperty()
+    userId = ndb.StringProperty(indexed=False)
+    joined = ndb.DateTimeProperty(auto_now_add=True)
+    sequence = ndb.IntegerProperty(indexed=False)  # numbered as users join
+
+
+class WaitlistCounter(ndb.Model):
+    """WaitlistCounter -- number of users who joined the waitlist of a
+    conference, keyed by websafeConferenceKey"""
+    joined = ndb.IntegerProperty(default=0, indexed=False)
+
+
+class Registration(ndb.Model):
+    """Registration -- user registered for a conference, child of the
+    Conference keyed by userId"""
+    userId = ndb.StringProperty()
+    registered = ndb.DateTimeProperty(auto_now_add=True, indexed=False)
+
+
+class AttendeeForm(messages.Message):
+    """AttendeeForm -- conference attendee outbound form message"""
+    displayName = messages.StringField(1)
+    mainEmail = messages.StringField(2)
+    teeShirtSize = messages.EnumField('TeeShirtSize', 3)
+    registered = messages.StringField(4)
+
+
+class AttendeeForms(messages.Message):
+    """AttendeeForms -- multiple AttendeeForm outbound form message"""
+    items = messages.MessageField(AttendeeForm, 1, repeated=True)
+    nextPageToken = messages.StringField(2)
+
+
+class RegistrationForm(messages.Message):
+    """RegistrationForm -- registration result outbound form message"""
+    data = messages.BooleanField(1)
+    waitlistPosition = messages.IntegerField(2)
+
+
+class WaitlistForm(messages.Message):
+    """WaitlistForm -- waitlist position outbound form message"""
+    position = messages.IntegerField(1)
+    joined = messages.StringField(2)
+
+
 class ConferenceQueryForm(messages.Message):
     """ConferenceQueryForm -- Conference query inbound form message"""
     field = messages.StringField(1)
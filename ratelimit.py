@@ -0,0 +1,104 @@
+import functools
+import logging
+import threading
+import time
+
+from google.appengine.api import memcache
+
+from models import TooManyRequestsException
+
+from settings import MEMCACHE_RATE_LIMIT_KEY
+from settings import MEMCACHE_THROTTLED_KEY
+from settings import RATE_LIMIT_CAS_RETRIES
+from settings import RATE_LIMITS
+from settings import THROTTLED_EXPIRY
+
+from utils import getUserId
+from utils import validateUser
+
+
+class LocalBuckets(object):
+    """In-process token buckets, used whenever memcache is unavailable."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._buckets = {}
+
+    def take(self, key, capacity, rate, now):
+        """Take a token from the bucket of key; return False if empty."""
+        with self._lock:
+            tokens, last = self._buckets.get(key, (capacity, now))
+            tokens = min(capacity, tokens + (now - last) * rate)
+            allowed = tokens >= 1
+            if allowed:
+                tokens -= 1
+            self._buckets[key] = (tokens, now)
+            return allowed
+
+
+_local = LocalBuckets()
+
+
+def _takeToken(key, capacity, rate, now):
+    """Take a token from the shared bucket of key; return False if empty.
+
+    The bucket is kept in memcache as (tokens, time of its last update) and
+    updated by compare-and-set, retried on contention. A missing bucket is
+    full, so it expires once it would have refilled.
+
+    Fails closed: a call whose compare-and-set still fails after
+    RATE_LIMIT_CAS_RETRIES attempts is throttled, as only concurrent calls
+    of the same user contend. The in-process buckets, which only limit the
+    calls reaching this instance, are used if memcache is unavailable.
+    """
+    client = memcache.Client()
+    bucket_key = MEMCACHE_RATE_LIMIT_KEY % key
+    expiry = int(capacity / rate) + 1
+    contended = False
+    for _ in range(RATE_LIMIT_CAS_RETRIES):
+        bucket = client.gets(bucket_key)
+        if bucket is None:
+            if client.add(bucket_key, (capacity - 1, now), time=expiry):
+                return True
+            # Either another request has just added it, or memcache is
+            # unavailable.
+            continue
+
+        tokens, last = bucket
+        tokens = min(capacity, tokens + max(0, now - last) * rate)
+        if tokens < 1:
+            # Throttled calls don't update the bucket.
+            return False
+        if client.cas(bucket_key, (tokens - 1, now), time=expiry):
+            return True
+        contended = True
+
+    if contended:
+        return False
+    return _local.take(key, capacity, rate, now)
+
+
+def _recordThrottled(name, user_id):
+    """Log a throttled call & count it per endpoint method in memcache."""
+    logging.warning('Throttled %s for user %s', name, user_id)
+    counter = MEMCACHE_THROTTLED_KEY % name
+    memcache.add(counter, 0, time=THROTTLED_EXPIRY)
+    memcache.incr(counter)
+
+
+def rateLimited(func):
+    """Decorator limiting calls of an endpoint method per user, according to
+    its (capacity, tokens per second) entry in RATE_LIMITS."""
+    name = func.__name__
+    capacity, rate = RATE_LIMITS[name]
+
+    @functools.wraps(func)
+    def wrapper(self, *args, **kwargs):
+        user_id = getUserId(validateUser())
+        if not _takeToken('%s|%s' % (name, user_id), capacity, rate,
+                          time.time()):
+            _recordThrottled(name, user_id)
+            raise TooManyRequestsException(
+                'Too many requests, please try again later.')
+        return func(self, *args, **kwargs)
+    return wrapper
@@ -0,0 +1,381 @@
+import datetime
+import time
+import zlib
+
+import numpy as np
+
+from google.appengine.datastore.datastore_query import Cursor
+from google.appengine.ext import ndb
+
+from models import Profile
+from models import RecommendationCounts
+from models import RecommendationJob
+from models import SessionRecommendations
+
+from settings import RECOMMENDATION_BATCH_SIZE
+from settings import RECOMMENDATION_JOB_TIMEOUT
+from settings import RECOMMENDATION_MAX_PAIRS
+from settings import RECOMMENDATION_MIN_COUNT
+from settings import RECOMMENDATION_MODULE
+from settings import RECOMMENDATION_PARTITIONS
+from settings import RECOMMENDATION_SLICE_SIZE
+from settings import RECOMMENDATION_TOP_K
+
+from tasks import StepChain
+
+JOB_KEY = ndb.Key(RecommendationJob, 'recommendations')
+TASK_URL = '/tasks/build_recommendations'
+STEPS = StepChain(TASK_URL, target=RECOMMENDATION_MODULE)
+
+# Pairs of session indices are encoded as a single int64.
+_SHIFT = 32
+_MASK = (1 << _SHIFT) - 1
+
+
+def _reduceCounts(codes, counts):
+    """Sum up counts of equal codes; return sorted unique codes & sums."""
+    if not len(codes):
+        return codes, counts
+    order = np.argsort(codes, kind='mergesort')
+    codes = codes[order]
+    counts = counts[order]
+    starts = np.concatenate(([0], np.flatnonzero(np.diff(codes)) + 1))
+    return codes[starts], np.add.reduceat(counts, starts)
+
+
+def _pairCodes(users, items, left):
+    """Return the codes of all pairs (a, b), a != b, of items sharing a user
+    whose first item is at a position where left is True.
+
+    users has to be sorted, so that every user's items are contiguous. The
+    pairs are generated by a vectorized join of the left elements of each
+    user's segment with the whole segment.
+    """
+    m = len(users)
+    if not m:
+        return np.zeros(0, dtype=np.int64)
+
+    seg_starts = np.concatenate(([0], np.flatnonzero(np.diff(users)) + 1))
+    seg_lens = np.diff(np.concatenate((seg_starts, [m])))
+
+    # Start and length of its user's segment, for every left element.
+    elem_lens = np.repeat(seg_lens, seg_lens)[left]
+    elem_starts = np.repeat(seg_starts, seg_lens)[left]
+
+    # Join every left element with each element of its segment.
+    lefts = np.repeat(np.flatnonzero(left), elem_lens)
+    offsets = np.cumsum(elem_lens) - elem_lens
+    rights = (np.repeat(elem_starts, elem_lens) +
+              np.arange(len(lefts)) - np.repeat(offsets, elem_lens))
+
+    a = items[lefts].astype(np.int64)
+    b = items[rights].astype(np.int64)
+    keep = a != b
+    return (a[keep] << _SHIFT) | b[keep]
+
+
+def partition(item, partitions):
+    """Return the partition of an item (a websafeSessionKey)."""
+    return (zlib.crc32(item.encode('utf-8')) & 0xffffffff) % partitions
+
+
+class CoOccurrence(object):
+    """Accumulate co-occurrence counts of items over batches of baskets.
+
+    Only the counts of pairs whose first item is owned are kept, by default
+    those of all pairs; popularity is counted for all items.
+    """
+
+    MIN_MERGE = 1 << 20
+
+    def __init__(self, owns=None, max_pairs=None):
+        self.owns = owns
+        self.max_pairs = max_pairs
+        self.index = {}
+        self.items = []
+        self.owned = []
+        self.codes = np.zeros(0, dtype=np.int64)
+        self.counts = np.zeros(0, dtype=np.int64)
+        self.popularity = np.zeros(0, dtype=np.int64)
+        self._pending = []
+        self._pendingSize = 0
+
+    def _itemIndex(self, item):
+        if item not in self.index:
+            self.index[item] = len(self.items)
+            self.items.append(item)
+            self.owned.append(self.owns is None or self.owns(item))
+        return self.index[item]
+
+    def addBatch(self, baskets):
+        """Add a batch of baskets, each an iterable of distinct items.
+
+        The pairs of a batch are generated at most max_pairs at a time, so
+        memory doesn't grow with the square of the longest baskets beyond
+        that.
+        """
+        chunk, pairs = [], 0
+        for basket in baskets:
+            basket = [self._itemIndex(item) for item in basket]
+            size = len(basket) * sum(self.owned[i] for i in basket)
+            if chunk and self.max_pairs and pairs + size > self.max_pairs:
+                self._addChunk(chunk)
+                chunk, pairs = [], 0
+            chunk.append(basket)
+            pairs += size
+        self._addChunk(chunk)
+
+    def _addChunk(self, baskets):
+        users = np.array([i for i, basket in enumerate(baskets)
+                          for _ in basket], dtype=np.int64)
+        items = np.array([item for basket in baskets for item in basket],
+                         dtype=np.int64)
+
+        self._growPopularity()
+        if len(items):
+            self.popularity += np.bincount(items, minlength=len(self.items))
+
+        owned = np.array(self.owned, dtype=bool)
+        codes = _pairCodes(users, items, owned[items] if len(items) else
+                           np.zeros(0, dtype=bool))
+        self._addPending(codes, np.ones(len(codes), dtype=np.int64))
+
+    def _growPopularity(self):
+        self.popularity = np.concatenate(
+            (self.popularity,
+             np.zeros(len(self.items) - len(self.popularity), dtype=np.int64)))
+
+    def _addPending(self, codes, counts):
+        # Merging into the totals means sorting them, so pair codes are
+        # buffered until they outnumber the totals (or a minimum size).
+        self._pending.append((codes, counts))
+        self._pendingSize += len(codes)
+        if self._pendingSize > max(len(self.codes), self.MIN_MERGE):
+            self._merge()
+
+    def _merge(self):
+        if not self._pending:
+            return
+        codes = np.concatenate([self.codes] + [c for c, _ in self._pending])
+        counts = np.concatenate(
+            [self.counts] + [n for _, n in self._pending])
+        self.codes, self.counts = _reduceCounts(codes, counts)
+        self._pending = []
+        self._pendingSize = 0
+
+    def popularityCounts(self):
+        """Return the items counted so far and their popularity."""
+        self._growPopularity()
+        return list(self.items), self.popularity.copy()
+
+    def pairCounts(self, first):
+        """Return the counts of the pairs whose first item is one where the
+        boolean array first is True: the items of these pairs, the codes of
+        the pairs by position in those items, and their counts."""
+        self._merge()
+        keep = first[self.codes >> _SHIFT]
+        codes, counts = self.codes[keep], self.counts[keep]
+        used = np.unique(np.concatenate((codes >> _SHIFT, codes & _MASK)))
+        position = np.zeros(len(self.items), dtype=np.int64)
+        position[used] = np.arange(len(used))
+        codes = (position[codes >> _SHIFT] << _SHIFT) | \
+            position[codes & _MASK]
+        return [self.items[i] for i in used], codes, counts
+
+    def addPopularity(self, items, popularity):
+        """Add popularity counts returned by popularityCounts(), e.g. those
+        of another slice of the baskets."""
+        index = np.array([self._itemIndex(item) for item in items],
+                         dtype=np.int64)
+        self._growPopularity()
+        self.popularity[index] += popularity
+
+    def addPairCounts(self, items, codes, counts):
+        """Add pair counts returned by pairCounts(), e.g. those of another
+        slice of the baskets."""
+        index = np.array([self._itemIndex(item) for item in items],
+                         dtype=np.int64)
+        codes = (index[codes >> _SHIFT] << _SHIFT) | index[codes & _MASK]
+        self._growPopularity()
+        self._addPending(codes, counts)
+
+    def topK(self, k, min_count=1):
+        """Return {item: [(other, similarity), ...]} holding the k most
+        similar items of every owned item, by cosine similarity of their
+        baskets.
+        """
+        self._merge()
+        keep = self.counts >= min_count
+        a = self.codes[keep] >> _SHIFT
+        b = self.codes[keep] & _MASK
+        counts = self.counts[keep].astype(np.float64)
+        sim = counts / np.sqrt(self.popularity[a] * self.popularity[b])
+
+        # Sort by item, then by descending similarity, and keep the first k
+        # neighbours of each item.
+        order = np.lexsort((b, -sim, a))
+        a, b, sim = a[order], b[order], sim[order]
+        rank = np.arange(len(a)) - np.searchsorted(a, a)
+        top = rank < k
+
+        result = {}
+        for i, j, s in zip(a[top], b[top], sim[top]):
+            result.setdefault(self.items[i], []).append(
+                (self.items[j], float(s)))
+        return result
+
+
+@ndb.transactional()
+def _createJob():
+    """Create a new job unless one is running; return it or None.
+
+    A job without progress for RECOMMENDATION_JOB_TIMEOUT seconds is
+    replaced.
+    """
+    job = JOB_KEY.get()
+    timeout = datetime.timedelta(seconds=RECOMMENDATION_JOB_TIMEOUT)
+    if job and job.updated > datetime.datetime.utcnow() - timeout:
+        return None
+    job = RecommendationJob(key=JOB_KEY, run=str(int(time.time())), step=0)
+    job.put()
+    return job
+
+
+def startBuild():
+    """Start recomputing the recommendations; return False if a build is
+    already running."""
+    job = _createJob()
+    if not job:
+        return False
+    STEPS.enqueue({'run': job.run}, 0)
+    return True
+
+
+def _pack(array):
+    return array.astype('<i8').tobytes()
+
+
+def _unpack(data):
+    return np.frombuffer(data, dtype='<i8').astype(np.int64)
+
+
+def _countsKey(slice_, part=None):
+    if part is None:
+        return ndb.Key(RecommendationCounts, 'popularity-%d' % slice_)
+    return ndb.Key(RecommendationCounts, 'pairs-%d-%d' % (slice_, part))
+
+
+def _countSlice(slice_, cursor):
+    """Count the pairs of the next RECOMMENDATION_SLICE_SIZE profiles by
+    key, from cursor, and store the counts of every partition of the
+    sessions; return the cursor after the slice and whether there are more
+    profiles."""
+    cooc = CoOccurrence(max_pairs=RECOMMENDATION_MAX_PAIRS)
+    query = Profile.query().order(Profile.key)
+    read, more = 0, True
+    while more and read < RECOMMENDATION_SLICE_SIZE:
+        profiles, cursor, more = query.fetch_page(
+            min(RECOMMENDATION_BATCH_SIZE, RECOMMENDATION_SLICE_SIZE - read),
+            start_cursor=cursor)
+        read += len(profiles)
+        cooc.addBatch(set(p.sessionWishlist) for p in profiles
+                      if p.sessionWishlist)
+
+    items, popularity = cooc.popularityCounts()
+    counts = [RecommendationCounts(key=_countsKey(slice_), items=items,
+                                   popularity=_pack(popularity))]
+    parts = np.array([partition(item, RECOMMENDATION_PARTITIONS)
+                      for item in items], dtype=np.int64)
+    for part in range(RECOMMENDATION_PARTITIONS):
+        items, codes, n = cooc.pairCounts(parts == part)
+        counts.append(RecommendationCounts(
+            key=_countsKey(slice_, part), items=items, codes=_pack(codes),
+            counts=_pack(n)))
+    ndb.put_multi(counts)
+    return cursor, more
+
+
+def _buildPartition(run, part, slices):
+    """Recompute and store the recommended sessions of the sessions in
+    partition part from the counts of all slices; return their number."""
+    cooc = CoOccurrence()
+    for slice_ in range(slices):
+        popularity, pairs = ndb.get_multi([_countsKey(slice_),
+                                           _countsKey(slice_, part)])
+        cooc.addPopularity(popularity.items, _unpack(popularity.popularity))
+        cooc.addPairCounts(pairs.items, _unpack(pairs.codes),
+                           _unpack(pairs.counts))
+
+    neighbours = cooc.topK(RECOMMENDATION_TOP_K, RECOMMENDATION_MIN_COUNT)
+
+    # Store session names along with the keys, so that recommendations can
+    # be served with a single get.
+    wssks = list(set(w for recs in neighbours.values() for w, _ in recs))
+    names = {}
+    for i in range(0, len(wssks), RECOMMENDATION_BATCH_SIZE):
+        chunk = wssks[i:i + RECOMMENDATION_BATCH_SIZE]
+        for wssk, sess in zip(chunk, ndb.get_multi(
+                [ndb.Key(urlsafe=w) for w in chunk])):
+            if sess:
+                names[wssk] = sess.name
+
+    recs = [SessionRecommendations(
+        id=wssk, run=run,
+        sessions=[[w, names[w], round(s, 4)] for w, s in sims
+                  if w in names])
+        for wssk, sims in neighbours.items()]
+    for i in range(0, len(recs), RECOMMENDATION_BATCH_SIZE):
+        ndb.put_multi(recs[i:i + RECOMMENDATION_BATCH_SIZE])
+    return len(recs)
+
+
+def _deleteStale(run):
+    """Drop recommendations of sessions nobody saves together anymore, i.e.
+    those not written by run."""
+    stale = [recs.key for recs in SessionRecommendations.query().iter(
+             batch_size=RECOMMENDATION_BATCH_SIZE) if recs.run != run]
+    for i in range(0, len(stale), RECOMMENDATION_BATCH_SIZE):
+        ndb.delete_multi(stale[i:i + RECOMMENDATION_BATCH_SIZE])
+
+
+def _deleteCounts():
+    keys = list(RecommendationCounts.query().iter(keys_only=True))
+    for i in range(0, len(keys), RECOMMENDATION_BATCH_SIZE):
+        ndb.delete_multi(keys[i:i + RECOMMENDATION_BATCH_SIZE])
+
+
+def runStep(run, step):
+    """Run step of a running job.
+
+    The first steps each count the pairs of one slice of the profiles, a
+    range of their keys, and store the counts by partition of the sessions;
+    the following steps each merge the counts of one partition over all
+    slices and store its recommendations. Every profile is thus read once,
+    memory is bounded by the pairs of a slice or a partition, and a failed
+    step is simply retried.
+    """
+    job = JOB_KEY.get()
+    if not job or job.run != run:
+        return
+    if STEPS.resume({'run': run}, step, job.step):
+        return
+
+    if job.slices is None:
+        cursor = Cursor(urlsafe=job.cursor) if job.cursor else None
+        cursor, more = _countSlice(step, cursor)
+        if more and cursor:
+            job.cursor = cursor.urlsafe()
+        else:
+            job.slices = step + 1
+    else:
+        part = step - job.slices
+        _buildPartition(run, part, job.slices)
+        if part + 1 >= RECOMMENDATION_PARTITIONS:
+            _deleteStale(run)
+            _deleteCounts()
+            JOB_KEY.delete()
+            return
+
+    job.step = step + 1
+    job.put()
+    STEPS.enqueue({'run': run}, job.step)
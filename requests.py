@@ -9,6 +9,32 @@ CONF_GET_REQUEST = endpoints.ResourceContainer(
     websafeConferenceKey=messages.StringField(1),
 )
 
+ROSTER_GET_REQUEST = endpoints.ResourceContainer(
+    message_types.VoidMessage,
+    websafeConferenceKey=messages.StringField(1),
+    sortBy=messages.StringField(2, default='NAME'),
+    offset=messages.IntegerField(3, default=0),
+    limit=messages.IntegerField(4, default=20),
+)
+
+CONF_ETAG_GET_REQUEST = endpoints.ResourceContainer(
+    message_types.VoidMessage,
+    websafeConferenceKey=messages.StringField(1),
+    ifNoneMatch=messages.StringField(2),
+)
+
+ETAG_GET_REQUEST = endpoints.ResourceContainer(
+    message_types.VoidMessage,
+    ifNoneMatch=messages.StringField(1),
+)
+
+WINDOW_GET_REQUEST = endpoints.ResourceContainer(
+    message_types.VoidMessage,
+    websafeConferenceKey=messages.StringField(1),
+    start=messages.StringField(2, required=True),
+    minutes=messages.IntegerField(3, default=60),
+)
+
 CONF_POST_REQUEST = endpoints.ResourceContainer(
     ConferenceForm,
     websafeConferenceKey=messages.StringField(1),
@@ -25,12 +51,46 @@ WISH_POST_REQUEST = endpoints.ResourceContainer(
     websafeSessionKey=messages.StringField(1),
 )
 
+AGENDA_GET_REQUEST = endpoints.ResourceContainer(
+    message_types.VoidMessage,
+    nonConflicting=messages.BooleanField(1, default=False),
+)
+
 SESS_GET_REQUEST = endpoints.ResourceContainer(
     message_types.VoidMessage,
     websafeSpeakerKey=messages.StringField(1),
+    websafeConferenceKey=messages.StringField(2),
+    pageToken=messages.StringField(3),
+    limit=messages.IntegerField(4, default=20),
+)
+
+ATTENDEE_GET_REQUEST = endpoints.ResourceContainer(
+    message_types.VoidMessage,
+    websafeConferenceKey=messages.StringField(1),
+    pageToken=messages.StringField(2),
+    limit=messages.IntegerField(3, default=20),
+)
+
+SUGGEST_GET_REQUEST = endpoints.ResourceContainer(
+    message_types.VoidMessage,
+    prefix=messages.StringField(1, required=True),
+    limit=messages.IntegerField(2, default=10),
+)
+
+SPEAKER_GET_REQUEST = endpoints.ResourceContainer(
+    message_types.VoidMessage,
+    websafeSpeakerKey=messages.StringField(1),
 )
 
 SESS_POST_REQUEST = endpoints.ResourceContainer(
     SessionForm,
     websafeConferenceKey=messages.StringField(1),
 )
+
+SEARCH_GET_REQUEST = endpoints.ResourceContainer(
+    message_types.VoidMessage,
+    query=messages.StringField(1, required=True),
+    kind=messages.StringField(2),
+    offset=messages.IntegerField(3, default=0),
+    limit=messages.IntegerField(4, default=20),
+)
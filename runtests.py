@@ -0,0 +1,28 @@
+#!/usr/bin/env python
+"""Run the unit tests in tests/ against the App Engine SDK.
+
+    python runtests.py [SDK_PATH]
+
+SDK_PATH defaults to $APPENGINE_SDK, else /usr/local/google_appengine.
+"""
+import os
+import sys
+import unittest
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+
+def main(sdk_path):
+    sys.path.insert(0, sdk_path)
+    import dev_appserver
+    dev_appserver.fix_sys_path()
+    sys.path.insert(0, ROOT)
+
+    suite = unittest.loader.TestLoader().discover(os.path.join(ROOT, 'tests'))
+    result = unittest.TextTestRunner(verbosity=2).run(suite)
+    return 0 if result.wasSuccessful() else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1] if len(sys.argv) > 1 else os.environ.get(
+        'APPENGINE_SDK', '/usr/local/google_appengine')))
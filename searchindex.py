@@ -0,0 +1,137 @@
+import collections
+import re
+
+from google.appengine.ext import ndb
+
+from models import SearchDocument
+from models import SearchPosting
+
+from settings import SEARCH_BATCH_SIZE
+from settings import SEARCH_FIELDS
+from settings import SEARCH_STOPWORDS
+
+TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+
+# Longest token kept, to bound the size of posting key names.
+MAX_TOKEN_LENGTH = 64
+
+
+def tokenize(text):
+    """Split text into lowercase search terms, dropping stopwords."""
+    return [t[:MAX_TOKEN_LENGTH] for t in TOKEN_RE.findall(text.lower())
+            if len(t) > 1 and t not in SEARCH_STOPWORDS]
+
+
+def _entityTerms(entity):
+    """Return the weighted terms of entity's indexed fields."""
+    terms = collections.defaultdict(int)
+    for field, weight in SEARCH_FIELDS[entity.key.kind()].items():
+        values = getattr(entity, field)
+        if not isinstance(values, list):
+            values = [values]
+
+        for value in values:
+            for term in tokenize(value or u''):
+                terms[term] += weight
+    return dict(terms)
+
+
+def _postingKey(term, wsk):
+    return ndb.Key(SearchPosting, u'%s %s' % (term, wsk))
+
+
+def indexChanges(entity, doc):
+    """Return the entities to write to index entity, last indexed as doc
+    (None if never), and the keys of the postings to delete.
+
+    Only postings of terms which have been added, removed or reweighted
+    since the entity was last indexed are written.
+    """
+    wsk = entity.key.urlsafe()
+    kind = entity.key.kind()
+    old_terms = doc.terms if doc else {}
+    new_terms = _entityTerms(entity)
+
+    stale = [_postingKey(term, wsk) for term in old_terms
+             if term not in new_terms]
+    changed = [SearchPosting(key=_postingKey(term, wsk), term=term, doc=wsk,
+                             kind=kind, weight=weight)
+               for term, weight in new_terms.items()
+               if old_terms.get(term) != weight]
+
+    doc = SearchDocument(key=ndb.Key(SearchDocument, wsk), kind=kind,
+                         title=entity.name, terms=new_terms)
+    return changed + [doc], stale
+
+
+def indexEntity(entity):
+    """Add or update a Conference or Session in the search index."""
+    doc = ndb.Key(SearchDocument, entity.key.urlsafe()).get()
+    writes, stale = indexChanges(entity, doc)
+    ndb.put_multi(writes)
+    ndb.delete_multi(stale)
+
+
+def unindexEntity(key):
+    """Remove the entity with the given key from the search index."""
+    wsk = key.urlsafe()
+    doc_key = ndb.Key(SearchDocument, wsk)
+    doc = doc_key.get()
+    if doc:
+        ndb.delete_multi([_postingKey(term, wsk) for term in doc.terms] +
+                         [doc_key])
+
+
+@ndb.tasklet
+def _termScores(token, kind):
+    """Return the score of every document matching token, by reading all
+    its postings, SEARCH_BATCH_SIZE at a time."""
+    q = SearchPosting.query(SearchPosting.term >= token,
+                            SearchPosting.term < token + u'\ufffd')
+    if kind:
+        q = q.filter(SearchPosting.kind == kind)
+
+    scores = {}
+
+    def add(posting):
+        weight = posting.weight
+        if posting.term != token:
+            weight /= 2.0
+        scores[posting.doc] = max(scores.get(posting.doc, 0), weight)
+
+    yield q.map_async(add, batch_size=SEARCH_BATCH_SIZE)
+    raise ndb.Return(scores)
+
+
+def search(query, kind=None, offset=0, limit=20):
+    """Return a page of (SearchDocument, score) tuples matching all terms
+    of query, best match first, and the offset of the next page or None.
+
+    Every term also matches as a prefix, e.g. 'pyth' finds 'python', but
+    at half the weight of an exact match.
+    """
+    tokens = sorted(set(tokenize(query)))
+    if not tokens:
+        return [], None
+
+    # Run one range query per term in parallel.
+    futures = [_termScores(token, kind) for token in tokens]
+
+    scores = None
+    for future in futures:
+        # A document has to match every term.
+        token_scores = future.get_result()
+        if scores is None:
+            scores = token_scores
+        else:
+            scores = {doc: scores[doc] + score
+                      for doc, score in token_scores.items()
+                      if doc in scores}
+
+    ranked = sorted(scores.items(), key=lambda item: (-item[1], item[0]))
+    page = ranked[offset:offset + limit]
+    docs = ndb.get_multi([ndb.Key(SearchDocument, doc) for doc, _ in page])
+
+    next_offset = offset + limit if len(ranked) > offset + limit else None
+    return ([(doc, score) for doc, (_, score) in zip(docs, page) if doc],
+            next_offset)
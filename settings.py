@@ -1,5 +1,3 @@
-import endpoints
-
 # Replace the following lines with client IDs obtained from the APIs
 # Console or Cloud Console.
 WEB_CLIENT_ID = 'replace with Web client ID'
@@ -7,11 +5,60 @@ ANDROID_CLIENT_ID = 'replace with Android client ID'
 IOS_CLIENT_ID = 'replace with iOS client ID'
 ANDROID_AUDIENCE = WEB_CLIENT_ID
 
-EMAIL_SCOPE = endpoints.EMAIL_SCOPE
-API_EXPLORER_CLIENT_ID = endpoints.API_EXPLORER_CLIENT_ID
+# Values of endpoints.EMAIL_SCOPE & endpoints.API_EXPLORER_CLIENT_ID, copied
+# so that modules only reading settings don't have to import endpoints.
+EMAIL_SCOPE = 'https://www.googleapis.com/auth/userinfo.email'
+API_EXPLORER_CLIENT_ID = '292824132082.apps.googleusercontent.com'
 MEMCACHE_ANNOUNCEMENTS_KEY = "RECENT_ANNOUNCEMENTS"
 ANNOUNCEMENT_TPL = ('Last chance to attend! The following conferences '
                     'are nearly sold out: %s')
+MEMCACHE_ROSTER_KEY = "SPEAKER_ROSTER_%s"
+# Cached speaker rosters expire after this many seconds. Once a session has
+# been added, its roster isn't cached again for this many seconds, so that
+# requests which have read the roster before can't cache it.
+ROSTER_EXPIRY = 10 * 60
+ROSTER_LOCK = 5
+MEMCACHE_FEATURED_KEY = "FEATURED_SPEAKER_%s"
+# Cached values (see cachecodec.py) are compressed above this many bytes and
+# split into chunks of at most this many bytes, below the memcache limit;
+# values split into chunks expire after at most this many seconds, so the
+# chunks of overwritten values don't linger. Values updated in place are
+# deleted after this many failed compare-and-set attempts.
+CACHE_COMPRESS_THRESHOLD = 1024
+CACHE_CHUNK_SIZE = 1000 * 1000
+CACHE_CHUNK_EXPIRY = 24 * 60 * 60
+CACHE_CAS_RETRIES = 5
+# In-instance cache of read-mostly values (see localcache.py): entries,
+# seconds kept & seconds between checks of the global version.
+LOCAL_CACHE_SIZE = 1000
+LOCAL_CACHE_TTL = 10 * 60
+LOCAL_CACHE_CHECK_INTERVAL = 5
+MEMCACHE_CACHE_VERSION_KEY = "LOCAL_CACHE_VERSION"
+# Version of the speakers, bumped whenever a session is added to one, which
+# instances check every SPEAKER_INDEX_CHECK_INTERVAL seconds before reading
+# the speakers changed since (SPEAKER_INDEX_SLACK seconds earlier) into their
+# index; they reload all speakers every SPEAKER_INDEX_RELOAD seconds, from a
+# snapshot stored by a cron job.
+MEMCACHE_SPEAKER_INDEX_KEY = "SPEAKER_INDEX_VERSION"
+MEMCACHE_SPEAKER_SNAPSHOT_KEY = "SPEAKER_INDEX_SNAPSHOT"
+SPEAKER_INDEX_CHECK_INTERVAL = 5
+SPEAKER_INDEX_SLACK = 60
+SPEAKER_INDEX_RELOAD = 60 * 60
+MAX_SUGGESTIONS = 20
+# ETags of resources, e.g. ETAG_conference_<websafeConferenceKey>: version
+# counters incremented on writes.
+MEMCACHE_ETAG_KEY = "ETAG_%s_%s"
+MEMCACHE_UPCOMING_KEY = "UPCOMING_CONFERENCES_%d"
+# Sessions in a time window, by conference, start minute & window length.
+MEMCACHE_WINDOW_KEY = "SESSION_WINDOW_%s_%d_%d"
+WINDOW_EXPIRY = 60
+MAX_WINDOW_MINUTES = 24 * 60
+UPCOMING_EXPIRY = 60
+# Conferences with at most this many seats left are announced.
+ANNOUNCEMENT_SEATS_THRESHOLD = 5
+# Conferences re-read per transaction by the announcement cron job; a
+# transaction spans at most 25 entity groups, one being the Announcement.
+ANNOUNCEMENT_RECONCILE_BATCH = 24
 # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
 
 DEFAULTS = {
@@ -30,9 +77,88 @@ OPERATORS = {
     'NE':   '!='
 }
 
+# Largest page size of paginated endpoints.
+MAX_PAGE_SIZE = 100
+
 FIELDS = {
     'CITY': 'city',
     'TOPIC': 'topics',
     'MONTH': 'month',
     'MAX_ATTENDEES': 'maxAttendees',
 }
+
+# Fields of FIELDS with facet counts; each count is spread over FACET_SHARDS
+# entities, of which FACET_APPLY_BATCH are written per transaction (at most
+# 25 entity groups), and cached until the end of the current FACETS_EXPIRY
+# seconds (updated on writes).
+FACET_FIELDS = ('city', 'topics', 'month')
+FACET_SHARDS = 10
+FACET_APPLY_BATCH = 20
+MEMCACHE_FACETS_KEY = "CONFERENCE_FACETS"
+FACETS_EXPIRY = 60 * 60
+
+# Fields covered by full-text search and their weight in the ranking.
+SEARCH_FIELDS = {
+    'Conference': {'name': 3, 'topics': 2, 'description': 1},
+    'Session': {'name': 3, 'highlights': 2},
+}
+
+SEARCH_KINDS = {
+    'CONFERENCE': 'Conference',
+    'SESSION': 'Session',
+}
+
+# Postings read per batch of a search term, all of which are read.
+SEARCH_BATCH_SIZE = 1000
+SEARCH_MAX_RESULTS = 100
+
+SEARCH_STOPWORDS = frozenset([
+    'an', 'and', 'are', 'as', 'at', 'be', 'by', 'for', 'from', 'in', 'is',
+    'it', 'of', 'on', 'or', 'the', 'to', 'with',
+])
+
+# Offline session recommendations: profiles read per batch, neighbours kept
+# per session and minimum number of users having saved both sessions.
+RECOMMENDATION_BATCH_SIZE = 500
+RECOMMENDATION_TOP_K = 10
+RECOMMENDATION_MIN_COUNT = 2
+# The job runs in its own module (see recommendations.yaml), as one task per
+# slice of profiles, whose counts of the pairs of a partition of the
+# sessions have to fit into an entity, and then one task per partition;
+# each task generates at most this many pairs at once. A job without
+# progress for this many seconds is considered dead.
+RECOMMENDATION_SLICE_SIZE = 1000
+RECOMMENDATION_PARTITIONS = 16
+RECOMMENDATION_MAX_PAIRS = 1 << 22
+RECOMMENDATION_JOB_TIMEOUT = 60 * 60
+RECOMMENDATION_MODULE = 'recommendations'
+
+# Attendance aggregation: profiles per batch, batches per task & seconds
+# without progress after which a running job is considered dead.
+ATTENDANCE_BATCH_SIZE = 500
+ATTENDANCE_BATCHES_PER_TASK = 20
+ATTENDANCE_JOB_TIMEOUT = 60 * 60
+
+# Waitlist promotion: rounds of a promote task & seconds after which a task
+# resumes what is left, e.g. entries its query has yet to see.
+WAITLIST_PROMOTE_ROUNDS = 10
+WAITLIST_RETRY_DELAY = 60
+
+# Rate limits of write endpoint methods per user, as (burst capacity,
+# tokens refilled per second).
+RATE_LIMITS = {
+    'createSession': (10, 0.2),
+    'addSessionToWishlist': (30, 0.5),
+    'registerForConference': (5, 0.1),
+}
+MEMCACHE_RATE_LIMIT_KEY = "RATE_LIMIT_%s"
+# Calls whose bucket is still contended after this many compare-and-set
+# attempts are throttled.
+RATE_LIMIT_CAS_RETRIES = 5
+# Throttled calls are counted per method for at most this many seconds.
+MEMCACHE_THROTTLED_KEY = "THROTTLED_%s"
+THROTTLED_EXPIRY = 24 * 60 * 60
+
+# Defaults of migrations: entities per batch & target writes per second.
+MIGRATION_BATCH_SIZE = 100
+MIGRATION_WRITES_PER_SECOND = 20.0
@@ -0,0 +1,187 @@
+import bisect
+import calendar
+import datetime
+import heapq
+import threading
+import time
+
+import cachecodec
+
+from models import Speaker
+
+from settings import MEMCACHE_SPEAKER_INDEX_KEY
+from settings import MEMCACHE_SPEAKER_SNAPSHOT_KEY
+from settings import SPEAKER_INDEX_CHECK_INTERVAL
+from settings import SPEAKER_INDEX_RELOAD
+from settings import SPEAKER_INDEX_SLACK
+
+_clock = time.time
+
+
+def normalize(text):
+    return u' '.join((text or u'').lower().split())
+
+
+def _indexKeys(name):
+    """Return the keys a name is found by: the name from each of its words
+    on, so that 'ada lovelace' is found by 'ada' as well as 'love'."""
+    words = normalize(name).split()
+    return [u' '.join(words[i:]) for i in range(len(words))]
+
+
+class PrefixIndex(object):
+    """Speakers as a sorted array of (key, websafeSpeakerKey), searched by
+    binary search, along with their names & session counts.
+
+    Updates build new arrays which replace the current ones at once, so
+    searches never see an index being modified.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._data = ([], {})
+
+    def __len__(self):
+        return len(self._data[1])
+
+    def load(self, speakers):
+        """Replace the index with speakers, {websafeSpeakerKey: (name,
+        sessionCount)}."""
+        keys = sorted((key, wssk) for wssk, (name, _) in speakers.items()
+                      for key in _indexKeys(name))
+        with self._lock:
+            self._data = (keys, dict(speakers))
+
+    def update(self, speakers):
+        """Add or replace the given speakers, {websafeSpeakerKey: (name,
+        sessionCount)}; updating a speaker again with the same entry
+        changes nothing."""
+        with self._lock:
+            keys, current = self._data
+            keys = list(keys)
+            current = dict(current)
+            for wssk, (name, count) in speakers.items():
+                old = current.get(wssk)
+                if old is None or old[0] != name:
+                    for key in _indexKeys(old[0]) if old else []:
+                        del keys[bisect.bisect_left(keys, (key, wssk))]
+                    for key in _indexKeys(name):
+                        bisect.insort(keys, (key, wssk))
+                current[wssk] = (name, count)
+            self._data = (keys, current)
+
+    def search(self, prefix, limit):
+        """Return up to limit (websafeSpeakerKey, name, sessionCount) of the
+        speakers with a word starting with prefix, most sessions first."""
+        keys, speakers = self._data
+        prefix = normalize(prefix)
+        found = set()
+        i = bisect.bisect_left(keys, (prefix,))
+        while i < len(keys) and keys[i][0].startswith(prefix):
+            found.add(keys[i][1])
+            i += 1
+
+        return heapq.nsmallest(
+            limit, ((wssk,) + speakers[wssk] for wssk in found),
+            key=lambda s: (-s[2], s[1]))
+
+
+_index = PrefixIndex()
+_lock = threading.Lock()
+_loadLock = threading.Lock()
+_state = {'version': None, 'nextCheck': 0, 'nextReload': 0, 'since': None}
+
+
+def _readSpeakers(since=None):
+    """Return {websafeSpeakerKey: (name, sessionCount)} of all speakers, or
+    of those updated since the given time."""
+    query = Speaker.query()
+    if since:
+        query = query.filter(Speaker.updated >= since)
+    return {sp.key.urlsafe(): (sp.name, sp.sessionCount or 0)
+            for sp in query if sp.name}
+
+
+def takeSnapshot():
+    """Read all speakers & store them in memcache for the instances to
+    (re)load their index from; return (time taken, speakers). Used by the
+    speaker snapshot cron job, so that instances don't read all speakers
+    on the path of a request."""
+    taken = calendar.timegm(datetime.datetime.utcnow().utctimetuple())
+    snapshot = (taken, _readSpeakers())
+    cachecodec.set(MEMCACHE_SPEAKER_SNAPSHOT_KEY, snapshot)
+    return snapshot
+
+
+def _update(now, version, reload):
+    """Reload the index from the snapshot of all speakers, or just read the
+    speakers updated since the last update, as of the given version.
+
+    Only the speakers updated since are read, from SPEAKER_INDEX_SLACK
+    seconds before, as the query is eventually consistent and the clocks
+    of instances differ.
+    """
+    started = datetime.datetime.utcnow()
+    if reload:
+        snapshot = cachecodec.get(MEMCACHE_SPEAKER_SNAPSHOT_KEY)
+        # Only taken here if the cron job's one has been evicted.
+        taken, speakers = snapshot or takeSnapshot()
+        _index.load(speakers)
+        since = datetime.datetime.utcfromtimestamp(taken)
+    else:
+        since = _state['since']
+    _index.update(_readSpeakers(
+        since - datetime.timedelta(seconds=SPEAKER_INDEX_SLACK)))
+
+    with _lock:
+        _state['version'] = version
+        _state['since'] = started
+        if reload:
+            _state['nextReload'] = now + SPEAKER_INDEX_RELOAD
+
+
+def load():
+    """Load the index of this instance unless it has been loaded; used by
+    the warmup request. Concurrent callers wait for the load rather than
+    search an empty index."""
+    if _state['since'] is not None:
+        return
+    with _loadLock:
+        if _state['since'] is None:
+            now = _clock()
+            _update(now, cachecodec.getVersion(MEMCACHE_SPEAKER_INDEX_KEY),
+                    True)
+            with _lock:
+                _state['nextCheck'] = now + SPEAKER_INDEX_CHECK_INTERVAL
+
+
+def _refresh(now):
+    """Bring the index of this instance up to date if the version of the
+    speakers has changed; memcache is asked at most once per
+    SPEAKER_INDEX_CHECK_INTERVAL seconds. The index is reloaded from the
+    snapshot every SPEAKER_INDEX_RELOAD seconds.
+    """
+    load()
+    with _lock:
+        if now < _state['nextCheck']:
+            return
+        _state['nextCheck'] = now + SPEAKER_INDEX_CHECK_INTERVAL
+        reload = now >= _state['nextReload']
+
+    version = cachecodec.getVersion(MEMCACHE_SPEAKER_INDEX_KEY)
+    if not reload and version is not None and version == _state['version']:
+        return
+    _update(now, version, reload)
+
+
+def speakersChanged():
+    """Bump the version of the speakers, so that instances refresh their
+    index at their next check. Never fails, a lost bump is caught up by the
+    next one or the periodic reload."""
+    cachecodec.bumpVersion(MEMCACHE_SPEAKER_INDEX_KEY)
+
+
+def suggest(prefix, limit):
+    """Return the speakers matching prefix, see PrefixIndex.search()."""
+    _refresh(_clock())
+    return _index.search(prefix, limit)
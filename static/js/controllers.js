@@ -17,6 +17,14 @@ var conferenceApp = conferenceApp || {};
  */
 conferenceApp.controllers = angular.module('conferenceControllers', ['ui.bootstrap']);
 
+/**
+ * Conferences returned by the conference.getConference API, by websafeConferenceKey.
+ * They are revalidated with their ETag, so that unchanged conferences are not sent again.
+ *
+ * @type {{}}
+ */
+conferenceApp.conferenceCache = conferenceApp.conferenceCache || {};
+
 /**
  * @ngdoc controller
  * @name MyProfileCtrl
@@ -559,8 +567,10 @@ conferenceApp.controllers.controller('ConferenceDetailCtrl', function ($scope, $
      */
     $scope.init = function () {
         $scope.loading = true;
+        var cached = conferenceApp.conferenceCache[$routeParams.websafeConferenceKey];
         gapi.client.conference.getConference({
-            websafeConferenceKey: $routeParams.websafeConferenceKey
+            websafeConferenceKey: $routeParams.websafeConferenceKey,
+            ifNoneMatch: cached && cached.etag
         }).execute(function (resp) {
             $scope.$apply(function () {
                 $scope.loading = false;
@@ -574,7 +584,14 @@ conferenceApp.controllers.controller('ConferenceDetailCtrl', function ($scope, $
                 } else {
                     // The request has succeeded.
                     $scope.alertStatus = 'success';
-                    $scope.conference = resp.result;
+                    if (resp.result.notModified && cached) {
+                        // The conference has not changed since it was cached.
+                        $scope.conference = angular.copy(cached);
+                    } else {
+                        $scope.conference = resp.result;
+                        conferenceApp.conferenceCache[$routeParams.websafeConferenceKey] =
+                            angular.copy(resp.result);
+                    }
                 }
             });
         });
@@ -624,12 +641,17 @@ conferenceApp.controllers.controller('ConferenceDetailCtrl', function ($scope, $
                         return;
                     }
                 } else {
-                    if (resp.result) {
+                    if (resp.result.data) {
                         // Register succeeded.
                         $scope.messages = 'Registered for the conference';
                         $scope.alertStatus = 'success';
                         $scope.isUserAttending = true;
                         $scope.conference.seatsAvailable = $scope.conference.seatsAvailable - 1;
+                    } else if (resp.result.waitlistPosition) {
+                        // The conference is full, the user has been put on the waitlist.
+                        $scope.messages = 'The conference is full, you are number ' +
+                            resp.result.waitlistPosition + ' on the waitlist';
+                        $scope.alertStatus = 'info';
                     } else {
                         $scope.messages = 'Failed to register for the conference';
                         $scope.alertStatus = 'warning';
@@ -0,0 +1,108 @@
+import functools
+import hashlib
+
+from google.appengine.api import taskqueue
+
+
+class TaskBatcher(object):
+    """Collect the push tasks of a request and enqueue them in one batch.
+
+    Every task gets a name derived from its url and params, so the same work
+    scheduled twice (e.g. by a retried request) is only executed once. Tasks
+    added with the same coalesce key replace each other, only the last one
+    is enqueued.
+    """
+
+    # Queue.add() accepts at most this many tasks per call.
+    MAX_BATCH = taskqueue.MAX_TASKS_PER_ADD
+
+    def __init__(self, queue_name='default'):
+        self.queue_name = queue_name
+        self._tasks = {}
+        self._order = []
+
+    def add(self, url, params, coalesce=None, named=True, countdown=None,
+            target=None):
+        """Schedule a task; it is enqueued when flush() is called.
+
+        Pass named=False for work that must be repeated by later requests
+        with the same params, e.g. reindexing an updated entity, and the
+        name of a module as target to run the task there.
+        """
+        key = coalesce or (url, tuple(sorted(params.items())))
+        if key not in self._tasks:
+            self._order.append(key)
+        self._tasks[key] = taskqueue.Task(
+            url=url, params=params, countdown=countdown, target=target,
+            name=self._taskName(url, params) if named else None)
+
+    def flush(self):
+        """Enqueue all scheduled tasks and return their number."""
+        tasks = [self._tasks[key] for key in self._order]
+        self._tasks = {}
+        self._order = []
+
+        queue = taskqueue.Queue(self.queue_name)
+        for i in range(0, len(tasks), self.MAX_BATCH):
+            try:
+                queue.add(tasks[i:i + self.MAX_BATCH])
+            except (taskqueue.TaskAlreadyExistsError,
+                    taskqueue.TombstonedTaskError):
+                # The remaining tasks of the batch have been added anyway,
+                # the duplicates have already been executed or are pending.
+                pass
+        return len(tasks)
+
+    @staticmethod
+    def _taskName(url, params):
+        """Return a deterministic task name for url and params."""
+        digest = hashlib.sha1(url)
+        for name, value in sorted(params.items()):
+            digest.update((u'\0%s=%s' % (name, value)).encode('utf-8'))
+        return '%s-%s' % (url.strip('/').replace('/', '-'),
+                          digest.hexdigest())
+
+
+class StepChain(object):
+    """Run a job as a chain of push tasks, one per step.
+
+    Every step checkpoints the progress of the job, e.g. in an entity also
+    holding the step reached, and then enqueues the next step. The tasks are
+    named, so a step is only enqueued once per run.
+    """
+
+    def __init__(self, url, target=None):
+        self.url = url
+        self.target = target
+
+    def enqueue(self, params, step, countdown=None):
+        """Enqueue step of the job with params."""
+        tasks = TaskBatcher()
+        tasks.add(self.url, dict(params, step=step), countdown=countdown,
+                  target=self.target)
+        tasks.flush()
+
+    def resume(self, params, step, checkpoint):
+        """Return whether step has already been run, enqueueing the step of
+        the checkpoint again if so; to be called at the start of a step."""
+        if step < checkpoint:
+            # The checkpoint has been saved, but enqueueing the next step
+            # failed.
+            self.enqueue(params, checkpoint)
+            return True
+        return False
+
+
+def batchTasks(func):
+    """Decorator providing a request-scoped TaskBatcher as self.tasks.
+
+    The tasks are enqueued with a single flush, and only if the decorated
+    method returns without raising.
+    """
+    @functools.wraps(func)
+    def wrapper(self, *args, **kwargs):
+        self.tasks = TaskBatcher()
+        result = func(self, *args, **kwargs)
+        self.tasks.flush()
+        return result
+    return wrapper
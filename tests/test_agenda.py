@@ -0,0 +1,106 @@
+import itertools
+import random
+import unittest
+
+import agenda
+
+
+def overlaps(a, b):
+    return a[0] < b[1] and b[0] < a[1]
+
+
+def randomEntries(rnd, n):
+    entries = []
+    for i in range(n):
+        if rnd.random() < 0.1:
+            entries.append([None, None, 'k%d' % i, 'unscheduled'])
+        else:
+            start = rnd.randrange(0, 600, 15)
+            end = start + rnd.choice([0, 15, 30, 60, 90, 240])
+            entries.append([start, end, 'k%d' % i, 'session %d' % i])
+    return entries
+
+
+class AgendaTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.rnd = random.Random(42)
+
+    def testFindConflicts(self):
+        for n in range(25):
+            entries = randomEntries(self.rnd, n)
+            scheduled = [e for e in entries if e[0] is not None]
+            expected = {frozenset((a[2], b[2]))
+                        for a, b in itertools.combinations(scheduled, 2)
+                        if overlaps(a, b)}
+            found = [frozenset((a[2], b[2]))
+                     for a, b in agenda.findConflicts(entries)]
+            self.assertEqual(len(found), len(set(found)))
+            self.assertEqual(set(found), expected)
+
+    def testMaxNonConflicting(self):
+        for n in range(12):
+            entries = randomEntries(self.rnd, n)
+            scheduled = [e for e in entries if e[0] is not None]
+            chosen = agenda.maxNonConflicting(entries)
+            for a, b in itertools.combinations(chosen, 2):
+                self.assertFalse(overlaps(a, b))
+
+            best = max(size for size in range(len(scheduled) + 1)
+                       for subset in itertools.combinations(scheduled, size)
+                       if not any(overlaps(a, b) for a, b in
+                                  itertools.combinations(subset, 2)))
+            self.assertEqual(len(chosen), best)
+
+    def testConflictsWith(self):
+        for n in range(40):
+            entries = sorted(randomEntries(self.rnd, n), key=agenda.sortKey)
+            entry = randomEntries(self.rnd, 1)[0]
+            expected = [e for e in entries if entry[0] is not None and
+                        e[0] is not None and overlaps(e, entry)]
+            self.assertEqual(agenda.conflictsWith(
+                entries, entry, agenda.maxDuration(entries)), expected)
+
+    def testConflictsWithUnscheduled(self):
+        entries = [[0, 60, 'a', 'a'], [None, None, 'b', 'b']]
+        self.assertEqual(
+            agenda.conflictsWith(entries, [None, None, 'c', 'c'], 60), [])
+        self.assertEqual(
+            agenda.conflictsWith(entries, [30, 90, 'c', 'c'], 60),
+            [entries[0]])
+
+    def testMaxDuration(self):
+        self.assertEqual(agenda.maxDuration([]), 0)
+        self.assertEqual(agenda.maxDuration(
+            [[0, 30, 'a', 'a'], [10, 100, 'b', 'b'], [None, None, 'c', 'c']]),
+            90)
+
+    def testInsertEntry(self):
+        entries = []
+        inserted = randomEntries(self.rnd, 50)
+        for entry in inserted:
+            agenda.insertEntry(entries, entry)
+            keys = [agenda.sortKey(e) for e in entries]
+            self.assertEqual(keys, sorted(keys))
+            # After the entries sorting equal to it.
+            i = entries.index(entry)
+            self.assertTrue(i + 1 == len(entries) or
+                            keys[i + 1] > keys[i])
+        self.assertEqual(sorted(e[2] for e in entries),
+                         sorted(e[2] for e in inserted))
+
+    def testInWindow(self):
+        for n in range(40):
+            timeline = sorted((e for e in randomEntries(self.rnd, n)
+                               if e[0] is not None), key=agenda.sortKey)
+            max_duration = max([e[1] - e[0] for e in timeline] or [0])
+            start = self.rnd.randrange(0, 600, 15)
+            end = start + self.rnd.choice([15, 60, 120])
+            expected = [e for e in timeline
+                        if e[0] < end and (e[1] > start or e[0] >= start)]
+            self.assertEqual(
+                agenda.inWindow(timeline, start, end, max_duration), expected)
+
+
+if __name__ == '__main__':
+    unittest.main()
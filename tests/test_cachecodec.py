@@ -0,0 +1,233 @@
+import os
+import unittest
+
+from protorpc import messages
+
+from google.appengine.api import memcache
+from google.appengine.ext import testbed
+
+import cachecodec
+
+
+class Color(messages.Enum):
+    RED = 1
+    GREEN = 2
+
+
+class Inner(messages.Message):
+    name = messages.StringField(1)
+    tags = messages.StringField(2, repeated=True)
+    color = messages.EnumField(Color, 3)
+
+
+class Outer(messages.Message):
+    title = messages.StringField(1)
+    count = messages.IntegerField(2)
+    ratio = messages.FloatField(3)
+    flag = messages.BooleanField(4)
+    inner = messages.MessageField(Inner, 5)
+    items = messages.MessageField(Inner, 6, repeated=True)
+    colors = messages.EnumField(Color, 7, repeated=True)
+    data = messages.BytesField(8)
+
+
+class OuterV1(messages.Message):
+    """Outer as it was before fields 3 to 8 were added."""
+    title = messages.StringField(1)
+    count = messages.IntegerField(2)
+
+
+def outer(n=3):
+    return Outer(
+        title=u'Caf\xe9', count=-7, ratio=0.5, flag=False,
+        inner=Inner(name=u'inner', tags=[u'a', u'b'], color=Color.GREEN),
+        items=[Inner(name=u'item %d' % i, tags=[u't%d' % i] * i,
+                     color=Color.RED if i % 2 else None) for i in range(n)],
+        colors=[Color.GREEN, Color.RED, Color.GREEN], data=b'\x00\xff')
+
+
+class EncodeTestCase(unittest.TestCase):
+
+    def testMessageRoundTrip(self):
+        for msg in [outer(), Outer(), Outer(items=[]), Outer(count=0)]:
+            data = cachecodec.encode(msg)
+            self.assertEqual(data[0], cachecodec.MESSAGE)
+            self.assertEqual(cachecodec.decode(data, Outer), msg)
+
+    def testUnassignedFieldsStayUnassigned(self):
+        decoded = cachecodec.decode(cachecodec.encode(Outer(count=0)), Outer)
+        self.assertEqual(decoded.count, 0)
+        self.assertIsNone(decoded.get_assigned_value('title'))
+        self.assertEqual(decoded.items, [])
+
+    def testEnums(self):
+        decoded = cachecodec.decode(cachecodec.encode(outer()), Outer)
+        self.assertIs(decoded.inner.color, Color.GREEN)
+        self.assertEqual(list(decoded.colors),
+                         [Color.GREEN, Color.RED, Color.GREEN])
+
+    def testUnknownFieldsAreSkipped(self):
+        decoded = cachecodec.decode(cachecodec.encode(outer()), OuterV1)
+        self.assertEqual(decoded, OuterV1(title=u'Caf\xe9', count=-7))
+
+    def testValueRoundTrip(self):
+        for value in [None, 0, u'', [], {}, [u'a', 1, 2.5, None],
+                      {u'k': [u'name', 3]}, (1, u'x')]:
+            data = cachecodec.encode(value)
+            self.assertEqual(data[0], cachecodec.VALUE)
+            self.assertEqual(cachecodec.decode(data), value)
+
+    def testCompression(self):
+        small = cachecodec.encode(outer(1))
+        self.assertEqual(small[0], cachecodec.MESSAGE)
+
+        msg = outer(200)
+        data = cachecodec.encode(msg)
+        self.assertEqual(data[0], cachecodec.MESSAGE.upper())
+        self.assertEqual(cachecodec.decode(data, Outer), msg)
+
+        value = [u'python'] * 1000
+        data = cachecodec.encode(value)
+        self.assertEqual(data[0], cachecodec.VALUE.upper())
+        self.assertEqual(cachecodec.decode(data), value)
+
+    def testIncompressibleValuesAreStoredAsIs(self):
+        value = os.urandom(4096)
+        self.assertEqual(cachecodec.encode(value)[0], cachecodec.VALUE)
+
+
+class MemcacheTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.testbed = testbed.Testbed()
+        self.testbed.activate()
+        self.testbed.init_memcache_stub()
+
+    def tearDown(self):
+        self.testbed.deactivate()
+
+    def testSetGet(self):
+        self.assertTrue(cachecodec.set('k', outer()))
+        self.assertEqual(cachecodec.get('k', Outer), outer())
+        self.assertTrue(cachecodec.set('v', {u'a': 1}))
+        self.assertEqual(cachecodec.get('v'), {u'a': 1})
+        self.assertIsNone(cachecodec.get('missing'))
+
+    def testChunking(self):
+        # Random bytes don't compress, so this needs 3 chunks.
+        value = [os.urandom(1000) for _ in range(
+            2 * cachecodec.CACHE_CHUNK_SIZE // 1000 + 100)]
+        self.assertTrue(cachecodec.set('k', value))
+        self.assertEqual(memcache.get('k')[0], cachecodec.CHUNKED)
+        self.assertEqual(cachecodec.get('k'), value)
+
+        # A rewrite uses new chunk keys, the reader never mixes them.
+        value[0] = os.urandom(1000)
+        self.assertTrue(cachecodec.set('k', value))
+        self.assertEqual(cachecodec.get('k'), value)
+
+    def testEvictedChunkIsAMiss(self):
+        value = [os.urandom(1000) for _ in range(
+            cachecodec.CACHE_CHUNK_SIZE // 1000 + 100)]
+        self.assertTrue(cachecodec.set('k', value))
+        count, token = cachecodec.marshal.loads(memcache.get('k')[1:])
+        memcache.delete(cachecodec._chunkKeys('k', count, token)[-1])
+        self.assertIsNone(cachecodec.get('k'))
+
+    def testUndecodableEntryIsAMiss(self):
+        memcache.set('k', 'm\x00garbage')
+        self.assertIsNone(cachecodec.get('k', Outer))
+        memcache.set('k', 42)
+        self.assertIsNone(cachecodec.get('k'))
+
+    def testDelete(self):
+        cachecodec.set('k', [1, 2])
+        cachecodec.delete('k')
+        self.assertIsNone(cachecodec.get('k'))
+
+    def testDeleteChunks(self):
+        value = [os.urandom(1000) for _ in range(
+            cachecodec.CACHE_CHUNK_SIZE // 1000 + 100)]
+        cachecodec.set('k', value)
+        count, token = cachecodec.marshal.loads(memcache.get('k')[1:])
+        keys = cachecodec._chunkKeys('k', count, token)
+        self.assertEqual(len(memcache.get_multi(keys)), 2)
+        cachecodec.delete('k')
+        self.assertIsNone(memcache.get('k'))
+        self.assertEqual(memcache.get_multi(keys), {})
+
+    def testAdd(self):
+        self.assertTrue(cachecodec.add('k', [1]))
+        self.assertFalse(cachecodec.add('k', [2]))
+        self.assertEqual(cachecodec.get('k'), [1])
+
+        # Not added again while locked by a delete.
+        cachecodec.delete('k', seconds=60)
+        self.assertFalse(cachecodec.add('k', [2]))
+        self.assertIsNone(cachecodec.get('k'))
+        self.assertTrue(cachecodec.set('k', [3]))
+        self.assertEqual(cachecodec.get('k'), [3])
+
+    def testAddChunked(self):
+        value = [os.urandom(1000) for _ in range(
+            cachecodec.CACHE_CHUNK_SIZE // 1000 + 100)]
+        self.assertTrue(cachecodec.add('k', value))
+        self.assertEqual(cachecodec.get('k'), value)
+        # The chunks of a value which isn't added are deleted.
+        stats = memcache.get_stats()['items']
+        self.assertFalse(cachecodec.add('k', value[1:]))
+        self.assertEqual(memcache.get_stats()['items'], stats)
+        self.assertEqual(cachecodec.get('k'), value)
+
+    def testChunksExpire(self):
+        value = [os.urandom(1000) for _ in range(
+            cachecodec.CACHE_CHUNK_SIZE // 1000 + 100)]
+        times = []
+        set_multi = memcache.set_multi
+        memcache.set_multi = lambda mapping, time=0: (
+            times.append(time) or set_multi(mapping, time=time))
+        try:
+            cachecodec.set('k', value)
+            cachecodec.set('k', value, time=60)
+        finally:
+            memcache.set_multi = set_multi
+        self.assertEqual(times, [cachecodec.CACHE_CHUNK_EXPIRY, 60])
+
+    def testUpdate(self):
+        def add(value):
+            return value + [len(value)]
+        self.assertFalse(cachecodec.update('k', add))
+        self.assertIsNone(cachecodec.get('k'))
+        cachecodec.set('k', [0])
+        self.assertTrue(cachecodec.update('k', add))
+        self.assertEqual(cachecodec.get('k'), [0, 1])
+
+        value = [os.urandom(1000) for _ in range(
+            cachecodec.CACHE_CHUNK_SIZE // 1000 + 100)]
+        cachecodec.set('k', value)
+        self.assertTrue(cachecodec.update('k', lambda value: value[1:]))
+        self.assertEqual(cachecodec.get('k'), value[1:])
+
+    def testUpdateContended(self):
+        cachecodec.set('k', 0)
+
+        def add(value):
+            # Changed by another writer every time.
+            memcache.set('k', cachecodec.encode(value - 1))
+            return value + 1
+        self.assertFalse(cachecodec.update('k', add))
+        self.assertIsNone(cachecodec.get('k'))
+
+    def testVersion(self):
+        version = cachecodec.getVersion('v')
+        self.assertIsNotNone(version)
+        self.assertEqual(cachecodec.getVersion('v'), version)
+        cachecodec.bumpVersion('v')
+        self.assertEqual(cachecodec.getVersion('v'), version + 1)
+        # An evicted version starts over elsewhere.
+        memcache.delete('v')
+        self.assertNotIn(cachecodec.getVersion('v'), (None, version + 1))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,148 @@
+import unittest
+
+from google.appengine.datastore import datastore_stub_util
+from google.appengine.ext import ndb
+from google.appengine.ext import testbed
+
+import facets
+
+from models import FacetChange
+from models import FacetShard
+
+
+class Conf(object):
+    """Stand-in for a Conference with its facet fields."""
+
+    def __init__(self, id, city=None, topics=(), month=0):
+        self.key = ndb.Key('Conference', id)
+        self.city = city
+        self.topics = list(topics)
+        self.month = month
+
+
+class CountKeyTestCase(unittest.TestCase):
+
+    def testRoundTrip(self):
+        values = [('city', u'A|B'), ('topics', u'x:y'), ('month', 3),
+                  ('topics', u'["]\\'), ('city', u'Z\xfcrich')]
+        for a in values:
+            self.assertEqual(facets.decodeKey(facets.countKey(a)), [a])
+            for b in values:
+                if a != b:
+                    self.assertEqual(
+                        sorted(facets.decodeKey(facets.countKey(a, b))),
+                        sorted([a, b]))
+
+    def testUnambiguous(self):
+        pair = facets.countKey(('city', u'a'), ('city', u'b'))
+        single = facets.countKey(('city', u'a|city:b'))
+        self.assertNotEqual(pair, single)
+        self.assertEqual(facets.countKey(('month', 1)),
+                         facets.countKey(('month', 1)))
+        self.assertNotEqual(facets.countKey(('month', 1)),
+                            facets.countKey(('month', u'1')))
+
+    def testOrderIndependent(self):
+        a, b = ('city', u'Paris'), ('topics', u'Web')
+        self.assertEqual(facets.countKey(a, b), facets.countKey(b, a))
+
+    def testCountKeys(self):
+        values = {('city', u'Paris'), ('topics', u'Web'), ('month', 5)}
+        keys = facets._countKeys(values)
+        self.assertEqual(len(keys), 3 + 3)
+        self.assertEqual(len(set(keys)), len(keys))
+
+
+class FacetCountsTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.testbed = testbed.Testbed()
+        self.testbed.activate()
+        self.testbed.init_datastore_v3_stub(
+            consistency_policy=datastore_stub_util.
+            PseudoRandomHRConsistencyPolicy(probability=1))
+        self.testbed.init_memcache_stub()
+        self.testbed.init_taskqueue_stub()
+        ndb.get_context().set_cache_policy(False)
+
+    def tearDown(self):
+        self.testbed.deactivate()
+
+    def applyAll(self):
+        for key in FacetChange.query().fetch(keys_only=True):
+            facets.applyChange(key.id())
+
+    def testCountsAndCondition(self):
+        facets.updateFacets(Conf(1, u'A|B', [u'Web', u'x:y'], 3))
+        facets.updateFacets(Conf(2, u'A|B', [u'Web'], 4))
+        self.applyAll()
+
+        self.assertEqual(facets.facetCounts(), {
+            'city': {u'A|B': 2},
+            'topics': {u'Web': 2, u'x:y': 1},
+            'month': {u'3': 1, u'4': 1}})
+        self.assertEqual(facets.facetCounts(('topics', u'x:y')), {
+            'city': {u'A|B': 1}, 'topics': {u'Web': 1}, 'month': {u'3': 1}})
+        self.assertEqual(facets.facetCounts(('city', u'A|B'))['topics'],
+                         {u'Web': 2, u'x:y': 1})
+
+    def testUpdateMovesCounts(self):
+        conf = Conf(1, u'Paris', [u'Web'], 3)
+        facets.updateFacets(conf)
+        conf.city = u'Rome'
+        facets.updateFacets(conf)
+        # Unchanged values record no change.
+        facets.updateFacets(conf)
+        self.assertEqual(FacetChange.query().count(), 2)
+        self.applyAll()
+        self.assertEqual(facets.facetCounts()['city'], {u'Rome': 1})
+
+    def testApplyIsIdempotent(self):
+        facets.updateFacets(Conf(1, u'Paris', [u'Web'], 3))
+        key = FacetChange.query().get(keys_only=True)
+        facets.applyChange(key.id())
+        facets.applyChange(key.id())
+        self.assertIsNone(key.get())
+        self.assertEqual(facets.facetCounts()['topics'], {u'Web': 1})
+
+    def testBatches(self):
+        topics = [u'topic %d' % i for i in range(10)]
+        facets.updateFacets(Conf(1, u'Paris', topics, 3))
+        self.applyAll()
+        counts = facets.facetCounts()
+        self.assertEqual(counts['topics'], dict.fromkeys(topics, 1))
+        # One shard per count written, 12 values and 66 pairs.
+        self.assertEqual(FacetShard.query().count(), 12 + 66)
+
+    def testCachedCountsAreUpdated(self):
+        facets.updateFacets(Conf(1, u'Paris', [u'Web'], 3))
+        self.applyAll()
+        self.assertEqual(facets.facetCounts()['city'], {u'Paris': 1})
+
+        conf = Conf(2, u'Paris', [u'Web'], 4)
+        facets.updateFacets(conf)
+        conf.city = u'Rome'
+        facets.updateFacets(conf)
+        self.applyAll()
+        # Read from the cache, which isn't summed again.
+        query = FacetShard.query
+        FacetShard.query = None
+        try:
+            counts = facets.facetCounts()
+        finally:
+            FacetShard.query = query
+        self.assertEqual(counts['city'], {u'Paris': 1, u'Rome': 1})
+        self.assertEqual(counts['month'], {u'3': 1, u'4': 1})
+
+    def testBackfill(self):
+        conf = Conf(1, u'Paris', [u'Web'], 3)
+        writes = facets.facetChanges(conf)
+        ndb.put_multi(writes)
+        # Counted conferences aren't counted again.
+        self.assertEqual(facets.facetChanges(conf), [])
+        self.applyAll()
+        self.assertEqual(facets.facetCounts()['city'], {u'Paris': 1})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,157 @@
+import threading
+import unittest
+
+from google.appengine.api import memcache
+from google.appengine.ext import testbed
+
+import cachecodec
+import localcache
+
+
+class LocalCacheTestCase(unittest.TestCase):
+
+    def testLeastRecentlyUsedIsEvicted(self):
+        cache = localcache.LocalCache(2, 60)
+        cache.set('a', 1, 0)
+        cache.set('b', 2, 0)
+        self.assertEqual(cache.get('a', 0), (True, 1))
+        cache.set('c', 3, 0)
+        self.assertEqual(cache.get('b', 0), (False, None))
+        self.assertEqual(cache.get('a', 0), (True, 1))
+        self.assertEqual(cache.get('c', 0), (True, 3))
+        self.assertEqual(len(cache), 2)
+
+    def testEntriesExpire(self):
+        cache = localcache.LocalCache(10, 60)
+        cache.set('a', 1, 0)
+        self.assertEqual(cache.get('a', 59.9), (True, 1))
+        self.assertEqual(cache.get('a', 60), (False, None))
+        # Expired entries are dropped when read.
+        self.assertEqual(len(cache), 0)
+
+    def testOverwriteRenewsEntry(self):
+        cache = localcache.LocalCache(2, 60)
+        cache.set('a', 1, 0)
+        cache.set('b', 2, 0)
+        cache.set('a', 10, 30)
+        cache.set('c', 3, 30)
+        self.assertEqual(cache.get('a', 80), (True, 10))
+        self.assertEqual(cache.get('b', 30), (False, None))
+
+    def testNoneIsAValue(self):
+        cache = localcache.LocalCache(2, 60)
+        cache.set('a', None, 0)
+        self.assertEqual(cache.get('a', 0), (True, None))
+
+    def testThreads(self):
+        cache = localcache.LocalCache(50, 60)
+        errors = []
+
+        def work(n):
+            try:
+                for i in range(2000):
+                    key = (n * 7 + i) % 80
+                    cache.set(key, key, 0)
+                    found, value = cache.get((key + 1) % 80, 0)
+                    if found and value != (key + 1) % 80:
+                        errors.append((key, value))
+            except Exception as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=work, args=(n,))
+                   for n in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errors, [])
+        self.assertLessEqual(len(cache), 50)
+
+
+class TwoTierTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.testbed = testbed.Testbed()
+        self.testbed.activate()
+        self.testbed.init_memcache_stub()
+        self.now = 1000.0
+        self.clock = localcache._clock
+        localcache._clock = lambda: self.now
+        localcache._cache.clear()
+        localcache._state.update(version=None, nextCheck=0)
+        localcache._stats.clear()
+
+    def tearDown(self):
+        localcache._clock = self.clock
+        localcache._cache.clear()
+        self.testbed.deactivate()
+
+    def testReadsThroughMemcache(self):
+        cachecodec.set('k', [1, 2])
+        self.assertEqual(localcache.get('k'), [1, 2])
+        # Served by the instance even once memcache has changed.
+        cachecodec.set('k', [3])
+        self.assertEqual(localcache.get('k'), [1, 2])
+        stats = localcache.stats()
+        self.assertEqual(stats['local']['hits'], 1)
+        self.assertEqual(stats['memcache']['hits'], 1)
+
+    def testMissesAreCached(self):
+        self.assertIsNone(localcache.get('k'))
+        cachecodec.set('k', u'value')
+        self.assertIsNone(localcache.get('k'))
+        self.assertEqual(localcache.stats()['memcache']['misses'], 1)
+
+    def testSetInvalidatesOtherInstances(self):
+        cachecodec.set('k', u'old')
+        self.assertEqual(localcache.get('k'), u'old')
+
+        # Another instance sets a value: its write bumps the version, which
+        # this instance only notices at its next check.
+        version = memcache.get(localcache.MEMCACHE_CACHE_VERSION_KEY)
+        cachecodec.set('k', u'new')
+        memcache.incr(localcache.MEMCACHE_CACHE_VERSION_KEY)
+        self.assertEqual(localcache.get('k'), u'old')
+
+        self.now += localcache.LOCAL_CACHE_CHECK_INTERVAL
+        self.assertEqual(localcache.get('k'), u'new')
+        self.assertNotEqual(
+            memcache.get(localcache.MEMCACHE_CACHE_VERSION_KEY), version)
+
+    def testSetUpdatesLocalCopy(self):
+        self.assertIsNone(localcache.get('k'))
+        localcache.set('k', {u'a': 1})
+        self.assertEqual(localcache.get('k'), {u'a': 1})
+        self.assertEqual(cachecodec.get('k'), {u'a': 1})
+
+    def testEvictedVersionInvalidates(self):
+        cachecodec.set('k', u'old')
+        self.assertEqual(localcache.get('k'), u'old')
+        memcache.flush_all()
+        cachecodec.set('k', u'new')
+        self.now += localcache.LOCAL_CACHE_CHECK_INTERVAL
+        self.assertEqual(localcache.get('k'), u'new')
+
+    def testVersionIsCheckedAtIntervals(self):
+        for _ in range(10):
+            localcache.get('k')
+            self.now += 1
+        self.assertEqual(localcache.stats()['versionChecks'],
+                         -(-10 // localcache.LOCAL_CACHE_CHECK_INTERVAL))
+
+    def testStats(self):
+        self.assertIsNone(localcache.stats()['local']['hitRate'])
+        cachecodec.set('k', 1)
+        localcache.get('k')
+        localcache.get('k')
+        localcache.get('k')
+        localcache.get('other')
+        stats = localcache.stats()
+        self.assertEqual(stats['local'], {'hits': 2, 'misses': 2,
+                                          'hitRate': 0.5, 'entries': 2})
+        self.assertEqual(stats['memcache'], {'hits': 1, 'misses': 1,
+                                             'hitRate': 0.5})
+
+
+if __name__ == '__main__':
+    unittest.main()
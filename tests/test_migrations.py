@@ -0,0 +1,167 @@
+import unittest
+
+from google.appengine.datastore import datastore_stub_util
+from google.appengine.ext import ndb
+from google.appengine.ext import testbed
+
+import migrations
+import searchindex
+
+from models import Conference
+from models import MigrationState
+from models import Session
+
+
+class Item(ndb.Model):
+    value = ndb.IntegerProperty()
+
+
+class MigrationsTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.testbed = testbed.Testbed()
+        self.testbed.activate()
+        self.testbed.init_datastore_v3_stub(
+            consistency_policy=datastore_stub_util.
+            PseudoRandomHRConsistencyPolicy(probability=1))
+        self.testbed.init_memcache_stub()
+        self.testbed.init_taskqueue_stub()
+        self.taskqueue = self.testbed.get_stub(testbed.TASKQUEUE_SERVICE_NAME)
+        ndb.get_context().set_cache_policy(False)
+        self.during = None
+        migrations.migration('items', Item)(self.transform)
+        migrations.migration('checked_items', Item, recheck=True)(
+            self.transform)
+        ndb.put_multi([Item(value=i % 2 or None) for i in range(10)])
+
+    def tearDown(self):
+        del migrations.MIGRATIONS['items']
+        del migrations.MIGRATIONS['checked_items']
+        self.testbed.deactivate()
+
+    def transform(self, item):
+        if self.during:
+            self.during()
+        if item.value is not None:
+            return None
+        item.value = 2
+        return [item]
+
+    def runTasks(self, limit=None):
+        """Run the enqueued steps, at most limit of them; return their
+        number."""
+        steps = 0
+        while limit is None or steps < limit:
+            tasks = self.taskqueue.get_filtered_tasks(
+                url=migrations.TASK_URL)
+            if not tasks:
+                break
+            self.taskqueue.FlushQueue('default')
+            for task in tasks:
+                params = task.extract_params()
+                migrations.runStep(params['name'], params['run'],
+                                   int(params['step']))
+                steps += 1
+        return steps
+
+    def state(self, name='items'):
+        return ndb.Key(MigrationState, name).get()
+
+    def values(self):
+        return sorted(item.value for item in Item.query())
+
+    def checkBatches(self, name):
+        migrations.startMigration(name, 3, 100.0)
+        self.assertEqual(self.runTasks(), 4)
+        state = self.state(name)
+        self.assertEqual((state.status, state.processed, state.changed),
+                         ('done', 10, 5))
+        self.assertEqual(self.values(), [1] * 5 + [2] * 5)
+
+    def testBatches(self):
+        self.checkBatches('items')
+
+    def testBatchesRechecked(self):
+        self.checkBatches('checked_items')
+
+    def testDryRun(self):
+        migrations.startMigration('items', 4, 100.0, dry_run=True)
+        self.runTasks()
+        state = self.state()
+        self.assertEqual((state.status, state.processed, state.changed),
+                         ('done', 10, 5))
+        self.assertEqual(self.values(), [None] * 5 + [1] * 5)
+        self.assertFalse(migrations.isCompleted('items'))
+
+    def testIsCompleted(self):
+        self.assertFalse(migrations.isCompleted('items'))
+        migrations.startMigration('items', 4, 100.0)
+        self.assertFalse(migrations.isCompleted('items'))
+        self.runTasks()
+        self.assertTrue(migrations.isCompleted('items'))
+        # Stays completed when run again.
+        migrations.startMigration('items', 4, 100.0, dry_run=True)
+        self.assertTrue(migrations.isCompleted('items'))
+
+    def testAlreadyRunning(self):
+        migrations.startMigration('items', 4, 100.0)
+        self.assertRaises(migrations.MigrationError,
+                          migrations.startMigration, 'items', 4, 100.0)
+
+    def testStopAndResume(self):
+        migrations.startMigration('items', 4, 100.0)
+        self.runTasks(limit=1)
+        migrations.stopMigration('items')
+        self.runTasks()
+        state = self.state()
+        self.assertEqual((state.status, state.processed), ('stopped', 4))
+
+        migrations.startMigration('items', 4, 100.0)
+        self.runTasks()
+        state = self.state()
+        self.assertEqual((state.status, state.processed, state.changed),
+                         ('done', 10, 5))
+
+    def testRestart(self):
+        migrations.startMigration('items', 4, 100.0)
+        self.runTasks(limit=1)
+        migrations.stopMigration('items')
+        migrations.startMigration('items', 4, 100.0, restart=True)
+        self.runTasks()
+        self.assertEqual(self.state().processed, 10)
+
+    def testStopDuringStep(self):
+        self.during = lambda: migrations.stopMigration('items')
+        migrations.startMigration('items', 4, 100.0)
+        self.assertEqual(self.runTasks(), 1)
+        state = self.state()
+        self.assertEqual((state.status, state.processed), ('stopped', 4))
+
+        self.during = None
+        migrations.startMigration('items', 4, 100.0)
+        self.runTasks()
+        self.assertEqual(self.state().processed, 10)
+        self.assertEqual(self.values(), [1] * 5 + [2] * 5)
+
+    def testSearch(self):
+        conf = Conference(name=u'Python Summit')
+        conf.put()
+        Session(name=u'Python Basics', parent=conf.key).put()
+        indexed = Session(name=u'Python Tricks', parent=conf.key)
+        indexed.put()
+        searchindex.indexEntity(indexed)
+
+        migrations.startMigration('search', 1, 100.0)
+        self.runTasks()
+        state = self.state('search')
+        # Two postings and a document for each of the others.
+        self.assertEqual((state.status, state.kind, state.processed,
+                          state.changed), ('done', 'Session', 3, 2 * 3))
+        hits, _ = searchindex.search(u'python')
+        self.assertEqual(sorted(doc.title for doc, _ in hits),
+                         [u'Python Basics', u'Python Summit',
+                          u'Python Tricks'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,100 @@
+import unittest
+
+from google.appengine.api import memcache
+from google.appengine.ext import testbed
+
+import ratelimit
+
+
+class LocalBucketsTestCase(unittest.TestCase):
+
+    def testBurstAndRefill(self):
+        buckets = ratelimit.LocalBuckets()
+        self.assertEqual([buckets.take('k', 3, 0.5, 0) for _ in range(4)],
+                         [True, True, True, False])
+        self.assertFalse(buckets.take('k', 3, 0.5, 1.9))
+        self.assertTrue(buckets.take('k', 3, 0.5, 2.1))
+        # Another key has a bucket of its own.
+        self.assertTrue(buckets.take('other', 3, 0.5, 2.1))
+
+    def testCapacity(self):
+        buckets = ratelimit.LocalBuckets()
+        self.assertTrue(buckets.take('k', 2, 1, 0))
+        # A bucket idle for long is only refilled up to its capacity.
+        self.assertEqual([buckets.take('k', 2, 1, 100) for _ in range(3)],
+                         [True, True, False])
+
+
+class TakeTokenTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.testbed = testbed.Testbed()
+        self.testbed.activate()
+        self.testbed.init_memcache_stub()
+
+    def tearDown(self):
+        self.testbed.deactivate()
+
+    def allowed(self, times, capacity=10, rate=0.2):
+        return sum(ratelimit._takeToken('k', capacity, rate, t)
+                   for t in times)
+
+    def testBurst(self):
+        self.assertEqual(self.allowed([0] * 15), 10)
+        self.assertFalse(ratelimit._takeToken('k', 10, 0.2, 4.9))
+        self.assertTrue(ratelimit._takeToken('k', 10, 0.2, 5.1))
+
+    def testNoDoubleBurst(self):
+        # Ten seconds of calls get no more than the capacity plus the
+        # refill.
+        times = [45 + i * 0.1 for i in range(100)]
+        self.assertEqual(self.allowed(times), 10 + 1)
+
+    def testSustainedRate(self):
+        times = [i * 0.5 for i in range(1200)]
+        self.assertLessEqual(self.allowed(times), 10 + 600 * 0.2 + 1)
+
+    def testSharedBucket(self):
+        self.allowed([0] * 10)
+        bucket = memcache.get(ratelimit.MEMCACHE_RATE_LIMIT_KEY % 'k')
+        self.assertEqual(bucket, (0, 0))
+
+    def testFallback(self):
+        client = memcache.Client
+        memcache.Client = lambda: _Unavailable()
+        try:
+            self.assertEqual(self.allowed([0] * 15, capacity=3), 3)
+        finally:
+            memcache.Client = client
+
+    def testContendedFailsClosed(self):
+        client = memcache.Client
+        memcache.Client = lambda: _Contended()
+        try:
+            self.assertEqual(self.allowed([0] * 3), 0)
+        finally:
+            memcache.Client = client
+
+
+class _Unavailable(object):
+    """Memcache client failing every call, as when memcache is down."""
+
+    def gets(self, key):
+        return None
+
+    def add(self, key, value, time=0):
+        return False
+
+    def cas(self, key, value, time=0):
+        return False
+
+
+class _Contended(_Unavailable):
+    """Memcache client whose bucket is changed by another call every time."""
+
+    def gets(self, key):
+        return (10, 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
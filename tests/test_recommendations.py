@@ -0,0 +1,164 @@
+import collections
+import random
+import unittest
+
+from google.appengine.datastore import datastore_stub_util
+from google.appengine.ext import ndb
+from google.appengine.ext import testbed
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+if numpy:
+    import recommendations
+
+from models import Profile
+from models import RecommendationCounts
+from models import Session
+from models import SessionRecommendations
+
+
+def bruteForce(baskets, k, min_count=1):
+    """Return the top k neighbours of every item, computed pair by pair."""
+    popularity = collections.Counter(x for b in baskets for x in b)
+    together = collections.Counter((x, y) for b in baskets
+                                   for x in b for y in b if x != y)
+    result = {}
+    for x in popularity:
+        sims = [(y, together[x, y] / (popularity[x] * popularity[y]) ** .5)
+                for y in popularity if together[x, y] >= min_count]
+        if sims:
+            result[x] = sorted(sims, key=lambda s: (-s[1], s[0]))[:k]
+    return result
+
+
+@unittest.skipUnless(numpy, 'numpy is not installed')
+class CoOccurrenceTestCase(unittest.TestCase):
+
+    def setUp(self):
+        rnd = random.Random(1)
+        self.baskets = [set('s%02d' % i for i in
+                            rnd.sample(range(30), rnd.randint(0, 8)))
+                        for _ in range(300)]
+
+    def assertNeighbours(self, found, expected):
+        self.assertEqual(sorted(found), sorted(expected))
+        for item, sims in expected.items():
+            self.assertEqual([round(s, 9) for _, s in found[item]],
+                             [round(s, 9) for _, s in sims])
+
+    def build(self, baskets, batch_size, **kwargs):
+        cooc = recommendations.CoOccurrence(**kwargs)
+        for i in range(0, len(baskets), batch_size):
+            cooc.addBatch(baskets[i:i + batch_size])
+        return cooc
+
+    def testTopK(self):
+        cooc = self.build(self.baskets, 37)
+        self.assertNeighbours(cooc.topK(5), bruteForce(self.baskets, 5))
+        self.assertNeighbours(cooc.topK(3, min_count=3),
+                              bruteForce(self.baskets, 3, min_count=3))
+
+    def testPopularity(self):
+        cooc = self.build(self.baskets, 50)
+        popularity = collections.Counter(x for b in self.baskets for x in b)
+        self.assertEqual(
+            {item: cooc.popularity[i] for i, item in enumerate(cooc.items)},
+            dict(popularity))
+
+    def testPartitions(self):
+        merged = {}
+        for part in range(4):
+            cooc = self.build(
+                self.baskets, 64,
+                owns=lambda item: recommendations.partition(item, 4) == part)
+            top = cooc.topK(5)
+            for item in top:
+                self.assertEqual(recommendations.partition(item, 4), part)
+            merged.update(top)
+        self.assertNeighbours(merged, bruteForce(self.baskets, 5))
+
+    def testMaxPairs(self):
+        # Most chunks hold a single basket.
+        cooc = self.build(self.baskets, 100, max_pairs=10)
+        self.assertNeighbours(cooc.topK(5), bruteForce(self.baskets, 5))
+
+    def testEmpty(self):
+        cooc = self.build([set(), set(['s1'])], 10)
+        self.assertEqual(cooc.topK(5), {})
+
+    def testSlices(self):
+        merged = recommendations.CoOccurrence()
+        for i in range(0, len(self.baskets), 70):
+            cooc = self.build(self.baskets[i:i + 70], 20)
+            merged.addPopularity(*cooc.popularityCounts())
+            first = numpy.array([recommendations.partition(item, 2) == 0
+                                 for item in cooc.items], dtype=bool)
+            for part in (first, ~first):
+                merged.addPairCounts(*cooc.pairCounts(part))
+        self.assertNeighbours(merged.topK(5), bruteForce(self.baskets, 5))
+
+
+@unittest.skipUnless(numpy, 'numpy is not installed')
+class BuildTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.testbed = testbed.Testbed()
+        self.testbed.activate()
+        self.testbed.init_datastore_v3_stub(
+            consistency_policy=datastore_stub_util.
+            PseudoRandomHRConsistencyPolicy(probability=1))
+        self.testbed.init_memcache_stub()
+        self.testbed.init_taskqueue_stub()
+        ndb.get_context().set_cache_policy(False)
+        self.sliceSize = recommendations.RECOMMENDATION_SLICE_SIZE
+        recommendations.RECOMMENDATION_SLICE_SIZE = 3
+        # Bound to the app id of the testbed, not the one at import.
+        self.jobKey = recommendations.JOB_KEY
+        recommendations.JOB_KEY = ndb.Key(*self.jobKey.flat())
+
+    def tearDown(self):
+        recommendations.RECOMMENDATION_SLICE_SIZE = self.sliceSize
+        recommendations.JOB_KEY = self.jobKey
+        self.testbed.deactivate()
+
+    def build(self):
+        self.assertTrue(recommendations.startBuild())
+        job = recommendations.JOB_KEY.get()
+        step = 0
+        while recommendations.JOB_KEY.get():
+            recommendations.runStep(job.run, step)
+            step += 1
+        return step
+
+    def testBuild(self):
+        rnd = random.Random(3)
+        wssks = [Session(name=u's%d' % i).put().urlsafe() for i in range(8)]
+        baskets = [set(rnd.sample(wssks, rnd.randint(0, 4)))
+                   for _ in range(10)]
+        for i, basket in enumerate(baskets):
+            Profile(id='u%d' % i, sessionWishlist=list(basket)).put()
+
+        # 4 slices of profiles, then one step per partition.
+        self.assertEqual(self.build(),
+                         4 + recommendations.RECOMMENDATION_PARTITIONS)
+        expected = bruteForce(baskets, recommendations.RECOMMENDATION_TOP_K,
+                              recommendations.RECOMMENDATION_MIN_COUNT)
+        # Fewer sessions than neighbours kept, so the order of equally
+        # similar ones doesn't matter.
+        found = {recs.key.id(): sorted(w for w, _, _ in recs.sessions)
+                 for recs in SessionRecommendations.query()}
+        self.assertEqual(found, {wssk: sorted(w for w, _ in sims)
+                                 for wssk, sims in expected.items()})
+        self.assertEqual(RecommendationCounts.query().count(), 0)
+
+    def testNoProfiles(self):
+        self.assertEqual(self.build(),
+                         1 + recommendations.RECOMMENDATION_PARTITIONS)
+        self.assertEqual(SessionRecommendations.query().count(), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,108 @@
+import unittest
+
+from google.appengine.datastore import datastore_stub_util
+from google.appengine.ext import ndb
+from google.appengine.ext import testbed
+
+import searchindex
+
+from models import Conference
+from models import SearchPosting
+from models import Session
+
+
+class TokenizeTestCase(unittest.TestCase):
+
+    def testTokenize(self):
+        self.assertEqual(searchindex.tokenize(u'The Python-Web Summit, 2026!'),
+                         [u'python', u'web', u'summit', u'2026'])
+        self.assertEqual(searchindex.tokenize(u'a I x'), [])
+        self.assertEqual(searchindex.tokenize(u'Z\xfcrich'), [u'z\xfcrich'])
+        self.assertEqual(len(searchindex.tokenize(u'x' * 100)[0]),
+                         searchindex.MAX_TOKEN_LENGTH)
+
+
+class SearchTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.testbed = testbed.Testbed()
+        self.testbed.activate()
+        self.testbed.init_datastore_v3_stub(
+            consistency_policy=datastore_stub_util.
+            PseudoRandomHRConsistencyPolicy(probability=1))
+        self.testbed.init_memcache_stub()
+        ndb.get_context().set_cache_policy(False)
+
+    def tearDown(self):
+        self.testbed.deactivate()
+
+    def index(self, entity):
+        entity.put()
+        searchindex.indexEntity(entity)
+        return entity
+
+    def titles(self, query, kind=None):
+        hits, _ = searchindex.search(query, kind, limit=100)
+        return [doc.title for doc, _ in hits]
+
+    def testPrefixMatches(self):
+        self.index(Conference(name=u'Python Summit'))
+        self.index(Conference(name=u'Pythonic Ideas'))
+        self.assertEqual(self.titles(u'python'),
+                         [u'Python Summit', u'Pythonic Ideas'])
+        self.assertEqual(sorted(self.titles(u'pyth')),
+                         [u'Python Summit', u'Pythonic Ideas'])
+        hits, _ = searchindex.search(u'python')
+        # An exact match weighs twice as much as a prefix.
+        self.assertEqual([score for _, score in hits], [3, 1.5])
+
+    def testAllTermsMatch(self):
+        self.index(Conference(name=u'Python Summit', topics=[u'Web']))
+        self.index(Conference(name=u'Python Days', topics=[u'Data']))
+        self.index(Session(name=u'Web Summit'))
+        self.assertEqual(self.titles(u'python web'), [u'Python Summit'])
+        self.assertEqual(sorted(self.titles(u'summit')),
+                         [u'Python Summit', u'Web Summit'])
+        self.assertEqual(self.titles(u'summit', 'Session'), [u'Web Summit'])
+        self.assertEqual(self.titles(u'python cobol'), [])
+        self.assertEqual(self.titles(u'the'), [])
+
+    def testReindexOnUpdate(self):
+        conf = self.index(Conference(name=u'Python Summit',
+                                     description=u'All about python'))
+        conf.name = u'Go Summit'
+        conf.description = None
+        searchindex.indexEntity(conf)
+        self.assertEqual(self.titles(u'python'), [])
+        self.assertEqual(self.titles(u'go'), [u'Go Summit'])
+        self.assertEqual(sorted(p.term for p in SearchPosting.query()),
+                         [u'go', u'summit'])
+
+        searchindex.unindexEntity(conf.key)
+        self.assertEqual(self.titles(u'summit'), [])
+        self.assertEqual(SearchPosting.query().count(), 0)
+
+    def testReadsAllPostings(self):
+        batch_size = searchindex.SEARCH_BATCH_SIZE
+        searchindex.SEARCH_BATCH_SIZE = 2
+        try:
+            for i in range(7):
+                self.index(Conference(name=u'Python %d' % i,
+                                      topics=[u'Web'] if i == 6 else []))
+            self.assertEqual(len(self.titles(u'python')), 7)
+            # The only match is found after the first batches.
+            self.assertEqual(self.titles(u'python web'), [u'Python 6'])
+        finally:
+            searchindex.SEARCH_BATCH_SIZE = batch_size
+
+    def testPages(self):
+        for i in range(5):
+            self.index(Session(name=u'Talk %d' % i))
+        hits, next_offset = searchindex.search(u'talk', limit=3)
+        self.assertEqual((len(hits), next_offset), (3, 3))
+        hits, next_offset = searchindex.search(u'talk', offset=3, limit=3)
+        self.assertEqual((len(hits), next_offset), (2, None))
+
+
+if __name__ == '__main__':
+    unittest.main()
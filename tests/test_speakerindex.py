@@ -0,0 +1,184 @@
+import random
+import threading
+import unittest
+
+from google.appengine.datastore import datastore_stub_util
+from google.appengine.ext import ndb
+from google.appengine.ext import testbed
+
+import cachecodec
+import speakerindex
+
+from models import Speaker
+
+
+def matches(speakers, prefix):
+    prefix = speakerindex.normalize(prefix)
+    return {wssk for wssk, (name, _) in speakers.items()
+            if any(key.startswith(prefix)
+                   for key in speakerindex._indexKeys(name))}
+
+
+class PrefixIndexTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.index = speakerindex.PrefixIndex()
+        self.index.load({'a': (u'Ada Lovelace', 3), 'b': (u'Alan Turing', 5),
+                         'c': (u'Grace  HOPPER', 5), 'd': (u'Ada', 1)})
+
+    def testSearchesEveryWord(self):
+        self.assertEqual([s[0] for s in self.index.search(u'ada', 10)],
+                         ['a', 'd'])
+        self.assertEqual(self.index.search(u'love', 10),
+                         [('a', u'Ada Lovelace', 3)])
+        self.assertEqual(self.index.search(u'ada love', 10),
+                         [('a', u'Ada Lovelace', 3)])
+        self.assertEqual(self.index.search(u'  hopper ', 10),
+                         [('c', u'Grace  HOPPER', 5)])
+        self.assertEqual(self.index.search(u'x', 10), [])
+
+    def testMostSessionsFirst(self):
+        self.assertEqual([s[0] for s in self.index.search(u'', 10)],
+                         ['b', 'c', 'a', 'd'])
+        self.assertEqual([s[0] for s in self.index.search(u'', 2)],
+                         ['b', 'c'])
+
+    def testSpeakerFoundOnce(self):
+        self.index.load({'a': (u'Ada Ada', 1)})
+        self.assertEqual(self.index.search(u'ada', 10), [('a', u'Ada Ada', 1)])
+
+    def testUpdate(self):
+        self.index.update({'a': (u'Ada Lovelace', 4), 'e': (u'Edsger', 2)})
+        self.assertEqual(self.index.search(u'ada', 10)[0],
+                         ('a', u'Ada Lovelace', 4))
+        self.assertEqual(self.index.search(u'eds', 10),
+                         [('e', u'Edsger', 2)])
+        self.assertEqual(len(self.index), 5)
+
+    def testUpdateRenames(self):
+        self.index.update({'a': (u'Augusta King', 3)})
+        self.assertEqual([s[0] for s in self.index.search(u'ada', 10)],
+                         ['d'])
+        self.assertEqual(self.index.search(u'king', 10),
+                         [('a', u'Augusta King', 3)])
+
+    def testUpdateIsIdempotent(self):
+        self.index.update({'e': (u'Edsger Dijkstra', 2)})
+        keys = list(self.index._data[0])
+        self.index.update({'e': (u'Edsger Dijkstra', 2)})
+        self.assertEqual(self.index._data[0], keys)
+
+    def testMatchesLinearScan(self):
+        rnd = random.Random(7)
+        words = [u'ada', u'alan', u'grace', u'al', u'lovelace', u'turing']
+        speakers = {}
+        index = speakerindex.PrefixIndex()
+        for i in range(300):
+            wssk = 's%d' % rnd.randrange(60)
+            speakers[wssk] = (u' '.join(rnd.sample(words, rnd.randint(1, 3))),
+                              rnd.randrange(10))
+            index.update({wssk: speakers[wssk]})
+            prefix = rnd.choice(words)[:rnd.randint(0, 3)]
+            self.assertEqual({s[0] for s in index.search(prefix, 1000)},
+                             matches(speakers, prefix))
+        keys = index._data[0]
+        self.assertEqual(keys, sorted(keys))
+
+
+class SuggestTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.testbed = testbed.Testbed()
+        self.testbed.activate()
+        self.testbed.init_datastore_v3_stub(
+            consistency_policy=datastore_stub_util.
+            PseudoRandomHRConsistencyPolicy(probability=1))
+        self.testbed.init_memcache_stub()
+        ndb.get_context().set_cache_policy(False)
+        self.now = 1000.0
+        self.clock = speakerindex._clock
+        speakerindex._clock = lambda: self.now
+        speakerindex._index.load({})
+        speakerindex._state.update(version=None, nextCheck=0, nextReload=0,
+                                   since=None)
+
+    def tearDown(self):
+        speakerindex._clock = self.clock
+        self.testbed.deactivate()
+
+    def names(self, prefix):
+        return [(name, count) for _, name, count in
+                speakerindex.suggest(prefix, 10)]
+
+    def testRefreshesOnVersionChange(self):
+        ada = Speaker(name=u'Ada Lovelace', sessionCount=1)
+        ada.put()
+        self.assertEqual(self.names(u'a'), [(u'Ada Lovelace', 1)])
+
+        ada.sessionCount = 2
+        ada.put()
+        Speaker(name=u'Alan Turing', sessionCount=1).put()
+        # Not seen before the version changes and a check is due.
+        self.assertEqual(self.names(u'a'), [(u'Ada Lovelace', 1)])
+        speakerindex.speakersChanged()
+        self.assertEqual(self.names(u'a'), [(u'Ada Lovelace', 1)])
+
+        self.now += speakerindex.SPEAKER_INDEX_CHECK_INTERVAL
+        self.assertEqual(self.names(u'a'),
+                         [(u'Ada Lovelace', 2), (u'Alan Turing', 1)])
+
+    def testPeriodicReload(self):
+        # The first check starts the version and loads all speakers.
+        self.assertEqual(self.names(u''), [])
+        # Written without bumping the version, as by a lost increment.
+        Speaker(name=u'Grace Hopper', sessionCount=1).put()
+        self.now += speakerindex.SPEAKER_INDEX_CHECK_INTERVAL
+        self.assertEqual(self.names(u''), [])
+
+        self.now += speakerindex.SPEAKER_INDEX_RELOAD
+        self.assertEqual(self.names(u''), [(u'Grace Hopper', 1)])
+
+    def testReloadsFromSnapshot(self):
+        # Alan is only in the snapshot, Grace is updated after it.
+        cachecodec.set(speakerindex.MEMCACHE_SPEAKER_SNAPSHOT_KEY,
+                       (0, {'x': (u'Alan Turing', 3)}))
+        Speaker(name=u'Grace Hopper', sessionCount=1).put()
+        self.assertEqual(self.names(u''),
+                         [(u'Alan Turing', 3), (u'Grace Hopper', 1)])
+
+    def testFirstCallersWaitForLoad(self):
+        started = threading.Event()
+        release = threading.Event()
+
+        def takeSnapshot():
+            started.set()
+            release.wait()
+            return 0, {'x': (u'Alan Turing', 3)}
+
+        take, read = speakerindex.takeSnapshot, speakerindex._readSpeakers
+        speakerindex.takeSnapshot = takeSnapshot
+        speakerindex._readSpeakers = lambda since=None: {}
+        results = []
+        try:
+            first = threading.Thread(
+                target=lambda: results.append(self.names(u'a')))
+            first.start()
+            started.wait()
+            second = threading.Thread(
+                target=lambda: results.append(self.names(u'a')))
+            second.start()
+            second.join(0.1)
+            # Still waiting for the first load.
+            self.assertTrue(second.is_alive())
+            release.set()
+            first.join()
+            second.join()
+        finally:
+            release.set()
+            speakerindex.takeSnapshot = take
+            speakerindex._readSpeakers = read
+        self.assertEqual(results, [[(u'Alan Turing', 3)]] * 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
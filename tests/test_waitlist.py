@@ -0,0 +1,103 @@
+import unittest
+
+from google.appengine.api import users
+from google.appengine.datastore import datastore_stub_util
+from google.appengine.ext import ndb
+from google.appengine.ext import testbed
+
+import conference
+import ratelimit
+
+from models import Conference
+from models import Profile
+from models import WaitlistEntry
+from requests import CONF_GET_REQUEST
+
+
+class WaitlistTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.testbed = testbed.Testbed()
+        self.testbed.activate()
+        self.testbed.init_datastore_v3_stub(
+            consistency_policy=datastore_stub_util.
+            PseudoRandomHRConsistencyPolicy(probability=1))
+        self.testbed.init_memcache_stub()
+        self.testbed.init_taskqueue_stub()
+        self.testbed.init_user_stub()
+        ndb.get_context().set_cache_policy(False)
+
+        self.email = None
+        self.validateUser = conference.validateUser
+        conference.validateUser = ratelimit.validateUser = (
+            lambda: users.User(self.email))
+
+        self.api = conference.ConferenceApi()
+        conf = Conference(name=u'PyCon', maxAttendees=2, seatsAvailable=2)
+        conf.put()
+        self.wsck = conf.key.urlsafe()
+
+    def tearDown(self):
+        conference.validateUser = self.validateUser
+        ratelimit.validateUser = self.validateUser
+        self.testbed.deactivate()
+
+    def call(self, method, email):
+        self.email = email
+        request = CONF_GET_REQUEST.combined_message_class(
+            websafeConferenceKey=self.wsck)
+        return getattr(self.api, method)(request)
+
+    def register(self, email):
+        form = self.call('registerForConference', email)
+        return form.data, form.waitlistPosition
+
+    def position(self, email):
+        return self.call('getWaitlistPosition', email).position
+
+    def attending(self, email):
+        prof = ndb.Key(Profile, email).get()
+        return self.wsck in prof.conferenceKeysToAttend
+
+    def promote(self):
+        conference.ConferenceApi._promoteWaitlist(self.wsck)
+
+    def fill(self, waiting):
+        """Register two users and put the waiting ones on the waitlist."""
+        self.assertEqual(self.register('a@x.org'), (True, None))
+        self.assertEqual(self.register('b@x.org'), (True, None))
+        for i, email in enumerate(waiting):
+            self.assertEqual(self.register(email), (False, i + 1))
+
+    def testDuplicateJoins(self):
+        self.fill(['c@x.org', 'd@x.org'])
+        self.assertEqual(self.register('c@x.org'), (False, 1))
+        self.assertEqual(self.register('d@x.org'), (False, 2))
+        self.assertEqual(WaitlistEntry.query().count(), 2)
+        self.assertEqual(self.position('d@x.org'), 2)
+
+    def testPromotionAfterUnregister(self):
+        self.fill(['c@x.org', 'd@x.org'])
+        self.assertTrue(self.call('unregisterFromConference', 'a@x.org').data)
+        self.promote()
+        self.assertTrue(self.attending('c@x.org'))
+        self.assertFalse(self.attending('d@x.org'))
+        self.assertIsNone(self.position('c@x.org'))
+        self.assertEqual(self.position('d@x.org'), 1)
+        self.assertEqual(self.register('e@x.org'), (False, 2))
+
+    def testFifoPromotion(self):
+        waiting = ['c@x.org', 'd@x.org', 'e@x.org', 'f@x.org']
+        self.fill(waiting)
+        self.call('unregisterFromConference', 'a@x.org')
+        self.call('unregisterFromConference', 'b@x.org')
+        self.promote()
+        self.assertEqual([self.attending(email) for email in waiting],
+                         [True, True, False, False])
+        self.assertEqual([self.position(email) for email in waiting[2:]],
+                         [1, 2])
+        self.assertEqual(ndb.Key(urlsafe=self.wsck).get().seatsAvailable, 0)
+
+
+if __name__ == '__main__':
+    unittest.main()